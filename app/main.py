@@ -1,6 +1,7 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Query
 from fastapi.middleware.cors import CORSMiddleware
 import os
+import threading
 from pathlib import Path
 from app.routers import products, analytics
 from contextlib import asynccontextmanager
@@ -22,6 +23,22 @@ async def lifespan(app: FastAPI):
     loader = get_loader(DATA_DIR)
     loader.preload_data_async()
     
+    # Сводка по товарам, куб спроса и дерево категорий строятся один раз после загрузки
+    def build_aggregates():
+        try:
+            if loader.wait_until_ready(600):
+                snapshot = loader.get_catalog()
+                rollup = snapshot.rollup()
+                print(f"📊 Сводка по товарам построена: {len(rollup)} товаров")
+                cube = snapshot.demand_cube()
+                print(f"📊 Куб спроса построен: {len(cube)} ячеек")
+                tree = snapshot.category_tree()
+                print(f"📊 Дерево категорий построено: {tree.node_count} узлов")
+        except Exception as e:
+            print(f"⚠️ Не удалось построить агрегаты каталога: {e}")
+    
+    threading.Thread(target=build_aggregates, daemon=True).start()
+    
     print("✅ Приложение готово к работе! Демонстрационные данные загружены, реальные данные загружаются в фоне...")
     
     yield
@@ -91,7 +108,8 @@ async def health_check():
         loader = get_loader(DATA_DIR)
         
         # Проверяем, загружены ли данные
-        if loader._cache is None:
+        snapshot = loader.get_snapshot()
+        if not snapshot.ready:
             return {
                 "status": "loading",
                 "message": "Данные загружаются в фоновом режиме",
@@ -100,11 +118,10 @@ async def health_check():
                 "using_mock_data": False
             }
         
-        df = loader._cache
         return {
             "status": "healthy",
             "data_files_loaded": len(loader.get_file_metadata()),
-            "total_products": len(df),
+            "total_products": len(snapshot),
             "cache_ready": True,
             "using_mock_data": loader._using_mock_data,
             "message": "⚠️ Используются демонстрационные данные. Реальные данные загружаются в фоне." if loader._using_mock_data else "✅ Используются реальные данные"
@@ -117,16 +134,28 @@ async def health_check():
 
 
 @app.get("/api/status")
-async def get_status():
-    """Получить статус загрузки данных"""
+async def get_status(
+    wait: float = Query(0, ge=0, le=60, description="Long-poll: ждать готовности данных до N секунд")
+):
+    """
+    Получить статус загрузки данных
+    
+    С параметром wait ответ приходит, как только данные будут готовы
+    (или по истечении wait секунд), без опроса каждые несколько секунд.
+    """
     from app.services.excel_loader import get_loader
     loader = get_loader(DATA_DIR)
+    if wait > 0:
+        await loader.wait_until_ready_async(wait)
+    snapshot = loader.get_snapshot()
     
     return {
-        "cache_ready": loader._cache is not None,
-        "loading": loader._loading,
-        "files_loaded": len(loader.get_file_metadata()) if loader._cache is not None else 0,
-        "total_products": len(loader._cache) if loader._cache is not None else 0,
+        "cache_ready": snapshot.ready,
+        "ready": loader.is_ready(),
+        "loading": loader._loading or loader._background_loading,
+        "files_loaded": len(loader.get_file_metadata()) if snapshot.ready else 0,
+        "total_products": len(snapshot),
+        "catalog_version": snapshot.version,
         "using_mock_data": loader._using_mock_data,
         "message": "⚠️ Используются демонстрационные данные. Реальные данные загружаются в фоне." if loader._using_mock_data else "✅ Используются реальные данные"
     }
@@ -42,6 +42,18 @@ class ProductListResponse(BaseModel):
     total_pages: int
 
 
+class CategoryTreeNode(BaseModel):
+    """Узел дерева категорий с агрегатами"""
+    name: Optional[str] = Field(None, description="Название категории (None - весь каталог)")
+    level: int = Field(..., ge=0, le=4, description="Уровень категории (0 - корень)")
+    path: List[str] = Field(default_factory=list, description="Путь категорий от 1 уровня")
+    row_count: int = Field(..., description="Число строк")
+    product_count: int = Field(..., description="Число разных товаров")
+    favorites_count: int = Field(..., description="Сумма добавлений в избранное")
+    out_of_stock_count: int = Field(..., description="Число товаров без наличия")
+    children: List["CategoryTreeNode"] = Field(default_factory=list, description="Подкатегории")
+
+
 class DemandMetrics(BaseModel):
     """Метрики спроса"""
     product_id: str
@@ -54,6 +66,14 @@ class DemandMetrics(BaseModel):
     rank: Optional[int] = None
 
 
+class GroupTopProducts(BaseModel):
+    """Топ товаров по спросу внутри группы (категории или бренда)"""
+    group: str = Field(..., description="Категория 1 уровня или бренд")
+    total_products: int = Field(..., description="Число товаров группы с учетом фильтров")
+    total_favorites: int = Field(..., description="Сумма добавлений в избранное по группе")
+    products: List[DemandMetrics] = Field(..., description="Лучшие товары группы (rank - место в группе)")
+
+
 class TrendData(BaseModel):
     """Данные тренда"""
     period: str
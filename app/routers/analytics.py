@@ -5,15 +5,57 @@ from datetime import date
 import pandas as pd
 import io
 from app.models import (
-    DemandMetrics, TrendData, TimeSeriesResponse, 
+    DemandMetrics, GroupTopProducts, TrendData, TimeSeriesResponse, 
     OutOfStockProduct, PricingMetricsResponse,
     PriceComparison, PriceComparisonResponse, CompetitorPrice
 )
 from app.services.analytics_service import get_analytics_service
+from app.services.compute import run_compute
+from app.services.result_cache import normalize_value
+from app.services.single_flight import get_single_flight
+from app.services.pricing_rules import get_pricing_rules, reload_pricing_rules
 
 router = APIRouter(prefix="/api/analytics", tags=["analytics"])
 
 
+def _render_export(rows: list, format: str) -> bytes:
+    """Сериализует строки отчета в CSV или Excel (выполняется в пуле export)"""
+    df = pd.DataFrame(rows)
+    if format == "excel":
+        output = io.BytesIO()
+        df.to_excel(output, index=False, engine='openpyxl')
+        return output.getvalue()
+    return df.to_csv(index=False).encode('utf-8')
+
+
+async def _run_export(name: str, params: dict, build) -> bytes:
+    """
+    Выполняет выгрузку в пуле export; одинаковые одновременные выгрузки (те же
+    параметры и версия каталога) ждут одну и получают тот же файл
+    
+    Ключ берет уже опубликованную версию: проверка общего снимка (stat и
+    отображение файла) выполняется в пуле вместе с самой выгрузкой.
+    """
+    loader = get_analytics_service().loader
+    key = ('export', name, normalize_value(params), id(loader), loader.published_version)
+    return await get_single_flight().run(key, lambda: run_compute("export", build))
+
+
+def _export_response(content: bytes, format: str, filename: str) -> Response:
+    """Ответ с файлом выгрузки"""
+    if format == "excel":
+        return StreamingResponse(
+            io.BytesIO(content),
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers={"Content-Disposition": f"attachment; filename={filename}_{date.today()}.xlsx"}
+        )
+    return Response(
+        content=content,
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename={filename}_{date.today()}.csv"}
+    )
+
+
 @router.get("/demand/top", response_model=list[DemandMetrics])
 async def get_top_products_by_demand(
     limit: int = Query(10, ge=1, le=1000, description="Количество товаров в топе"),
@@ -30,7 +72,8 @@ async def get_top_products_by_demand(
     """
     try:
         service = get_analytics_service()
-        top_products = service.get_top_products_by_demand(
+        top_products = await run_compute(
+            "analytics", service.get_top_products_by_demand,
             limit=limit,
             category=category,
             brand=brand,
@@ -38,10 +81,43 @@ async def get_top_products_by_demand(
             period_end=period_end
         )
         return top_products
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении топ товаров: {str(e)}")
 
 
+@router.get("/demand/top-per-group", response_model=list[GroupTopProducts])
+async def get_top_products_per_group(
+    group_by: str = Query("category", pattern="^(category|brand)$", description="Группировка: category или brand"),
+    limit: int = Query(10, ge=1, le=100, description="Количество товаров в каждой группе"),
+    category: Optional[str] = Query(None, description="Фильтр по категории"),
+    brand: Optional[str] = Query(None, description="Фильтр по бренду"),
+    period_start: Optional[date] = Query(None, description="Начало периода"),
+    period_end: Optional[date] = Query(None, description="Конец периода")
+):
+    """
+    Получает топ N товаров по количеству добавлений в избранное в каждой
+    категории 1 уровня или в каждом бренде (за один запрос)
+    """
+    try:
+        service = get_analytics_service()
+        groups = await run_compute(
+            "analytics", service.get_top_products_per_group,
+            group_by=group_by,
+            limit=limit,
+            category=category,
+            brand=brand,
+            period_start=period_start,
+            period_end=period_end
+        )
+        return groups
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении топ товаров по группам: {str(e)}")
+
+
 @router.get("/demand/trends", response_model=list[TrendData])
 async def get_demand_trends(
     category: Optional[str] = Query(None, description="Фильтр по категории"),
@@ -58,12 +134,15 @@ async def get_demand_trends(
     """
     try:
         service = get_analytics_service()
-        trends = service.get_demand_trends(
+        trends = await run_compute(
+            "analytics", service.get_demand_trends,
             category=category,
             brand=brand,
             group_by=group_by
         )
         return trends
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении трендов: {str(e)}")
 
@@ -83,46 +162,51 @@ async def get_out_of_stock_products(
     Товары отсортированы по приоритетности (на основе спроса и длительности отсутствия).
     """
     try:
-        service = get_analytics_service()
-        products = service.get_out_of_stock_with_priority(
-            min_days=min_days,
-            category=category,
-            brand=brand,
-            limit=limit
-        )
-        
-        # Дополнительная фильтрация по периоду (если нужно)
-        if period_start or period_end:
-            # Фильтруем через product_service для доступа к period_start/period_end
-            from app.services.product_service import get_product_service
-            product_service = get_product_service()
-            filtered_products = product_service.get_out_of_stock_products(
+        def compute() -> list[OutOfStockProduct]:
+            service = get_analytics_service()
+            products = service.get_out_of_stock_with_priority(
                 min_days=min_days,
                 category=category,
                 brand=brand,
-                period_start=period_start,
-                period_end=period_end
+                limit=limit
             )
-            # Конвертируем в OutOfStockProduct
-            result = []
-            for p in filtered_products:
-                if p.days_out_of_stock and p.days_out_of_stock >= min_days:
-                    # Рассчитываем приоритетность
-                    priority = min(100, (p.favorites_count / 1000 * 70) + (p.days_out_of_stock / 100 * 30))
-                    result.append(OutOfStockProduct(
-                        product_id=p.id,
-                        product_name=p.name,
-                        brand=p.brand,
-                        category_level_1=p.category_level_1,
-                        last_in_stock=p.last_in_stock or date.today(),
-                        days_out_of_stock=p.days_out_of_stock,
-                        favorites_count=p.favorites_count,
-                        priority_score=priority
-                    ))
-            sorted_result = sorted(result, key=lambda x: x.priority_score, reverse=True)
-            return sorted_result[:limit]
+            
+            # Дополнительная фильтрация по периоду (если нужно)
+            if period_start or period_end:
+                # Фильтруем через product_service для доступа к period_start/period_end
+                from app.services.product_service import get_product_service
+                product_service = get_product_service()
+                filtered_products = product_service.get_out_of_stock_products(
+                    min_days=min_days,
+                    category=category,
+                    brand=brand,
+                    period_start=period_start,
+                    period_end=period_end
+                )
+                # Конвертируем в OutOfStockProduct
+                result = []
+                for p in filtered_products:
+                    if p.days_out_of_stock and p.days_out_of_stock >= min_days:
+                        # Рассчитываем приоритетность
+                        priority = min(100, (p.favorites_count / 1000 * 70) + (p.days_out_of_stock / 100 * 30))
+                        result.append(OutOfStockProduct(
+                            product_id=p.id,
+                            product_name=p.name,
+                            brand=p.brand,
+                            category_level_1=p.category_level_1,
+                            last_in_stock=p.last_in_stock or date.today(),
+                            days_out_of_stock=p.days_out_of_stock,
+                            favorites_count=p.favorites_count,
+                            priority_score=priority
+                        ))
+                sorted_result = sorted(result, key=lambda x: x.priority_score, reverse=True)
+                return sorted_result[:limit]
+            
+            return products[:limit]
         
-        return products[:limit]
+        return await run_compute("analytics", compute)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении товаров без остатков: {str(e)}")
 
@@ -142,7 +226,8 @@ async def get_time_series(
     """
     try:
         service = get_analytics_service()
-        time_series = service.get_time_series(
+        time_series = await run_compute(
+            "analytics", service.get_time_series,
             category=category,
             brand=brand,
             group_by=group_by,
@@ -152,6 +237,8 @@ async def get_time_series(
             data=time_series,
             group_by=group_by
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении временного ряда: {str(e)}")
 
@@ -176,7 +263,8 @@ async def get_pricing_metrics(
     """
     try:
         service = get_analytics_service()
-        metrics = service.get_pricing_metrics(
+        metrics = await run_compute(
+            "analytics", service.get_pricing_metrics,
             category=category,
             brand=brand,
             min_days_out_of_stock=min_days_out_of_stock,
@@ -186,10 +274,37 @@ async def get_pricing_metrics(
             metrics=metrics,
             total=len(metrics)
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении метрик ценообразования: {str(e)}")
 
 
+@router.get("/pricing-rules")
+async def get_pricing_rules_config():
+    """
+    Текущие правила ценообразования: уровни спроса, веса приоритета и рекомендации
+    """
+    # Проверка файла правил (stat, при изменении - чтение и сброс кэша) - в пуле
+    return await run_compute("query", lambda: get_pricing_rules().to_dict())
+
+
+@router.post("/pricing-rules/reload")
+async def reload_pricing_rules_config():
+    """
+    Перечитывает правила ценообразования из файла PRICING_RULES_FILE
+    
+    Кэш результатов сбрасывается: метрики пересчитываются по новым правилам.
+    При ошибке в файле продолжают действовать прежние правила. Остальные воркеры
+    перечитывают файл сами, заметив его изменение при следующем запросе.
+    """
+    try:
+        rules = await run_compute("query", reload_pricing_rules)
+        return rules.to_dict()
+    except (OSError, ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка в правилах ценообразования: {str(e)}")
+
+
 @router.get("/export/demand/top")
 async def export_top_products_by_demand(
     format: str = Query("csv", pattern="^(csv|excel)$", description="Формат экспорта: csv или excel"),
@@ -203,36 +318,61 @@ async def export_top_products_by_demand(
     Экспортирует топ товаров по спросу в CSV или Excel
     """
     try:
-        service = get_analytics_service()
-        top_products = service.get_top_products_by_demand(
-            limit=limit,
-            category=category,
-            brand=brand,
-            period_start=period_start,
-            period_end=period_end
-        )
-        
-        # Конвертируем в DataFrame
-        df = pd.DataFrame([p.dict() for p in top_products])
-        
-        if format == "excel":
-            output = io.BytesIO()
-            df.to_excel(output, index=False, engine='openpyxl')
-            output.seek(0)
-            return StreamingResponse(
-                io.BytesIO(output.read()),
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={"Content-Disposition": f"attachment; filename=top_products_{date.today()}.xlsx"}
+        def build() -> bytes:
+            service = get_analytics_service()
+            top_products = service.get_top_products_by_demand(
+                limit=limit,
+                category=category,
+                brand=brand,
+                period_start=period_start,
+                period_end=period_end
             )
-        else:  # csv
-            output = io.StringIO()
-            df.to_csv(output, index=False)
-            output.seek(0)
-            return Response(
-                content=output.getvalue(),
-                media_type="text/csv; charset=utf-8",
-                headers={"Content-Disposition": f"attachment; filename=top_products_{date.today()}.csv"}
+            return _render_export([p.model_dump() for p in top_products], format)
+        
+        params = dict(format=format, limit=limit, category=category, brand=brand,
+                      period_start=period_start, period_end=period_end)
+        content = await _run_export("top_products", params, build)
+        return _export_response(content, format, "top_products")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при экспорте: {str(e)}")
+
+
+@router.get("/export/demand/top-per-group")
+async def export_top_products_per_group(
+    format: str = Query("csv", pattern="^(csv|excel)$", description="Формат экспорта: csv или excel"),
+    group_by: str = Query("category", pattern="^(category|brand)$", description="Группировка"),
+    limit: int = Query(10, ge=1, le=100, description="Количество товаров в каждой группе"),
+    category: Optional[str] = Query(None, description="Фильтр по категории"),
+    brand: Optional[str] = Query(None, description="Фильтр по бренду"),
+    period_start: Optional[date] = Query(None, description="Начало периода"),
+    period_end: Optional[date] = Query(None, description="Конец периода")
+):
+    """
+    Экспортирует топ товаров по спросу в каждой группе в CSV или Excel
+    (строка на товар с колонкой группы)
+    """
+    try:
+        def build() -> bytes:
+            service = get_analytics_service()
+            groups = service.get_top_products_per_group(
+                group_by=group_by,
+                limit=limit,
+                category=category,
+                brand=brand,
+                period_start=period_start,
+                period_end=period_end
             )
+            rows = [{"group": g.group, **p.model_dump()} for g in groups for p in g.products]
+            return _render_export(rows, format)
+        
+        params = dict(format=format, group_by=group_by, limit=limit, category=category, brand=brand,
+                      period_start=period_start, period_end=period_end)
+        content = await _run_export("top_per_group", params, build)
+        return _export_response(content, format, "top_per_group")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при экспорте: {str(e)}")
 
@@ -248,33 +388,20 @@ async def export_demand_trends(
     Экспортирует тренды спроса в CSV или Excel
     """
     try:
-        service = get_analytics_service()
-        trends = service.get_demand_trends(
-            category=category,
-            brand=brand,
-            group_by=group_by
-        )
-        
-        df = pd.DataFrame([t.dict() for t in trends])
-        
-        if format == "excel":
-            output = io.BytesIO()
-            df.to_excel(output, index=False, engine='openpyxl')
-            output.seek(0)
-            return StreamingResponse(
-                io.BytesIO(output.read()),
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={"Content-Disposition": f"attachment; filename=demand_trends_{date.today()}.xlsx"}
-            )
-        else:
-            output = io.StringIO()
-            df.to_csv(output, index=False)
-            output.seek(0)
-            return Response(
-                content=output.getvalue(),
-                media_type="text/csv; charset=utf-8",
-                headers={"Content-Disposition": f"attachment; filename=demand_trends_{date.today()}.csv"}
+        def build() -> bytes:
+            service = get_analytics_service()
+            trends = service.get_demand_trends(
+                category=category,
+                brand=brand,
+                group_by=group_by
             )
+            return _render_export([t.model_dump() for t in trends], format)
+        
+        params = dict(format=format, category=category, brand=brand, group_by=group_by)
+        content = await _run_export("demand_trends", params, build)
+        return _export_response(content, format, "demand_trends")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при экспорте: {str(e)}")
 
@@ -291,34 +418,21 @@ async def export_time_series(
     Экспортирует временной ряд в CSV или Excel
     """
     try:
-        service = get_analytics_service()
-        time_series = service.get_time_series(
-            category=category,
-            brand=brand,
-            group_by=group_by,
-            period=period
-        )
-        
-        df = pd.DataFrame([ts.dict() for ts in time_series])
-        
-        if format == "excel":
-            output = io.BytesIO()
-            df.to_excel(output, index=False, engine='openpyxl')
-            output.seek(0)
-            return StreamingResponse(
-                io.BytesIO(output.read()),
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={"Content-Disposition": f"attachment; filename=timeseries_{date.today()}.xlsx"}
-            )
-        else:
-            output = io.StringIO()
-            df.to_csv(output, index=False)
-            output.seek(0)
-            return Response(
-                content=output.getvalue(),
-                media_type="text/csv; charset=utf-8",
-                headers={"Content-Disposition": f"attachment; filename=timeseries_{date.today()}.csv"}
+        def build() -> bytes:
+            service = get_analytics_service()
+            time_series = service.get_time_series(
+                category=category,
+                brand=brand,
+                group_by=group_by,
+                period=period
             )
+            return _render_export([ts.model_dump() for ts in time_series], format)
+        
+        params = dict(format=format, category=category, brand=brand, group_by=group_by, period=period)
+        content = await _run_export("timeseries", params, build)
+        return _export_response(content, format, "timeseries")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при экспорте: {str(e)}")
 
@@ -334,33 +448,20 @@ async def export_out_of_stock(
     Экспортирует товары без остатков в CSV или Excel
     """
     try:
-        service = get_analytics_service()
-        products = service.get_out_of_stock_with_priority(
-            min_days=min_days,
-            category=category,
-            brand=brand
-        )
-        
-        df = pd.DataFrame([p.dict() for p in products])
-        
-        if format == "excel":
-            output = io.BytesIO()
-            df.to_excel(output, index=False, engine='openpyxl')
-            output.seek(0)
-            return StreamingResponse(
-                io.BytesIO(output.read()),
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={"Content-Disposition": f"attachment; filename=out_of_stock_{date.today()}.xlsx"}
-            )
-        else:
-            output = io.StringIO()
-            df.to_csv(output, index=False)
-            output.seek(0)
-            return Response(
-                content=output.getvalue(),
-                media_type="text/csv; charset=utf-8",
-                headers={"Content-Disposition": f"attachment; filename=out_of_stock_{date.today()}.csv"}
+        def build() -> bytes:
+            service = get_analytics_service()
+            products = service.get_out_of_stock_with_priority(
+                min_days=min_days,
+                category=category,
+                brand=brand
             )
+            return _render_export([p.model_dump() for p in products], format)
+        
+        params = dict(format=format, min_days=min_days, category=category, brand=brand)
+        content = await _run_export("out_of_stock", params, build)
+        return _export_response(content, format, "out_of_stock")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при экспорте: {str(e)}")
 
@@ -377,34 +478,22 @@ async def export_pricing_metrics(
     Экспортирует метрики ценообразования в CSV или Excel
     """
     try:
-        service = get_analytics_service()
-        metrics = service.get_pricing_metrics(
-            category=category,
-            brand=brand,
-            min_days_out_of_stock=min_days_out_of_stock,
-            limit=limit
-        )
-        
-        df = pd.DataFrame([m.dict() for m in metrics])
-        
-        if format == "excel":
-            output = io.BytesIO()
-            df.to_excel(output, index=False, engine='openpyxl')
-            output.seek(0)
-            return StreamingResponse(
-                io.BytesIO(output.read()),
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={"Content-Disposition": f"attachment; filename=pricing_metrics_{date.today()}.xlsx"}
-            )
-        else:
-            output = io.StringIO()
-            df.to_csv(output, index=False)
-            output.seek(0)
-            return Response(
-                content=output.getvalue(),
-                media_type="text/csv; charset=utf-8",
-                headers={"Content-Disposition": f"attachment; filename=pricing_metrics_{date.today()}.csv"}
+        def build() -> bytes:
+            service = get_analytics_service()
+            metrics = service.get_pricing_metrics(
+                category=category,
+                brand=brand,
+                min_days_out_of_stock=min_days_out_of_stock,
+                limit=limit
             )
+            return _render_export([m.model_dump() for m in metrics], format)
+        
+        params = dict(format=format, category=category, brand=brand,
+                      min_days_out_of_stock=min_days_out_of_stock, limit=limit)
+        content = await _run_export("pricing_metrics", params, build)
+        return _export_response(content, format, "pricing_metrics")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при экспорте: {str(e)}")
 
@@ -424,7 +513,8 @@ async def get_competitor_price_analysis(
     try:
         from typing import Dict
         service = get_analytics_service()
-        comparisons = service.get_competitor_price_analysis(
+        comparisons = await run_compute(
+            "analytics", service.get_competitor_price_analysis,
             category=category,
             brand=brand,
             min_favorites=min_favorites,
@@ -450,6 +540,8 @@ async def get_competitor_price_analysis(
                 "more_expensive_than_competitors": expensive_count
             }
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при анализе цен конкурентов: {str(e)}")
 
@@ -5,6 +5,9 @@ from fastapi import APIRouter, HTTPException, Query, Body
 from typing import Optional, List, Dict, Any
 from pydantic import BaseModel, Field
 from app.services.excel_loader import get_loader
+from app.services.compute import run_compute, get_compute_executor
+from app.services.result_cache import get_result_cache
+from app.services.single_flight import get_single_flight
 import os
 import pandas as pd
 
@@ -65,7 +68,8 @@ async def get_cache_stats():
         DATA_DIR = os.getenv("DATA_DIR", str(Path(__file__).parent.parent.parent / "data"))
         loader = get_loader(DATA_DIR)
         
-        if loader._cache is None:
+        df = loader.get_snapshot().df
+        if df is None:
             return CacheStats(
                 total_products=0,
                 files_loaded=0,
@@ -74,8 +78,7 @@ async def get_cache_stats():
                 file_metadata={}
             )
         
-        df = loader._cache
-        cache_size_mb = df.memory_usage(deep=True).sum() / 1024 / 1024
+        cache_size_mb = await run_compute("query", lambda: df.memory_usage(deep=True).sum() / 1024 / 1024)
         
         return CacheStats(
             total_products=len(df),
@@ -84,6 +87,8 @@ async def get_cache_stats():
             cache_size_mb=round(cache_size_mb, 2),
             file_metadata=loader.get_file_metadata()
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении статистики: {str(e)}")
 
@@ -104,7 +109,8 @@ async def get_cache_products(
         DATA_DIR = os.getenv("DATA_DIR", str(Path(__file__).parent.parent.parent / "data"))
         loader = get_loader(DATA_DIR)
         
-        if loader._cache is None:
+        df = loader.get_snapshot().df
+        if df is None:
             return ProductListResponse(
                 products=[],
                 total=0,
@@ -113,48 +119,50 @@ async def get_cache_products(
                 total_pages=0
             )
         
-        df = loader._cache.copy()
-        
-        # Фильтрация
-        if search:
-            mask = (
-                df['name'].str.contains(search, case=False, na=False) |
-                df['brand'].astype(str).str.contains(search, case=False, na=False)
-            )
-            df = df[mask]
-        
-        if category:
-            df = df[df['category_level_1'] == category]
-        
-        if brand:
-            df = df[df['brand'] == brand]
-        
-        total = len(df)
-        total_pages = (total + page_size - 1) // page_size
-        
-        # Пагинация
-        start_idx = (page - 1) * page_size
-        end_idx = start_idx + page_size
-        df_page = df.iloc[start_idx:end_idx]
-        
-        # Конвертируем в список словарей
-        products = []
-        for _, row in df_page.iterrows():
-            products.append({
-                'id': str(row.get('id', '')),
-                'name': str(row.get('name', '')),
-                'brand': str(row.get('brand', '')) if pd.notna(row.get('brand')) else None,
-                'link': str(row.get('link', '')) if pd.notna(row.get('link')) else None,
-                'category_level_1': str(row.get('category_level_1', '')) if pd.notna(row.get('category_level_1')) else None,
-                'category_level_2': str(row.get('category_level_2', '')) if pd.notna(row.get('category_level_2')) else None,
-                'category_level_3': str(row.get('category_level_3', '')) if pd.notna(row.get('category_level_3')) else None,
-                'category_level_4': str(row.get('category_level_4', '')) if pd.notna(row.get('category_level_4')) else None,
-                'favorites_count': int(row.get('favorites_count', 0)),
-                'last_in_stock': str(row.get('last_in_stock', '')) if pd.notna(row.get('last_in_stock')) else None,
-                'period_start': str(row.get('period_start', '')) if pd.notna(row.get('period_start')) else None,
-                'period_end': str(row.get('period_end', '')) if pd.notna(row.get('period_end')) else None,
-                'days_out_of_stock': int(row.get('days_out_of_stock', 0)) if pd.notna(row.get('days_out_of_stock')) else None,
-            })
+        def page_products(df):
+            # Фильтрация
+            if search:
+                mask = (
+                    df['name'].str.contains(search, case=False, na=False) |
+                    df['brand'].astype(str).str.contains(search, case=False, na=False)
+                )
+                df = df[mask]
+            
+            if category:
+                df = df[df['category_level_1'] == category]
+            
+            if brand:
+                df = df[df['brand'] == brand]
+            
+            total = len(df)
+            total_pages = (total + page_size - 1) // page_size
+            
+            # Пагинация
+            start_idx = (page - 1) * page_size
+            end_idx = start_idx + page_size
+            df_page = df.iloc[start_idx:end_idx]
+            
+            # Конвертируем в список словарей
+            products = []
+            for _, row in df_page.iterrows():
+                products.append({
+                    'id': str(row.get('id', '')),
+                    'name': str(row.get('name', '')),
+                    'brand': str(row.get('brand', '')) if pd.notna(row.get('brand')) else None,
+                    'link': str(row.get('link', '')) if pd.notna(row.get('link')) else None,
+                    'category_level_1': str(row.get('category_level_1', '')) if pd.notna(row.get('category_level_1')) else None,
+                    'category_level_2': str(row.get('category_level_2', '')) if pd.notna(row.get('category_level_2')) else None,
+                    'category_level_3': str(row.get('category_level_3', '')) if pd.notna(row.get('category_level_3')) else None,
+                    'category_level_4': str(row.get('category_level_4', '')) if pd.notna(row.get('category_level_4')) else None,
+                    'favorites_count': int(row.get('favorites_count', 0)),
+                    'last_in_stock': str(row.get('last_in_stock', '')) if pd.notna(row.get('last_in_stock')) else None,
+                    'period_start': str(row.get('period_start', '')) if pd.notna(row.get('period_start')) else None,
+                    'period_end': str(row.get('period_end', '')) if pd.notna(row.get('period_end')) else None,
+                    'days_out_of_stock': int(row.get('days_out_of_stock', 0)) if pd.notna(row.get('days_out_of_stock')) else None,
+                })
+            return products, total, total_pages
+        
+        products, total, total_pages = await run_compute("query", page_products, df)
         
         return ProductListResponse(
             products=products,
@@ -163,6 +171,8 @@ async def get_cache_products(
             page_size=page_size,
             total_pages=total_pages
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении товаров: {str(e)}")
 
@@ -174,27 +184,26 @@ async def add_product(product: ProductItem):
         from app.services.excel_loader import get_loader
         from pathlib import Path
         from datetime import date
-        import hashlib
+        from app.services.product_keys import product_id_for
         
         DATA_DIR = os.getenv("DATA_DIR", str(Path(__file__).parent.parent.parent / "data"))
         loader = get_loader(DATA_DIR)
         
-        if loader._cache is None:
+        if not loader.get_snapshot().ready:
             # Создаем пустой DataFrame если кэш пуст
-            loader._cache = pd.DataFrame(columns=[
+            await run_compute("reload", loader.append_products, pd.DataFrame(columns=[
                 'id', 'name', 'brand', 'link', 'category_level_1', 'category_level_2',
                 'category_level_3', 'category_level_4', 'favorites_count', 'last_in_stock',
                 'period_start', 'period_end', 'days_out_of_stock'
-            ])
+            ]))
         
         # Генерируем ID если не указан
         product_id = product.id
         if not product_id:
-            key = f"{product.name}|{product.brand}|{product.link}"
-            product_id = hashlib.md5(key.encode()).hexdigest()[:16]
+            product_id = product_id_for(product.name, product.brand, product.link)
         
-        # Проверяем, существует ли уже товар с таким ID
-        if product_id in loader._cache['id'].values:
+        # Проверяем, существует ли уже товар с таким ID (по индексу, без сканирования)
+        if len(loader.find_product_positions(product_id)) > 0:
             raise HTTPException(status_code=400, detail=f"Товар с ID {product_id} уже существует")
         
         # Создаем новую строку
@@ -224,13 +233,13 @@ async def add_product(product: ProductItem):
         
         # Добавляем в DataFrame
         new_df = pd.DataFrame([new_row])
-        loader._cache = pd.concat([loader._cache, new_df], ignore_index=True)
+        await run_compute("reload", loader.append_products, new_df)
         
         return {
             "success": True,
             "message": "Товар добавлен в кэш",
             "product_id": product_id,
-            "total_products": len(loader._cache)
+            "total_products": len(loader.get_snapshot())
         }
     except HTTPException:
         raise
@@ -249,47 +258,43 @@ async def update_product(product_id: str, product: ProductItem):
         DATA_DIR = os.getenv("DATA_DIR", str(Path(__file__).parent.parent.parent / "data"))
         loader = get_loader(DATA_DIR)
         
-        if loader._cache is None:
+        if not loader.get_snapshot().ready:
             raise HTTPException(status_code=404, detail="Кэш пуст")
         
-        # Ищем товар
-        mask = loader._cache['id'] == product_id
-        if not mask.any():
-            raise HTTPException(status_code=404, detail=f"Товар с ID {product_id} не найден")
-        
-        # Обновляем данные
-        loader._cache.loc[mask, 'name'] = product.name
+        # Собираем изменения
+        values = {'name': product.name}
         if product.brand is not None:
-            loader._cache.loc[mask, 'brand'] = product.brand
+            values['brand'] = product.brand
         if product.link is not None:
-            loader._cache.loc[mask, 'link'] = product.link
+            values['link'] = product.link
         if product.category_level_1 is not None:
-            loader._cache.loc[mask, 'category_level_1'] = product.category_level_1
+            values['category_level_1'] = product.category_level_1
         if product.category_level_2 is not None:
-            loader._cache.loc[mask, 'category_level_2'] = product.category_level_2
+            values['category_level_2'] = product.category_level_2
         if product.category_level_3 is not None:
-            loader._cache.loc[mask, 'category_level_3'] = product.category_level_3
+            values['category_level_3'] = product.category_level_3
         if product.category_level_4 is not None:
-            loader._cache.loc[mask, 'category_level_4'] = product.category_level_4
-        loader._cache.loc[mask, 'favorites_count'] = product.favorites_count
+            values['category_level_4'] = product.category_level_4
+        values['favorites_count'] = product.favorites_count
         if product.last_in_stock:
-            loader._cache.loc[mask, 'last_in_stock'] = pd.to_datetime(product.last_in_stock).date()
+            values['last_in_stock'] = pd.to_datetime(product.last_in_stock).date()
         if product.period_start:
-            loader._cache.loc[mask, 'period_start'] = pd.to_datetime(product.period_start).date()
+            values['period_start'] = pd.to_datetime(product.period_start).date()
         if product.period_end:
-            loader._cache.loc[mask, 'period_end'] = pd.to_datetime(product.period_end).date()
-        if product.days_out_of_stock is not None:
-            loader._cache.loc[mask, 'days_out_of_stock'] = product.days_out_of_stock
+            values['period_end'] = pd.to_datetime(product.period_end).date()
         
         # Пересчитываем days_out_of_stock если нужно
         if product.days_out_of_stock is None and product.last_in_stock:
-            from datetime import date
             today = date.today()
             last_stock = pd.to_datetime(product.last_in_stock).date()
             delta = today - last_stock
-            loader._cache.loc[mask, 'days_out_of_stock'] = delta.days if delta.days >= 0 else 0
+            values['days_out_of_stock'] = delta.days if delta.days >= 0 else 0
         elif product.days_out_of_stock is not None:
-            loader._cache.loc[mask, 'days_out_of_stock'] = product.days_out_of_stock
+            values['days_out_of_stock'] = product.days_out_of_stock
+        
+        # Изменения публикуются новой версией каталога (текущие читатели их не видят)
+        if await run_compute("reload", loader.update_products, product_id, values) == 0:
+            raise HTTPException(status_code=404, detail=f"Товар с ID {product_id} не найден")
         
         return {
             "success": True,
@@ -312,22 +317,18 @@ async def delete_product(product_id: str):
         DATA_DIR = os.getenv("DATA_DIR", str(Path(__file__).parent.parent.parent / "data"))
         loader = get_loader(DATA_DIR)
         
-        if loader._cache is None:
+        if not loader.get_snapshot().ready:
             raise HTTPException(status_code=404, detail="Кэш пуст")
         
-        # Ищем товар
-        mask = loader._cache['id'] == product_id
-        if not mask.any():
-            raise HTTPException(status_code=404, detail=f"Товар с ID {product_id} не найден")
-        
         # Удаляем товар
-        loader._cache = loader._cache[~mask].reset_index(drop=True)
+        if await run_compute("reload", loader.delete_products, [product_id]) == 0:
+            raise HTTPException(status_code=404, detail=f"Товар с ID {product_id} не найден")
         
         return {
             "success": True,
             "message": "Товар удален из кэша",
             "product_id": product_id,
-            "total_products": len(loader._cache)
+            "total_products": len(loader.get_snapshot())
         }
     except HTTPException:
         raise
@@ -345,19 +346,17 @@ async def delete_products_bulk(product_ids: List[str] = Body(..., embed=True)):
         DATA_DIR = os.getenv("DATA_DIR", str(Path(__file__).parent.parent.parent / "data"))
         loader = get_loader(DATA_DIR)
         
-        if loader._cache is None:
+        if not loader.get_snapshot().ready:
             raise HTTPException(status_code=404, detail="Кэш пуст")
         
         # Удаляем товары
-        mask = loader._cache['id'].isin(product_ids)
-        deleted_count = mask.sum()
-        loader._cache = loader._cache[~mask].reset_index(drop=True)
+        deleted_count = await run_compute("reload", loader.delete_products, product_ids)
         
         return {
             "success": True,
             "message": f"Удалено товаров: {deleted_count}",
             "deleted_count": int(deleted_count),
-            "total_products": len(loader._cache)
+            "total_products": len(loader.get_snapshot())
         }
     except HTTPException:
         raise
@@ -375,14 +374,16 @@ async def clear_cache():
         DATA_DIR = os.getenv("DATA_DIR", str(Path(__file__).parent.parent.parent / "data"))
         loader = get_loader(DATA_DIR)
         
-        total_products = len(loader._cache) if loader._cache is not None else 0
-        loader.clear_cache()
+        total_products = len(loader.get_snapshot())
+        await run_compute("reload", loader.clear_cache)
         
         return {
             "success": True,
             "message": "Кэш очищен",
             "deleted_products": total_products
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при очистке кэша: {str(e)}")
 
@@ -398,13 +399,15 @@ async def reload_cache():
         loader = get_loader(DATA_DIR)
         
         # Перезагружаем данные
-        loader.load_all_data(force_reload=True)
+        await run_compute("reload", loader.load_all_data, force_reload=True)
         
         return {
             "success": True,
             "message": "Кэш перезагружен",
-            "total_products": len(loader._cache) if loader._cache is not None else 0
+            "total_products": len(loader.get_snapshot())
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при перезагрузке кэша: {str(e)}")
 
@@ -419,15 +422,16 @@ async def get_product(product_id: str):
         DATA_DIR = os.getenv("DATA_DIR", str(Path(__file__).parent.parent.parent / "data"))
         loader = get_loader(DATA_DIR)
         
-        if loader._cache is None:
+        snapshot = loader.get_snapshot()
+        if not snapshot.ready:
             raise HTTPException(status_code=404, detail="Кэш пуст")
         
-        # Ищем товар
-        mask = loader._cache['id'] == product_id
-        if not mask.any():
+        # Ищем товар (поиск и чтение строки - в одной версии каталога)
+        positions = await run_compute("query", snapshot.positions, product_id)
+        if len(positions) == 0:
             raise HTTPException(status_code=404, detail=f"Товар с ID {product_id} не найден")
         
-        row = loader._cache[mask].iloc[0]
+        row = snapshot.df.iloc[positions[0]]
         
         return {
             'id': str(row.get('id', '')),
@@ -449,3 +453,39 @@ async def get_product(product_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении товара: {str(e)}")
 
+
+
+@router.get("/compute", response_model=Dict[str, Any])
+async def get_compute_metrics():
+    """
+    Метрики пулов вычислений (query, analytics, export, reload)
+    
+    Для каждого пула: число потоков и мест в очереди, выполняемые и ожидающие задачи,
+    счетчики (в том числе отклоненных при заполненной очереди), время ожидания
+    в очереди и выполнения в миллисекундах (среднее, p50, p95, максимум).
+    """
+    return get_compute_executor().metrics()
+
+
+@router.get("/results", response_model=Dict[str, Any])
+async def get_result_cache_metrics():
+    """
+    Метрики кэша результатов запросов (аналитика, поиск товаров)
+    
+    Число записей и ограничения (записей, TTL в секундах), попадания и промахи,
+    вытесненные, устаревшие по TTL и удаленные при смене версии каталога записи.
+    В single_flight - выполняемые вычисления и число одновременных одинаковых
+    запросов, получивших результат ведущего.
+    """
+    metrics = get_result_cache().metrics()
+    metrics["single_flight"] = get_single_flight().metrics()
+    return metrics
+
+
+@router.delete("/results", response_model=Dict[str, Any])
+async def clear_result_cache():
+    """Очищает кэш результатов запросов (данные каталога не меняются)"""
+    return {
+        "success": True,
+        "deleted_entries": get_result_cache().clear()
+    }
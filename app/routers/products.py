@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Query, HTTPException, Path
 from typing import Optional
 from datetime import date
-from app.models import Product, ProductFilter, ProductListResponse
+from app.models import Product, ProductFilter, ProductListResponse, CategoryTreeNode
 from app.services.product_service import get_product_service
+from app.services.compute import run_compute
 
 router = APIRouter(prefix="/api/products", tags=["products"])
 
@@ -46,7 +47,7 @@ async def search_products(
             out_of_stock_days=out_of_stock_days
         )
         
-        products, total = service.search_products(filters, page=page, page_size=page_size)
+        products, total = await run_compute("query", service.search_products, filters, page=page, page_size=page_size)
         
         total_pages = (total + page_size - 1) // page_size
         
@@ -57,10 +58,52 @@ async def search_products(
             page_size=page_size,
             total_pages=total_pages
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при поиске товаров: {str(e)}")
 
 
+@router.get("/explain")
+async def explain_search(
+    category_level_1: Optional[str] = Query(None, description="Категория 1 уровня"),
+    category_level_2: Optional[str] = Query(None, description="Категория 2 уровня"),
+    category_level_3: Optional[str] = Query(None, description="Категория 3 уровня"),
+    category_level_4: Optional[str] = Query(None, description="Категория 4 уровня"),
+    brand: Optional[str] = Query(None, description="Бренд"),
+    min_favorites_count: Optional[int] = Query(None, ge=0, description="Минимальное количество добавлений в избранное"),
+    period_start: Optional[date] = Query(None, description="Начало периода"),
+    period_end: Optional[date] = Query(None, description="Конец периода"),
+    out_of_stock_days: Optional[int] = Query(None, ge=0, description="Минимальное количество дней отсутствия в наличии")
+):
+    """
+    План выполнения фильтра поиска (для отладки)
+    
+    Возвращает стратегию (scan/index/bitmap), условия в порядке избирательности
+    с оценкой числа строк, а также фактическое число строк и время выполнения.
+    """
+    try:
+        service = get_product_service()
+        
+        filters = ProductFilter(
+            category_level_1=category_level_1,
+            category_level_2=category_level_2,
+            category_level_3=category_level_3,
+            category_level_4=category_level_4,
+            brand=brand,
+            min_favorites_count=min_favorites_count,
+            period_start=period_start,
+            period_end=period_end,
+            out_of_stock_days=out_of_stock_days
+        )
+        
+        return await run_compute("query", service.explain_search, filters)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при построении плана: {str(e)}")
+
+
 @router.get("/{product_id}", response_model=Product)
 async def get_product(product_id: str = Path(..., description="ID товара")):
     """
@@ -68,7 +111,7 @@ async def get_product(product_id: str = Path(..., description="ID товара")
     """
     try:
         service = get_product_service()
-        product = service.get_product_by_id(product_id)
+        product = await run_compute("query", service.get_product_by_id, product_id)
         
         if product is None:
             raise HTTPException(status_code=404, detail="Товар не найден")
@@ -87,12 +130,46 @@ async def get_categories():
     """
     try:
         service = get_product_service()
-        categories = service.get_categories()
+        categories = await run_compute("query", service.get_categories)
         return categories
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении категорий: {str(e)}")
 
 
+@router.get("/categories/tree", response_model=CategoryTreeNode)
+async def get_category_tree(
+    category_level_1: Optional[str] = Query(None, description="Категория 1 уровня (корень поддерева)"),
+    category_level_2: Optional[str] = Query(None, description="Категория 2 уровня"),
+    category_level_3: Optional[str] = Query(None, description="Категория 3 уровня"),
+    depth: Optional[int] = Query(None, ge=0, le=4, description="Глубина поддерева (по умолчанию - все уровни)")
+):
+    """
+    Получает дерево категорий с числом товаров, суммой добавлений в избранное
+    и числом товаров без наличия в каждом узле
+    """
+    try:
+        # Путь - подряд идущие уровни, начиная с 1
+        path = []
+        for level in (category_level_1, category_level_2, category_level_3):
+            if not level:
+                break
+            path.append(level)
+        
+        service = get_product_service()
+        tree = await run_compute("query", service.get_category_tree, path, depth)
+        
+        if tree is None:
+            raise HTTPException(status_code=404, detail="Категория не найдена")
+        
+        return tree
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении дерева категорий: {str(e)}")
+
+
 @router.get("/brands/list", response_model=list[str])
 async def get_brands(
     category: Optional[str] = Query(None, description="Фильтр по категории")
@@ -102,8 +179,10 @@ async def get_brands(
     """
     try:
         service = get_product_service()
-        brands = service.get_brands(category=category)
+        brands = await run_compute("query", service.get_brands, category=category)
         return brands
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении брендов: {str(e)}")
 
@@ -52,7 +52,8 @@ async def handle_telegram_command(command: TelegramCommand):
             DATA_DIR = os.getenv("DATA_DIR", str(Path(__file__).parent.parent.parent / "data"))
             loader = get_loader(DATA_DIR)
             
-            if loader._cache is None:
+            df = loader.get_snapshot().df
+            if df is None:
                 stats_dict = {
                     "total_products": 0,
                     "files_loaded": 0,
@@ -60,9 +61,8 @@ async def handle_telegram_command(command: TelegramCommand):
                     "cache_size_mb": 0.0
                 }
             else:
-                import pandas as pd
-                df = loader._cache
-                cache_size_mb = df.memory_usage(deep=True).sum() / 1024 / 1024
+                from app.services.compute import run_compute
+                cache_size_mb = await run_compute("query", lambda: df.memory_usage(deep=True).sum() / 1024 / 1024)
                 stats_dict = {
                     "total_products": len(df),
                     "files_loaded": len(loader.get_file_metadata()),
@@ -88,8 +88,9 @@ async def handle_telegram_command(command: TelegramCommand):
             DATA_DIR = os.getenv("DATA_DIR", str(Path(__file__).parent.parent.parent / "data"))
             loader = get_loader(DATA_DIR)
             
-            total_products = len(loader._cache) if loader._cache is not None else 0
-            loader.clear_cache()
+            from app.services.compute import run_compute
+            total_products = len(loader.get_snapshot())
+            await run_compute("reload", loader.clear_cache)
             
             return TelegramResponse(
                 success=True,
@@ -105,8 +106,9 @@ async def handle_telegram_command(command: TelegramCommand):
             DATA_DIR = os.getenv("DATA_DIR", str(Path(__file__).parent.parent.parent / "data"))
             loader = get_loader(DATA_DIR)
             
-            loader.load_all_data(force_reload=True)
-            total_products = len(loader._cache) if loader._cache is not None else 0
+            from app.services.compute import run_compute
+            await run_compute("reload", loader.load_all_data, force_reload=True)
+            total_products = len(loader.get_snapshot())
             
             return TelegramResponse(
                 success=True,
@@ -121,7 +123,7 @@ async def handle_telegram_command(command: TelegramCommand):
             
             DATA_DIR = os.getenv("DATA_DIR", str(Path(__file__).parent.parent.parent / "data"))
             loader = get_loader(DATA_DIR)
-            count = len(loader._cache) if loader._cache is not None else 0
+            count = len(loader.get_snapshot())
             
             return TelegramResponse(
                 success=True,
@@ -199,7 +201,7 @@ async def handle_telegram_command(command: TelegramCommand):
             
             DATA_DIR = os.getenv("DATA_DIR", str(Path(__file__).parent.parent.parent / "data"))
             loader = get_loader(DATA_DIR)
-            count = len(loader._cache) if loader._cache is not None else 0
+            count = len(loader.get_snapshot())
             
             products_text = f"""📦 <b>Товары</b>
 
@@ -255,13 +257,13 @@ async def handle_telegram_command(command: TelegramCommand):
             DATA_DIR = os.getenv("DATA_DIR", str(Path(__file__).parent.parent.parent / "data"))
             loader = get_loader(DATA_DIR)
             
-            if loader._cache is None:
+            df = loader.get_snapshot().df
+            if df is None:
                 cache_size_mb = 0.0
                 total_products = 0
             else:
-                import pandas as pd
-                df = loader._cache
-                cache_size_mb = df.memory_usage(deep=True).sum() / 1024 / 1024
+                from app.services.compute import run_compute
+                cache_size_mb = await run_compute("query", lambda: df.memory_usage(deep=True).sum() / 1024 / 1024)
                 total_products = len(df)
             
             cache_text = f"""🗄️ <b>Управление кэшем</b>
@@ -1,16 +1,28 @@
 import pandas as pd
+import numpy as np
 from typing import List, Optional
 import os
 from pathlib import Path
-from datetime import date, timedelta
+from datetime import date
 from app.services.excel_loader import get_loader
+from app.services.enrichment import (
+    has_competitor_prices, read_competitor_prices, competitor_price_matrix, day_to_date
+)
+from app.services.result_cache import cached_result
+from app.services.query_planner import QueryPlanner, analytics_predicates
+from app.services.top_k import top_k, top_k_per_group
+from app.services.pricing_rules import get_pricing_rules
 from app.models import (
-    DemandMetrics, TrendData, TimeSeriesPoint, 
+    DemandMetrics, GroupTopProducts, TrendData, TimeSeriesPoint, 
     OutOfStockProduct, PricingMetric,
     PriceComparison, CompetitorPrice
 )
 
 
+# Каталог с добавленными ценами конкурентов среди производных структур версии
+COMPETITOR_PRICES_KEY = ('competitor_prices',)
+
+
 class AnalyticsService:
     """Сервис для аналитики и метрик"""
     
@@ -22,6 +34,7 @@ class AnalyticsService:
                 data_dir = str(base_dir / data_dir)
         self.loader = get_loader(data_dir)
     
+    @cached_result
     def get_top_products_by_demand(
         self,
         limit: int = 10,
@@ -31,37 +44,17 @@ class AnalyticsService:
         period_end: Optional[date] = None
     ) -> List[DemandMetrics]:
         """Получает топ товаров по количеству добавлений в избранное"""
-        # Используем кэш если доступен
-        if self.loader._cache is not None:
-            df = self.loader._cache
-        else:
-            df = self.loader.load_all_data()
-        
-        # Фильтры
-        if category:
-            df = df[df['category_level_1'] == category]
-        if brand:
-            df = df[df['brand'] == brand]
-        if period_start:
-            df = df[df['period_start'] >= period_start]
-        if period_end:
-            df = df[df['period_end'] <= period_end]
-        
-        # Группируем по товару (ID) и суммируем добавления в избранное
-        grouped = df.groupby('id').agg({
-            'name': 'first',
-            'brand': 'first',
-            'category_level_1': 'first',
-            'favorites_count': 'sum',
-            'period_start': 'min',
-            'period_end': 'max'
-        }).reset_index()
-        
-        # Сортируем по количеству добавлений
-        grouped = grouped.sort_values('favorites_count', ascending=False)
-        
-        # Берем топ N
-        top_products = grouped.head(limit)
+        # Фильтры - через планировщик по индексам текущей версии каталога
+        snapshot = self.loader.get_catalog()
+        subset = QueryPlanner(snapshot).run(
+            analytics_predicates(category, brand, period_start, period_end)).subset()
+        
+        # Суммы по товарам (без фильтров - готовые колонки сводки версии), топ N -
+        # частичным выбором; таблица собирается только для товаров топа
+        rollup = snapshot.rollup()
+        measures = rollup.measures(snapshot.df, subset)
+        top = top_k(measures['favorites_count'], limit)
+        top_products = rollup.select(snapshot.df, subset, measures['products'][top])
         
         # Конвертируем в модели
         result = []
@@ -79,6 +72,78 @@ class AnalyticsService:
         
         return result
     
+    @cached_result
+    def get_top_products_per_group(
+        self,
+        group_by: str = "category",
+        limit: int = 10,
+        category: Optional[str] = None,
+        brand: Optional[str] = None,
+        period_start: Optional[date] = None,
+        period_end: Optional[date] = None
+    ) -> List[GroupTopProducts]:
+        """
+        Получает топ N товаров по спросу в каждой категории 1 уровня или бренде
+        
+        Все группы считаются за один проход: суммы спроса по парам (группа, товар),
+        сортировка по (группа, спрос) и первые N каждой группы. Товар нескольких
+        категорий попадает в каждую со строками этой категории - как в
+        get_top_products_by_demand с фильтром по категории.
+        """
+        column = 'brand' if group_by == "brand" else 'category_level_1'
+        
+        # Фильтры - через планировщик
+        snapshot = self.loader.get_catalog()
+        subset = QueryPlanner(snapshot).run(
+            analytics_predicates(category, brand, period_start, period_end)).subset()
+        
+        # Группа каждой строки - по инвертированному индексу, номера групп по возрастанию названия
+        index = snapshot.inverted_index(column)
+        values = np.asarray(index.values, dtype=object)
+        order = np.argsort(values)
+        ranks = np.empty(len(values), dtype=np.int64)
+        ranks[order] = np.arange(len(values))
+        row_groups = np.where(index.codes >= 0, ranks[index.codes], -1)
+        group_values = values[order]
+        
+        # Суммы по парам (группа, товар), размеры и суммы групп, топ N в каждой группе
+        rollup = snapshot.rollup()
+        measures = rollup.group_measures(snapshot.df, subset, row_groups)
+        groups = measures['groups']
+        favorites = measures['favorites_count']
+        sizes = np.bincount(groups, minlength=len(group_values))
+        totals = np.bincount(groups, weights=favorites, minlength=len(group_values))
+        top = top_k_per_group(groups, favorites, limit)
+        table = rollup.select_groups(snapshot.df, subset, row_groups, groups[top], measures['products'][top])
+        
+        # Конвертируем в модели: группы по возрастанию названия, товары - по месту в группе
+        result = []
+        for code, row in zip(groups[top].tolist(), table.to_dict('records')):
+            if not result or result[-1][0] != code:
+                result.append((code, []))
+            products = result[-1][1]
+            products.append(DemandMetrics(
+                product_id=str(row['id']),
+                product_name=str(row['name']),
+                brand=str(row['brand']) if pd.notna(row['brand']) else None,
+                category_level_1=str(row['category_level_1']) if pd.notna(row['category_level_1']) else None,
+                favorites_count=int(row['favorites_count']),
+                period_start=row['period_start'] if pd.notna(row['period_start']) else None,
+                period_end=row['period_end'] if pd.notna(row['period_end']) else None,
+                rank=len(products) + 1
+            ))
+        
+        return [
+            GroupTopProducts(
+                group=str(group_values[code]),
+                total_products=int(sizes[code]),
+                total_favorites=int(round(totals[code])),
+                products=products
+            )
+            for code, products in result
+        ]
+    
+    @cached_result
     def get_demand_trends(
         self,
         category: Optional[str] = None,
@@ -86,53 +151,34 @@ class AnalyticsService:
         group_by: str = "category"
     ) -> List[TrendData]:
         """Анализирует тренды спроса"""
-        # Используем кэш если доступен
-        if self.loader._cache is not None:
-            df = self.loader._cache
-        else:
-            df = self.loader.load_all_data()
-        
-        # Фильтры
-        if category:
-            df = df[df['category_level_1'] == category]
-        if brand:
-            df = df[df['brand'] == brand]
-        
-        # Группировка
-        if group_by == "category":
-            group_col = 'category_level_1'
-        elif group_by == "brand":
-            group_col = 'brand'
+        # Свертка куба спроса текущей версии каталога (без группировки строк)
+        if group_by in ("category", "brand"):
+            # Категория/бренд x месяц; строки без значения измерения не учитываются
+            table = self.loader.get_catalog().demand_cube().rollup(group_by, 'month', category, brand)
+            table = table[table['group'].notna()]
         else:
-            group_col = 'period_start'
-        
-        # Группируем по периоду и выбранному полю
-        df['period_str'] = df['period_start'].apply(
-            lambda x: x.strftime('%Y-%m') if pd.notna(x) else 'Unknown'
-        )
-        
-        grouped = df.groupby([group_col, 'period_str']).agg({
-            'favorites_count': ['sum', 'count'],
-            'id': 'nunique'
-        }).reset_index()
+            # Дата начала периода (подпись - месяц); строки без даты не учитываются
+            table = self.loader.get_catalog().demand_cube().rollup(None, 'day', category, brand)
+            table = table[table['bucket'].notna()]
         
-        grouped.columns = [group_col, 'period', 'total_favorites', 'count', 'unique_products']
-        grouped['avg_favorites_per_product'] = grouped['total_favorites'] / grouped['unique_products']
+        periods = table['bucket'].dt.strftime('%Y-%m').fillna('Unknown')
         
         # Конвертируем в модели
         result = []
-        for _, row in grouped.iterrows():
+        for period, group, total, unique in zip(periods, table['group'], table['favorites_count'],
+                                                table['unique_products']):
             result.append(TrendData(
-                period=str(row['period']),
-                category=str(row[group_col]) if group_by == "category" and pd.notna(row[group_col]) else None,
-                brand=str(row[group_col]) if group_by == "brand" and pd.notna(row[group_col]) else None,
-                total_favorites=int(row['total_favorites']),
-                unique_products=int(row['unique_products']),
-                avg_favorites_per_product=float(row['avg_favorites_per_product'])
+                period=str(period),
+                category=str(group) if group_by == "category" else None,
+                brand=str(group) if group_by == "brand" else None,
+                total_favorites=int(total),
+                unique_products=int(unique),
+                avg_favorites_per_product=float(total / unique)
             ))
         
         return sorted(result, key=lambda x: x.period)
     
+    @cached_result
     def get_time_series(
         self,
         category: Optional[str] = None,
@@ -141,85 +187,29 @@ class AnalyticsService:
         period: str = "month"
     ) -> List[TimeSeriesPoint]:
         """Получает временной ряд добавлений в избранное"""
-        # Используем кэш если доступен
-        if self.loader._cache is not None:
-            df = self.loader._cache
-        else:
-            df = self.loader.load_all_data()
-        
-        # Фильтры
-        if category:
-            df = df[df['category_level_1'] == category]
-        if brand:
-            df = df[df['brand'] == brand]
-        
-        # Форматируем дату в зависимости от периода
-        if period == "day":
-            df['date_str'] = df['period_start'].apply(
-                lambda x: x.strftime('%Y-%m-%d') if pd.notna(x) else None
-            )
-        elif period == "week":
-            df['date_str'] = df['period_start'].apply(
-                lambda x: (x - timedelta(days=x.weekday())).strftime('%Y-W%W') if pd.notna(x) else None
-            )
-        else:  # month
-            df['date_str'] = df['period_start'].apply(
-                lambda x: x.strftime('%Y-%m') if pd.notna(x) else None
-            )
+        bucket = period if period in ("day", "week") else "month"
+        dimension = group_by if group_by in ("category", "brand") else None
         
-        # Группировка
-        if group_by == "category":
-            group_col = 'category_level_1'
-        elif group_by == "brand":
-            group_col = 'brand'
-        else:
-            group_col = None
-        
-        if group_col:
-            grouped = df.groupby([group_col, 'date_str']).agg({
-                'favorites_count': 'sum'
-            }).reset_index()
-            
-            result = []
-            for _, row in grouped.iterrows():
-                if pd.notna(row['date_str']):
-                    # Парсим дату обратно
-                    if period == "day":
-                        date_val = pd.to_datetime(row['date_str']).date()
-                    elif period == "week":
-                        # Упрощенная обработка недели
-                        date_val = pd.to_datetime(row['date_str'].split('-W')[0] + '-01-01').date()
-                    else:
-                        date_val = pd.to_datetime(row['date_str'] + '-01').date()
-                    
-                    result.append(TimeSeriesPoint(
-                        date=date_val,
-                        value=int(row['favorites_count']),
-                        category=str(row[group_col]) if group_by == "category" and pd.notna(row[group_col]) else None,
-                        brand=str(row[group_col]) if group_by == "brand" and pd.notna(row[group_col]) else None
-                    ))
-        else:
-            grouped = df.groupby('date_str').agg({
-                'favorites_count': 'sum'
-            }).reset_index()
-            
-            result = []
-            for _, row in grouped.iterrows():
-                if pd.notna(row['date_str']):
-                    if period == "day":
-                        date_val = pd.to_datetime(row['date_str']).date()
-                    elif period == "week":
-                        date_val = pd.to_datetime(row['date_str'].split('-W')[0] + '-01-01').date()
-                    else:
-                        date_val = pd.to_datetime(row['date_str'] + '-01').date()
-                    
-                    result.append(TimeSeriesPoint(
-                        date=date_val,
-                        value=int(row['favorites_count'])
-                    ))
+        # Свертка куба спроса: строки без даты или значения измерения не учитываются
+        table = self.loader.get_catalog().demand_cube().rollup(dimension, bucket, category, brand)
+        table = table[table['bucket'].notna()]
+        if dimension:
+            table = table[table['group'].notna()]
+        
+        result = []
+        for start, group, value in zip(table['bucket'], table['group'], table['favorites_count']):
+            # Неделя подписывается 1 января года своего понедельника (упрощенная обработка)
+            date_val = start.date() if bucket != "week" else date(start.year, 1, 1)
+            result.append(TimeSeriesPoint(
+                date=date_val,
+                value=int(value),
+                category=str(group) if dimension == "category" else None,
+                brand=str(group) if dimension == "brand" else None
+            ))
         
         return sorted(result, key=lambda x: x.date)
     
+    @cached_result
     def get_out_of_stock_with_priority(
         self,
         min_days: int = 15,
@@ -228,49 +218,27 @@ class AnalyticsService:
         limit: int = 100
     ) -> List[OutOfStockProduct]:
         """Получает товары, отсутствующие в наличии, с расчетом приоритетности (lazy evaluation)"""
-        # Используем кэш если доступен
-        if self.loader._cache is not None:
-            df = self.loader._cache
-        else:
-            df = self.loader.load_all_data()
-        
-        # Lazy evaluation: сначала фильтруем по дням отсутствия (быстрая операция)
-        df = df[df['days_out_of_stock'] >= min_days]
-        
-        # Дополнительные фильтры (lazy evaluation)
-        if category:
-            df = df[df['category_level_1'] == category]
-        if brand:
-            df = df[df['brand'] == brand]
-        
-        # Lazy evaluation: если данных слишком много, сначала ограничиваем по favorites_count
-        # Это экономит память при группировке
-        if len(df) > limit * 3:
-            # Берем топ товаров по favorites_count для быстрой предварительной фильтрации
-            df = df.nlargest(limit * 3, 'favorites_count')
-        
-        # Группируем по товару и агрегируем данные
-        grouped = df.groupby('id').agg({
-            'name': 'first',
-            'brand': 'first',
-            'category_level_1': 'first',
-            'last_in_stock': 'min',
-            'days_out_of_stock': 'max',
-            'favorites_count': 'sum'
-        }).reset_index()
-        
-        # Рассчитываем приоритетность (0-100)
-        # Приоритет = (спрос * 0.7) + (дни отсутствия * 0.3)
-        max_favorites = grouped['favorites_count'].max() if len(grouped) > 0 else 1
-        max_days = grouped['days_out_of_stock'].max() if len(grouped) > 0 else 1
-        
-        grouped['priority_score'] = (
-            (grouped['favorites_count'] / max_favorites * 70) +
-            (grouped['days_out_of_stock'] / max_days * 30)
-        ).clip(0, 100)
-        
-        # Сортируем по приоритетности и ограничиваем результат (lazy evaluation)
-        grouped = grouped.sort_values('priority_score', ascending=False).head(limit)
+        # Текущая версия каталога (берется один раз на запрос)
+        snapshot = self.loader.get_catalog()
+        df = snapshot.df
+        
+        # Lazy evaluation: дни отсутствия, категория и бренд - через планировщик
+        # (отрезок отсортированного индекса и инвертированные индексы)
+        positions = QueryPlanner(snapshot).run(
+            analytics_predicates(category, brand, min_days=min_days)).positions()
+        
+        # Суммы спроса и максимум дней по всем товарам отобранных строк (без groupby)
+        rollup = snapshot.rollup()
+        measures = rollup.measures(df, positions)
+        
+        # Рассчитываем приоритетность (0-100) с нормировкой по всем товарам выборки
+        # Приоритет = спрос и дни отсутствия с весами правил (по умолчанию 0.7 и 0.3)
+        scores = get_pricing_rules().priority(measures['favorites_count'], measures['days_out_of_stock'])
+        
+        # Топ N частичным выбором; таблица собирается только для товаров топа (lazy evaluation)
+        top = top_k(scores, limit)
+        grouped = rollup.select(df, positions, measures['products'][top])
+        grouped['priority_score'] = scores[top]
         
         # Конвертируем в модели (lazy evaluation - только top N)
         result = []
@@ -288,6 +256,7 @@ class AnalyticsService:
         
         return result
     
+    @cached_result
     def get_pricing_metrics(
         self,
         category: Optional[str] = None,
@@ -301,77 +270,39 @@ class AnalyticsService:
         Lazy evaluation: обрабатывает данные по требованию и возвращает только top N метрик
         для оптимизации памяти и производительности.
         """
-        # Используем кэш если доступен (lazy evaluation)
-        if self.loader._cache is not None:
-            df = self.loader._cache
-        else:
-            df = self.loader.load_all_data()
-        
-        # Фильтры (lazy evaluation - применяются до полной обработки)
-        if category:
-            df = df[df['category_level_1'] == category]
-        if brand:
-            df = df[df['brand'] == brand]
-        
-        # Lazy evaluation: группируем только необходимые колонки
-        grouped = df.groupby('id').agg({
-            'name': 'first',
-            'brand': 'first',
-            'category_level_1': 'first',
-            'favorites_count': 'sum',
-            'days_out_of_stock': 'max'
-        }).reset_index()
-        
-        # Фильтруем по минимальному количеству дней отсутствия
-        grouped = grouped[grouped['days_out_of_stock'] >= min_days_out_of_stock]
-        
-        # Lazy evaluation: если данных слишком много, сначала сортируем и ограничиваем
-        # Это экономит память при расчете квантилей
-        if len(grouped) > limit * 2:
-            # Быстрая предварительная сортировка по favorites_count для экономии памяти
-            grouped = grouped.nlargest(limit * 2, 'favorites_count')
-        
-        # Определяем уровень спроса (lazy evaluation - только для отфильтрованных данных)
-        if len(grouped) > 0:
-            q75 = grouped['favorites_count'].quantile(0.75)
-            q25 = grouped['favorites_count'].quantile(0.25)
-            
-            def get_demand_level(count):
-                if count >= q75:
-                    return "high"
-                elif count >= q25:
-                    return "medium"
-                else:
-                    return "low"
-            
-            grouped['demand_level'] = grouped['favorites_count'].apply(get_demand_level)
-        else:
-            grouped['demand_level'] = "low"
+        # Фильтры (lazy evaluation - применяются до полной обработки) - через планировщик
+        snapshot = self.loader.get_catalog()
+        subset = QueryPlanner(snapshot).run(analytics_predicates(category, brand)).subset()
         
-        # Рассчитываем приоритетность (lazy evaluation)
-        max_favorites = grouped['favorites_count'].max() if len(grouped) > 0 else 1
-        max_days = grouped['days_out_of_stock'].max() if len(grouped) > 0 else 1
+        # Суммы спроса и максимум дней по товарам (без фильтров - готовые колонки сводки)
+        rollup = snapshot.rollup()
+        measures = rollup.measures(snapshot.df, subset)
         
-        grouped['priority_score'] = (
-            (grouped['favorites_count'] / max_favorites * 70) +
-            (grouped['days_out_of_stock'] / max_days * 30)
-        ).clip(0, 100)
-        
-        # Генерируем рекомендации (lazy evaluation)
-        def get_recommendation(row):
-            if row['demand_level'] == "high" and row['days_out_of_stock'] > 30:
-                return "Критично: высокий спрос, товар отсутствует более месяца. Срочное пополнение."
-            elif row['demand_level'] == "high":
-                return "Высокий приоритет: высокий спрос, рекомендуется пополнить в ближайшее время."
-            elif row['days_out_of_stock'] > 60:
-                return "Средний приоритет: товар отсутствует длительное время, рассмотреть пополнение."
-            else:
-                return "Низкий приоритет: мониторинг ситуации."
-        
-        grouped['recommendation'] = grouped.apply(get_recommendation, axis=1)
-        
-        # Сортируем по приоритетности и ограничиваем результат (lazy evaluation)
-        grouped = grouped.sort_values('priority_score', ascending=False).head(limit)
+        # Фильтруем по минимальному количеству дней отсутствия
+        with np.errstate(invalid='ignore'):
+            selected = measures['days_out_of_stock'] >= min_days_out_of_stock
+        products = measures['products'][selected]
+        favorites = measures['favorites_count'][selected]
+        days = measures['days_out_of_stock'][selected]
+        
+        # Уровни спроса, приоритет и рекомендации - по правилам, векторно для всех
+        # отобранных товаров (квантили и нормировка по ним же, результат не зависит от limit)
+        rules = get_pricing_rules()
+        demand_levels, _ = rules.demand_tiers(favorites)
+        scores = rules.priority(favorites, days)
+        recommendations = rules.pricing.apply({
+            'demand_level': demand_levels,
+            'days_out_of_stock': days,
+            'favorites_count': favorites,
+            'priority_score': scores,
+        })
+        
+        # Топ N частичным выбором; таблица собирается только для товаров топа (lazy evaluation)
+        top = top_k(scores, limit)
+        grouped = rollup.select(snapshot.df, subset, products[top])
+        grouped['priority_score'] = scores[top]
+        grouped['demand_level'] = demand_levels[top]
+        grouped['recommendation'] = recommendations[top]
         
         # Конвертируем в модели (lazy evaluation - только top N)
         result = []
@@ -390,6 +321,7 @@ class AnalyticsService:
         
         return result
     
+    @cached_result
     def get_competitor_price_analysis(
         self,
         category: Optional[str] = None,
@@ -402,162 +334,93 @@ class AnalyticsService:
         
         Сравнивает наши цены с ценами конкурентов и предоставляет рекомендации.
         """
-        # Используем кэш если доступен
-        if self.loader._cache is not None:
-            df = self.loader._cache.copy()
-        else:
-            df = self.loader.load_all_data()
-        
-        # Убеждаемся, что колонки our_price и competitor_prices существуют
-        if 'our_price' not in df.columns or 'competitor_prices' not in df.columns:
-            print("Генерирую данные о ценах конкурентов...")
-            df = self.loader._generate_competitor_prices(df)
-        
-        # Фильтры (lazy evaluation)
-        if category:
-            df = df[df['category_level_1'] == category]
-        if brand:
-            df = df[df['brand'] == brand]
-        
-        # Фильтруем по минимальному спросу
-        df = df[df['favorites_count'] >= min_favorites]
-        
-        # Lazy evaluation: если данных слишком много, ограничиваем
-        if len(df) > limit * 2:
-            df = df.nlargest(limit * 2, 'favorites_count')
-        
-        # Группируем по товару
-        # Проверяем наличие колонок перед группировкой
-        agg_dict = {
-            'name': 'first',
-            'brand': 'first',
-            'category_level_1': 'first',
-            'favorites_count': 'sum'
-        }
-        
-        if 'our_price' in df.columns:
-            agg_dict['our_price'] = 'first'
-        if 'competitor_prices' in df.columns:
-            agg_dict['competitor_prices'] = 'first'
-        
-        grouped = df.groupby('id').agg(agg_dict).reset_index()
-        
-        # Определяем уровень спроса
-        if len(grouped) > 0:
-            q75 = grouped['favorites_count'].quantile(0.75)
-            q25 = grouped['favorites_count'].quantile(0.25)
-            
-            def get_demand_level(count):
-                if count >= q75:
-                    return "high"
-                elif count >= q25:
-                    return "medium"
-                else:
-                    return "low"
-            
-            grouped['demand_level'] = grouped['favorites_count'].apply(get_demand_level)
-        else:
-            grouped['demand_level'] = "low"
+        # Текущая версия каталога (берется один раз на запрос)
+        snapshot = self.loader.get_catalog()
+        df = snapshot.df
+        
+        # Фильтры и минимальный спрос - по индексам версии (порядок строк не меняется)
+        positions = QueryPlanner(snapshot).run(
+            analytics_predicates(category, brand, min_favorites=min_favorites)).positions()
+        
+        # Убеждаемся, что в каталоге есть наша цена и матрица цен конкурентов
+        # (загрузчик добавляет их при обогащении; иначе - один раз на версию)
+        if not has_competitor_prices(df):
+            df = snapshot.derived(COMPETITOR_PRICES_KEY,
+                                  lambda: self.loader._generate_competitor_prices(df.copy()))
         
         # Если нет данных после фильтрации, возвращаем пустой список
-        if len(grouped) == 0:
+        if len(positions) == 0:
             return []
         
-        # Обрабатываем цены конкурентов
+        # Сводка по товарам отобранных строк: первая строка каждого ID и сумма спроса
+        # (товары в порядке ID, как у groupby('id'))
+        grouped = snapshot.rollup().aggregate(snapshot.df, positions)
+        ids = grouped['id'].to_numpy()
+        favorites = grouped['favorites_count'].to_numpy(dtype=np.float64)
+        products = df.iloc[grouped['first_row'].to_numpy()]
+        
+        # Статистика по матрице цен конкурентов (товары x конкуренты)
+        competitor_names, prices, updated = read_competitor_prices(products)
+        prices = prices.astype(np.float64)
+        no_prices = np.isnan(prices).all(axis=1)
+        if no_prices.any():
+            generated, _ = competitor_price_matrix(products[no_prices], self.loader._enrichment_seed)
+            prices[no_prices] = generated
+        with np.errstate(invalid='ignore'):
+            avg_prices = np.nanmean(prices, axis=1)
+            min_prices = np.nanmin(prices, axis=1)
+            max_prices = np.nanmax(prices, axis=1)
+        
+        # Наша цена (по умолчанию на 5% выше средней) и разница в процентах
+        our_prices = products['our_price'].to_numpy(dtype=np.float64)
+        our_prices = np.where(np.isnan(our_prices), avg_prices * 1.05, our_prices)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            price_diff = np.where(avg_prices > 0, (our_prices - avg_prices) / avg_prices * 100, 0.0)
+        price_diff = np.round(price_diff, 2)
+        
+        # Уровень спроса по квантилям и приоритет (высокий спрос + большая разница в цене),
+        # рекомендации - по правилам для всех товаров сразу
+        rules = get_pricing_rules()
+        demand_levels, demand_scores = rules.demand_tiers(favorites)
+        priority = demand_scores * 10 + np.abs(price_diff)
+        recommendations = rules.price.apply({
+            'price_diff_percent': price_diff,
+            'demand_level': demand_levels,
+            'favorites_count': favorites,
+        })
+        
+        # Топ по приоритету (при равенстве - по ID) частичным выбором
+        top = top_k(priority, limit)
+        
         result = []
-        for _, row in grouped.iterrows():
-            # Получаем цены конкурентов
-            competitor_prices_dict = row.get('competitor_prices', {})
-            if not isinstance(competitor_prices_dict, dict):
-                # Если competitor_prices не словарь, пытаемся преобразовать или генерируем заново
-                if pd.isna(competitor_prices_dict) or competitor_prices_dict is None:
-                    competitor_prices_dict = {}
-                else:
-                    # Пытаемся преобразовать в словарь, если это строка или другой тип
-                    try:
-                        if isinstance(competitor_prices_dict, str):
-                            import json
-                            competitor_prices_dict = json.loads(competitor_prices_dict)
-                        else:
-                            competitor_prices_dict = {}
-                    except:
-                        competitor_prices_dict = {}
-            
-            competitor_prices_list = []
-            for comp_name, price in competitor_prices_dict.items():
-                competitor_prices_list.append(CompetitorPrice(
-                    competitor_name=comp_name,
-                    price=float(price),
+        for i in top.tolist():
+            row = products.iloc[i]
+            competitor_prices_list = [
+                CompetitorPrice(
+                    competitor_name=name,
+                    price=round(float(prices[i, j]), 2),
                     url=None,
-                    last_updated=date.today()
-                ))
-            
-            if not competitor_prices_list:
-                # Если нет данных о ценах, генерируем их
-                import random
-                competitors = ['Wildberries', 'Яндекс.Маркет', 'AliExpress', 'Amazon', 'eBay']
-                base_price = row.get('our_price', 1000) or 1000
-                for comp in competitors:
-                    variation = random.uniform(-0.2, 0.3)
-                    competitor_prices_list.append(CompetitorPrice(
-                        competitor_name=comp,
-                        price=round(base_price * (1 + variation), 2),
-                        url=None,
-                        last_updated=date.today()
-                    ))
-            
-            # Вычисляем статистику по ценам
-            prices = [cp.price for cp in competitor_prices_list]
-            avg_price = sum(prices) / len(prices) if prices else 0
-            min_price = min(prices) if prices else 0
-            max_price = max(prices) if prices else 0
-            
-            # Наша цена
-            our_price = row.get('our_price')
-            if pd.isna(our_price) or our_price is None:
-                our_price = avg_price * 1.05  # По умолчанию на 5% выше средней
-            
-            # Разница в процентах
-            price_diff_percent = ((our_price - avg_price) / avg_price * 100) if avg_price > 0 else 0
-            
-            # Генерируем рекомендацию
-            if price_diff_percent > 15:
-                recommendation = "⚠️ Наша цена значительно выше конкурентов. Рекомендуется снизить цену для конкурентоспособности."
-            elif price_diff_percent > 5:
-                recommendation = "📊 Наша цена немного выше средней. Можно рассмотреть небольшое снижение."
-            elif price_diff_percent < -15:
-                recommendation = "💰 Наша цена значительно ниже конкурентов. Можно рассмотреть повышение цены."
-            elif price_diff_percent < -5:
-                recommendation = "✅ Наша цена ниже конкурентов. Хорошая позиция для привлечения клиентов."
-            else:
-                recommendation = "✅ Наша цена в среднем диапазоне. Конкурентная позиция."
-            
+                    last_updated=day_to_date(updated[i, j])
+                )
+                for j, name in enumerate(competitor_names) if not np.isnan(prices[i, j])
+            ]
             result.append(PriceComparison(
-                product_id=str(row['id']),
+                product_id=str(ids[i]),
                 product_name=str(row['name']),
                 brand=str(row['brand']) if pd.notna(row['brand']) else None,
                 category_level_1=str(row['category_level_1']) if pd.notna(row['category_level_1']) else None,
-                our_price=float(our_price),
+                our_price=float(our_prices[i]),
                 competitor_prices=competitor_prices_list,
-                avg_competitor_price=round(avg_price, 2),
-                min_competitor_price=round(min_price, 2),
-                max_competitor_price=round(max_price, 2),
-                price_difference_percent=round(price_diff_percent, 2),
-                recommendation=recommendation,
-                favorites_count=int(row['favorites_count']),
-                demand_level=str(row['demand_level'])
+                avg_competitor_price=round(float(avg_prices[i]), 2),
+                min_competitor_price=round(float(min_prices[i]), 2),
+                max_competitor_price=round(float(max_prices[i]), 2),
+                price_difference_percent=float(price_diff[i]),
+                recommendation=str(recommendations[i]),
+                favorites_count=int(favorites[i]),
+                demand_level=str(demand_levels[i])
             ))
         
-        # Сортируем по приоритетности (высокий спрос + большая разница в цене)
-        def get_priority(comp):
-            demand_score = {'high': 3, 'medium': 2, 'low': 1}.get(comp.demand_level, 1)
-            price_diff_abs = abs(comp.price_difference_percent or 0)
-            return demand_score * 10 + price_diff_abs
-        
-        result.sort(key=get_priority, reverse=True)
-        
-        # Ограничиваем результат (lazy evaluation)
-        return result[:limit]
+        return result
 
 
 # Глобальный экземпляр сервиса
@@ -0,0 +1,202 @@
+"""
+Битовые индексы версии каталога
+
+Условие фильтра превращается в упакованный битсет строк (бит на строку, n/8 байт):
+для значения категории, бренда или периода - из позиций инвертированного индекса,
+для порога числовой колонки - из готовых битсетов корзин отсортированного индекса
+и небольшого остатка. Несколько условий объединяются побитовым AND, число строк
+считается по таблице popcount байтов, а позиции декодируются только для
+запрошенной страницы - без массива позиций всей выборки.
+"""
+import threading
+from collections import OrderedDict
+from typing import Hashable, List, Tuple
+
+import numpy as np
+
+from app.services.catalog_index import InvertedIndex, SortedIndex
+
+
+# Число единичных битов в каждом значении байта
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+# Сколько битсетов значений хранит индекс колонки (последние использованные)
+VALUE_BITMAP_CACHE_SIZE = 128
+
+# Число корзин порогового индекса: битсет «ранг >= начала корзины» для каждой
+RANGE_BUCKETS = 32
+
+# До скольких значений условие собирается через OR битсетов значений
+MAX_OR_VALUES = 8
+
+
+def bitmap_size(row_count: int) -> int:
+    """Размер битсета в байтах"""
+    return (row_count + 7) // 8
+
+
+def empty_bitmap(row_count: int) -> np.ndarray:
+    return np.zeros(bitmap_size(row_count), dtype=np.uint8)
+
+
+def full_bitmap(row_count: int) -> np.ndarray:
+    """Битсет всех строк (биты после последней строки - нули)"""
+    return np.packbits(np.ones(row_count, dtype=bool))
+
+
+def set_bits(bitmap: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """Устанавливает биты позиций (на месте) и возвращает битсет"""
+    if len(positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        np.bitwise_or.at(bitmap, positions >> 3, (0x80 >> (positions & 7)).astype(np.uint8))
+    return bitmap
+
+
+def bitmap_from_positions(positions: np.ndarray, row_count: int) -> np.ndarray:
+    """Битсет строк с указанными позициями"""
+    selected = np.zeros(row_count, dtype=bool)
+    selected[positions] = True
+    return np.packbits(selected)
+
+
+def popcount(bitmap: np.ndarray) -> int:
+    """Число установленных битов"""
+    return int(POPCOUNT[bitmap].sum(dtype=np.int64))
+
+
+def decode_range(bitmap: np.ndarray, start: int, stop: int) -> np.ndarray:
+    """
+    Позиции установленных битов с порядковыми номерами [start, stop)
+
+    Нужный участок находится по накопленным popcount байтов, распаковываются
+    только байты страницы.
+    """
+    if stop <= start:
+        return np.empty(0, dtype=np.int64)
+    cumulative = np.cumsum(POPCOUNT[bitmap], dtype=np.int64)
+    total = int(cumulative[-1]) if len(cumulative) else 0
+    if start >= total:
+        return np.empty(0, dtype=np.int64)
+    stop = min(stop, total)
+    first = int(np.searchsorted(cumulative, start, side='right'))
+    last = int(np.searchsorted(cumulative, stop - 1, side='right'))
+    before = int(cumulative[first - 1]) if first > 0 else 0
+    bits = np.flatnonzero(np.unpackbits(bitmap[first:last + 1])) + first * 8
+    return bits[start - before:stop - before].astype(np.int64, copy=False)
+
+
+def decode_all(bitmap: np.ndarray) -> np.ndarray:
+    """Позиции всех установленных битов (по возрастанию)"""
+    return np.flatnonzero(np.unpackbits(bitmap)).astype(np.int64, copy=False)
+
+
+class ValueBitmaps:
+    """Битсеты значений колонки поверх инвертированного индекса"""
+
+    def __init__(self, index: InvertedIndex, cache_size: int = VALUE_BITMAP_CACHE_SIZE):
+        self.index = index
+        self.row_count = len(index)
+        self._cache: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def count_for(self, mask: np.ndarray) -> int:
+        return self.index.count_for(mask)
+
+    def _build(self, groups: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        if len(groups) == 0:
+            return empty_bitmap(self.row_count)
+        if len(groups) == 1:
+            return bitmap_from_positions(self.index.positions_for(mask), self.row_count)
+        if len(groups) <= MAX_OR_VALUES:
+            # OR битсетов отдельных значений (каждый кэшируется)
+            bitmap = empty_bitmap(self.row_count)
+            for group in groups.tolist():
+                single = np.zeros_like(mask)
+                single[group] = True
+                np.bitwise_or(bitmap, self.bitmap(single), out=bitmap)
+            return bitmap
+        # Много значений - одним проходом по кодам строк
+        return np.packbits(mask[self.index.codes])
+
+    def bitmap(self, mask: np.ndarray) -> np.ndarray:
+        """Битсет строк со значениями из маски (только для чтения)"""
+        groups = np.flatnonzero(mask[:-1])
+        key = groups.tobytes()
+        with self._lock:
+            bitmap = self._cache.get(key)
+            if bitmap is not None:
+                self._cache.move_to_end(key)
+                return bitmap
+        bitmap = self._build(groups, mask)
+        bitmap.flags.writeable = False
+        with self._lock:
+            self._cache[key] = bitmap
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return bitmap
+
+
+class RangeBitmaps:
+    """
+    Битсеты порогов колонки поверх отсортированного индекса
+
+    Для начала каждой корзины рангов хранится битсет «ранг >= начала»; битсет
+    произвольного порога - битсет ближайшей корзины выше плюс биты строк между
+    порогом и началом корзины (непрерывный отрезок перестановки).
+    """
+
+    def __init__(self, index: SortedIndex, buckets: int = RANGE_BUCKETS):
+        self.index = index
+        self.row_count = len(index)
+        ranked = len(index.order)
+        self._starts = np.unique(np.linspace(0, ranked, buckets + 1).astype(np.int64))
+        self._suffixes: List[np.ndarray] = [None] * len(self._starts)
+        selected = np.zeros(self.row_count, dtype=bool)
+        stop = ranked
+        for bucket in range(len(self._starts) - 1, -1, -1):
+            start = int(self._starts[bucket])
+            selected[index.order[start:stop]] = True
+            self._suffixes[bucket] = np.packbits(selected)
+            self._suffixes[bucket].flags.writeable = False
+            stop = start
+
+    def count_for(self, bounds: Tuple[int, int]) -> int:
+        return self.index.count_for(bounds)
+
+    def _at_least(self, rank: int) -> np.ndarray:
+        bucket = int(np.searchsorted(self._starts, rank, side='left'))
+        bitmap = self._suffixes[bucket].copy()
+        return set_bits(bitmap, self.index.order[rank:int(self._starts[bucket])])
+
+    def bitmap(self, bounds: Tuple[int, int]) -> np.ndarray:
+        """Битсет строк с рангами [start, stop)"""
+        start, stop = bounds
+        if stop - start <= self.row_count // (8 * RANGE_BUCKETS) + 1:
+            # Узкий диапазон дешевле собрать из позиций
+            bitmap = empty_bitmap(self.row_count)
+            return set_bits(bitmap, self.index.slice(bounds))
+        bitmap = self._at_least(start)
+        if stop < len(self.index.order):
+            np.bitwise_and(bitmap, np.invert(self._at_least(stop)), out=bitmap)
+        return bitmap
+
+
+def filter_bitmap(row_count: int, terms: List[tuple]) -> np.ndarray:
+    """
+    Битсет строк, удовлетворяющих всем условиям (AND)
+
+    terms - список (ValueBitmaps, маска значений) или (RangeBitmaps, отрезок).
+    Условия объединяются от самого избирательного; пустой результат
+    прерывает вычисление.
+    """
+    if not terms:
+        return full_bitmap(row_count)
+    terms = sorted(terms, key=lambda item: item[0].count_for(item[1]))
+    bitmaps, condition = terms[0]
+    result = np.array(bitmaps.bitmap(condition), dtype=np.uint8, copy=True)
+    for bitmaps, condition in terms[1:]:
+        if not result.any():
+            break
+        np.bitwise_and(result, bitmaps.bitmap(condition), out=result)
+    return result
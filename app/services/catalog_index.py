@@ -0,0 +1,217 @@
+"""
+Вторичные индексы версии каталога
+
+Инвертированный индекс колонки хранит для каждого значения отсортированный массив
+позиций строк (CSR) и код значения для каждой строки. Фильтр по нескольким колонкам
+берет позиции самого избирательного условия, а остальные условия проверяет по
+кодам только для этих позиций - без сканирования и копирования всего датафрейма.
+
+Отсортированный индекс числовой колонки или даты хранит перестановку строк по
+возрастанию значения и ранг каждой строки: условие диапазона - это бинарный поиск
+и непрерывный отрезок перестановки, а упорядочить выборку можно по рангам.
+
+Индексы строятся лениво для конкретной версии каталога (см. CatalogSnapshot.derived)
+и после изменения каталога строятся заново для новой версии.
+"""
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# Колонки с инвертированными индексами
+INVERTED_INDEX_COLUMNS = ('category_level_1', 'category_level_2', 'category_level_3',
+                          'category_level_4', 'brand', 'period_start', 'period_end')
+
+# Колонки с отсортированными перестановками (условия диапазона и порядок)
+SORTED_INDEX_COLUMNS = ('favorites_count', 'days_out_of_stock', 'last_in_stock')
+
+
+class InvertedIndex:
+    """Значение колонки -> отсортированные позиции строк"""
+
+    def __init__(self, values: pd.Series):
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        # Код значения каждой строки (-1 - пропуск)
+        self.codes = codes.astype(np.int32, copy=False)
+        self.values: List[Any] = list(uniques)
+        self._groups = {}
+        for group, value in enumerate(self.values):
+            self._groups.setdefault(value, group)
+        self.counts = np.bincount(codes[codes >= 0], minlength=len(self.values))
+        self._offsets = np.zeros(len(self.values) + 1, dtype=np.int64)
+        np.cumsum(self.counts, out=self._offsets[1:])
+        # Стабильная сортировка: внутри значения позиции идут по возрастанию
+        order = np.argsort(codes, kind='stable')
+        self._positions = order[len(order) - int(self._offsets[-1]):]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def group(self, value: Any) -> Optional[int]:
+        """Номер значения в индексе (None, если значения нет)"""
+        try:
+            return self._groups.get(value)
+        except TypeError:
+            return None
+
+    def positions(self, value: Any) -> np.ndarray:
+        """Позиции строк со значением (по возрастанию)"""
+        group = self.group(value)
+        if group is None:
+            return np.empty(0, dtype=np.int64)
+        return self._positions[self._offsets[group]:self._offsets[group + 1]]
+
+    def groups_where(self, predicate: Callable[[Any], bool]) -> np.ndarray:
+        """
+        Маска значений, для которых predicate истинен
+
+        Длина на единицу больше числа значений: последний элемент (False)
+        соответствует коду пропуска -1.
+        """
+        mask = np.zeros(len(self.values) + 1, dtype=bool)
+        for group, value in enumerate(self.values):
+            try:
+                mask[group] = bool(predicate(value))
+            except TypeError:
+                mask[group] = False
+        return mask
+
+    def group_mask(self, value: Any) -> np.ndarray:
+        """Маска значений из одного значения"""
+        mask = np.zeros(len(self.values) + 1, dtype=bool)
+        group = self.group(value)
+        if group is not None:
+            mask[group] = True
+        return mask
+
+    def count_for(self, mask: np.ndarray) -> int:
+        """Число строк со значениями из маски"""
+        return int(self.counts[mask[:-1]].sum())
+
+    def positions_for(self, mask: np.ndarray) -> np.ndarray:
+        """Позиции строк со значениями из маски (по возрастанию)"""
+        groups = np.flatnonzero(mask[:-1])
+        if len(groups) == 1:
+            group = groups[0]
+            return self._positions[self._offsets[group]:self._offsets[group + 1]]
+        parts = [self._positions[self._offsets[g]:self._offsets[g + 1]] for g in groups.tolist()]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts))
+
+    def matches(self, positions: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        """Булев массив: значение строки из positions входит в маску"""
+        return mask[self.codes[positions]]
+
+
+class SortedIndex:
+    """
+    Перестановка строк по возрастанию значения колонки
+
+    Условие диапазона (>=, <=) бинарным поиском превращается в непрерывный
+    отрезок перестановки; ранг строки в перестановке позволяет проверять условие
+    для произвольных позиций и упорядочивать их без полной сортировки.
+    Пропуски в перестановку не входят (ранг -1).
+    """
+
+    def __init__(self, values: pd.Series):
+        self._dates = not pd.api.types.is_numeric_dtype(values)
+        if self._dates:
+            # Даты (date/datetime) сравниваются как наносекунды с начала эпохи
+            stamps = pd.to_datetime(values, errors='coerce')
+            valid = stamps.notna().to_numpy()
+            keys = stamps.to_numpy(dtype='datetime64[ns]').view(np.int64)
+        else:
+            keys = values.to_numpy(dtype=np.float64, na_value=np.nan)
+            valid = ~np.isnan(keys)
+        rows = np.flatnonzero(valid)
+        # Стабильная сортировка: при равных значениях позиции идут по возрастанию
+        self.order = rows[np.argsort(keys[rows], kind='stable')]
+        self.keys = keys[self.order]
+        self.ranks = np.full(len(keys), -1, dtype=np.int64)
+        self.ranks[self.order] = np.arange(len(self.order), dtype=np.int64)
+        self._descending = None
+
+    def __len__(self) -> int:
+        return len(self.ranks)
+
+    def _key(self, value: Any):
+        if self._dates:
+            return pd.Timestamp(value).value
+        return float(value)
+
+    def bounds(self, low: Any = None, high: Any = None) -> Tuple[int, int]:
+        """Отрезок перестановки [start, stop) для low <= значение <= high"""
+        start = 0 if low is None else int(np.searchsorted(self.keys, self._key(low), side='left'))
+        stop = len(self.keys) if high is None else int(np.searchsorted(self.keys, self._key(high), side='right'))
+        return start, max(start, stop)
+
+    def count_for(self, bounds: Tuple[int, int]) -> int:
+        """Число строк в отрезке"""
+        return bounds[1] - bounds[0]
+
+    def slice(self, bounds: Tuple[int, int]) -> np.ndarray:
+        """Позиции строк отрезка в порядке возрастания значения"""
+        return self.order[bounds[0]:bounds[1]]
+
+    def positions_for(self, bounds: Tuple[int, int]) -> np.ndarray:
+        """Позиции строк отрезка (по возрастанию позиций)"""
+        return np.sort(self.slice(bounds))
+
+    def matches(self, positions: np.ndarray, bounds: Tuple[int, int]) -> np.ndarray:
+        """Булев массив: строка из positions попадает в отрезок"""
+        ranks = self.ranks[positions]
+        return (ranks >= bounds[0]) & (ranks < bounds[1])
+
+    def _descending_order(self) -> Tuple[np.ndarray, np.ndarray]:
+        # Порядок по убыванию значения; при равных значениях позиции по возрастанию
+        if self._descending is None:
+            order = self.order[np.argsort(-self.keys, kind='stable')]
+            ranks = np.full(len(self.ranks), -1, dtype=np.int64)
+            ranks[order] = np.arange(len(order), dtype=np.int64)
+            self._descending = (order, ranks)
+        return self._descending
+
+    def sort_positions(self, positions: np.ndarray, descending: bool = False) -> np.ndarray:
+        """
+        Упорядочивает позиции по значению колонки (пропуски - в конце)
+
+        Небольшой набор сортируется по рангам, большой - отбирается проходом
+        по готовой перестановке, без сортировки.
+        """
+        order, ranks = self._descending_order() if descending else (self.order, self.ranks)
+        position_ranks = ranks[positions]
+        missing = positions[position_ranks < 0]
+        if len(positions) * max(1, int(np.log2(len(positions) + 1))) < len(order):
+            present = position_ranks >= 0
+            ordered = positions[present][np.argsort(position_ranks[present])]
+        else:
+            selected = np.zeros(len(ranks), dtype=bool)
+            selected[positions] = True
+            ordered = order[selected[order]]
+        if len(missing):
+            ordered = np.concatenate([ordered, np.sort(missing)])
+        return ordered
+
+
+def filter_positions(row_count: int, predicates: List[tuple]) -> np.ndarray:
+    """
+    Позиции строк, удовлетворяющих всем условиям (по возрастанию)
+
+    predicates - список (InvertedIndex, маска значений) или (SortedIndex, отрезок).
+    Кандидаты берутся из самого избирательного условия, остальные проверяются
+    по кодам или рангам кандидатов и объединяются в одну маску - позиции
+    выбираются один раз.
+    """
+    if not predicates:
+        return np.arange(row_count, dtype=np.int64)
+    predicates = sorted(predicates, key=lambda item: item[0].count_for(item[1]))
+    index, condition = predicates[0]
+    positions = index.positions_for(condition)
+    if len(positions) == 0 or len(predicates) == 1:
+        return positions
+    keep = np.ones(len(positions), dtype=bool)
+    for index, condition in predicates[1:]:
+        keep &= index.matches(positions, condition)
+    return positions[keep]
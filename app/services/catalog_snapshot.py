@@ -0,0 +1,132 @@
+"""
+Версии каталога (RCU)
+
+Каталог публикуется неизменяемыми версиями: читатель один раз берет текущую
+версию и работает с ней весь запрос, не блокируясь на загрузке. Писатель
+собирает новый датафрейм (изменяя только копии затронутых колонок) и атомарно
+подменяет версию. Номер версии растет при каждом изменении содержимого и служит
+ключом для производных кэшей.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.services.id_index import ProductIdIndex
+from app.services.catalog_index import InvertedIndex, SortedIndex, SORTED_INDEX_COLUMNS
+from app.services.bitmap_index import ValueBitmaps, RangeBitmaps
+from app.services.product_rollup import ProductRollup
+from app.services.demand_cube import DemandCube
+from app.services.category_tree import CategoryTree
+
+
+_MISSING = object()
+
+# Ключ сводки по товарам среди производных структур версии
+ROLLUP_KEY = ('rollup',)
+
+
+class CatalogSnapshot:
+    """Неизменяемая версия каталога: номер, датафрейм и лениво построенный индекс ID"""
+
+    def __init__(self, version: int, frame: Optional[pd.DataFrame] = None,
+                 id_index: Optional[ProductIdIndex] = None):
+        self.version = version
+        self._frame = frame
+        self._id_index = id_index
+        self._lock = threading.Lock()
+        # Производные структуры версии (индексы, агрегаты) и замки их построения
+        self._derived: Dict[Hashable, Any] = {}
+        self._derived_locks: Dict[Hashable, threading.Lock] = {}
+
+    def __len__(self) -> int:
+        return len(self._frame) if self._frame is not None else 0
+
+    @property
+    def ready(self) -> bool:
+        """Есть ли в версии данные"""
+        return self._frame is not None
+
+    @property
+    def df(self) -> Optional[pd.DataFrame]:
+        """Каталог одним датафреймом"""
+        return self._frame
+
+    @property
+    def id_index(self) -> Optional[ProductIdIndex]:
+        """Индекс ID -> позиции строк этой версии (строится при первом обращении)"""
+        if self._id_index is None and self._frame is not None:
+            df = self.df
+            with self._lock:
+                if self._id_index is None:
+                    self._id_index = ProductIdIndex(df['id'])
+        return self._id_index
+
+    def built_id_index(self) -> Optional[ProductIdIndex]:
+        """Индекс, если он уже построен (без построения)"""
+        return self._id_index
+
+    def positions(self, product_id: str) -> np.ndarray:
+        """Позиции строк товара в этой версии (пустой массив, если товара нет)"""
+        index = self.id_index
+        if index is None:
+            return np.empty(0, dtype=np.int64)
+        return index.positions(product_id)
+
+    def derived(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """
+        Производная структура этой версии (индекс, агрегат)
+
+        Строится один раз при первом обращении; построение разных структур
+        не блокирует друг друга.
+        """
+        value = self._derived.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            key_lock = self._derived_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            value = self._derived.get(key, _MISSING)
+            if value is _MISSING:
+                value = build()
+                self._derived[key] = value
+        return value
+
+    def built(self, key: Hashable) -> Any:
+        """Производная структура, если она уже построена (иначе None)"""
+        value = self._derived.get(key, _MISSING)
+        return None if value is _MISSING else value
+
+    def seed(self, key: Hashable, value: Any):
+        """Задает производную структуру, посчитанную заранее (например, перенесенную из прошлой версии)"""
+        with self._lock:
+            key_lock = self._derived_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            self._derived[key] = value
+
+    def inverted_index(self, column: str) -> InvertedIndex:
+        """Инвертированный индекс колонки (значение -> позиции строк)"""
+        return self.derived(('inverted', column), lambda: InvertedIndex(self.df[column]))
+
+    def sorted_index(self, column: str) -> SortedIndex:
+        """Отсортированная перестановка строк по колонке (диапазоны и порядок)"""
+        return self.derived(('sorted', column), lambda: SortedIndex(self.df[column]))
+
+    def bitmap_index(self, column: str):
+        """Битсеты условий колонки: пороги для числовых колонок, значения для остальных"""
+        if column in SORTED_INDEX_COLUMNS:
+            return self.derived(('bitmap', column), lambda: RangeBitmaps(self.sorted_index(column)))
+        return self.derived(('bitmap', column), lambda: ValueBitmaps(self.inverted_index(column)))
+
+    def rollup(self) -> ProductRollup:
+        """Сводка по товарам (строка на товар и номера товаров строк)"""
+        return self.derived(ROLLUP_KEY, lambda: ProductRollup(self.df))
+    
+    def demand_cube(self) -> DemandCube:
+        """Куб спроса (категория, бренд, день) для трендов и временных рядов"""
+        return self.derived(('demand_cube',), lambda: DemandCube(self.df))
+    
+    def category_tree(self) -> CategoryTree:
+        """Дерево категорий уровней 1-4 с агрегатами узлов"""
+        return self.derived(('category_tree',), lambda: CategoryTree(self.df))
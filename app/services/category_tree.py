@@ -0,0 +1,145 @@
+"""
+Дерево категорий версии каталога
+
+Категории образуют иерархию из четырех уровней (category_level_1..4). Дерево
+строится один раз на версию каталога. Узел уровня k - путь из k значений категорий,
+и он хранит:
+- число строк и разных товаров;
+- сумму добавлений в избранное;
+- число товаров без наличия (days_out_of_stock >= OUT_OF_STOCK_DAYS);
+- позиции своих строк (отрезок общей перестановки уровня).
+
+Переход к подкатегории - поиск в словаре детей узла. Агрегаты и строки любого
+узла берутся готовыми, без группировки всего каталога. Строка без значения
+уровня k учитывается в узлах уровней до k-1.
+"""
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+CATEGORY_COLUMNS = ('category_level_1', 'category_level_2', 'category_level_3', 'category_level_4')
+
+# С какого числа дней отсутствия товар считается отсутствующим (как в аналитике по умолчанию)
+OUT_OF_STOCK_DAYS = 15
+
+
+def _distinct_counts(nodes: np.ndarray, products: np.ndarray, count: int) -> np.ndarray:
+    """Число разных товаров в каждом узле"""
+    if len(nodes) == 0:
+        return np.zeros(count, dtype=np.int64)
+    span = int(products.max()) + 1
+    pairs = np.unique(nodes * span + products)
+    return np.bincount(pairs // span, minlength=count).astype(np.int64)
+
+
+class CategoryNode:
+    """Узел дерева категорий: путь, агрегаты и позиции строк"""
+
+    def __init__(self, name: Optional[str], level: int, path: tuple, row_count: int,
+                 product_count: int, favorites_count: int, out_of_stock_count: int,
+                 order: np.ndarray, start: int, stop: int):
+        self.name = name
+        self.level = level
+        self.path = path
+        self.row_count = row_count
+        self.product_count = product_count
+        self.favorites_count = favorites_count
+        self.out_of_stock_count = out_of_stock_count
+        self.children: Dict[str, "CategoryNode"] = {}
+        self._order = order
+        self._start = start
+        self._stop = stop
+
+    def positions(self) -> np.ndarray:
+        """Позиции строк узла (по возрастанию)"""
+        return np.sort(self._order[self._start:self._stop])
+
+    def child(self, name: str) -> Optional["CategoryNode"]:
+        return self.children.get(name)
+
+    def to_dict(self, depth: Optional[int] = None) -> dict:
+        """Узел с агрегатами и детьми до глубины depth (None - все уровни)"""
+        children = []
+        if depth is None or depth > 0:
+            next_depth = None if depth is None else depth - 1
+            children = [child.to_dict(next_depth) for child in self.children.values()]
+        return {
+            "name": self.name,
+            "level": self.level,
+            "path": list(self.path),
+            "row_count": self.row_count,
+            "product_count": self.product_count,
+            "favorites_count": self.favorites_count,
+            "out_of_stock_count": self.out_of_stock_count,
+            "children": children,
+        }
+
+
+class CategoryTree:
+    """Дерево категорий уровней 1-4 с агрегатами узлов"""
+
+    def __init__(self, df: pd.DataFrame):
+        row_count = len(df)
+        product_codes, _ = pd.factorize(df['id'])
+        product_codes = product_codes.astype(np.int64)
+        favorites = np.nan_to_num(df['favorites_count'].to_numpy(dtype=np.float64, na_value=0.0))
+        days = df['days_out_of_stock'].to_numpy(dtype=np.float64, na_value=np.nan)
+        with np.errstate(invalid='ignore'):
+            missing = days >= OUT_OF_STOCK_DAYS
+
+        all_rows = np.arange(row_count, dtype=np.int64)
+        self.root = CategoryNode(
+            None, 0, (), row_count,
+            len(np.unique(product_codes)), int(round(favorites.sum())),
+            len(np.unique(product_codes[missing])), all_rows, 0, row_count
+        )
+        self.node_count = 0
+
+        # Строки, у которых определены все уровни до текущего, и их узлы уровня выше
+        rows = all_rows
+        parents: List[CategoryNode] = [self.root]
+        parent_of_row = np.zeros(row_count, dtype=np.int64)
+        for level, column in enumerate(CATEGORY_COLUMNS, start=1):
+            codes, values = pd.factorize(df[column].to_numpy(dtype=object)[rows], sort=True)
+            present = codes >= 0
+            rows, codes, parent_of_row = rows[present], codes[present].astype(np.int64), parent_of_row[present]
+            if len(rows) == 0:
+                break
+            # Узлы уровня упорядочены по родителю, затем по значению категории
+            nodes, inverse = np.unique(parent_of_row * len(values) + codes, return_inverse=True)
+            count = len(nodes)
+            order = np.argsort(inverse, kind='stable')
+            sorted_rows = rows[order]
+            stops = np.cumsum(np.bincount(inverse, minlength=count))
+            starts = stops - np.bincount(inverse, minlength=count)
+            row_counts = stops - starts
+            node_favorites = np.bincount(inverse, weights=favorites[rows], minlength=count)
+            product_counts = _distinct_counts(inverse, product_codes[rows], count)
+            row_missing = missing[rows]
+            out_of_stock = _distinct_counts(inverse[row_missing], product_codes[rows][row_missing], count)
+
+            level_nodes = []
+            for node in range(count):
+                parent = parents[int(nodes[node] // len(values))]
+                name = str(values[int(nodes[node] % len(values))])
+                item = CategoryNode(
+                    name, level, parent.path + (name,), int(row_counts[node]),
+                    int(product_counts[node]), int(round(node_favorites[node])), int(out_of_stock[node]),
+                    sorted_rows, int(starts[node]), int(stops[node])
+                )
+                parent.children[name] = item
+                level_nodes.append(item)
+            self.node_count += count
+            parents = level_nodes
+            parent_of_row = inverse.astype(np.int64)
+
+    def find(self, path: Sequence[str]) -> Optional[CategoryNode]:
+        """Узел по пути категорий (пустой путь - корень)"""
+        node = self.root
+        for name in path:
+            node = node.child(name)
+            if node is None:
+                return None
+        return node
@@ -0,0 +1,209 @@
+"""
+Пулы вычислений для async-маршрутов
+
+Маршруты FastAPI объявлены как async def, а работа с pandas синхронная: выполненная
+прямо в обработчике, она блокирует цикл событий (включая /health). Обработчики
+отдают такую работу в пул своего типа нагрузки и ждут результат через await.
+
+Типы нагрузки разделены, чтобы тяжелые выгрузки не вытесняли быстрые запросы:
+- query - поиск и чтение товаров, справочники;
+- analytics - аналитические расчеты;
+- export - выгрузки CSV/Excel;
+- reload - перезагрузка и изменение каталога.
+
+У каждого пула ограничено число потоков и глубина очереди: при переполнении
+запрос сразу получает 503 вместо неограниченного ожидания.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+
+# Типы нагрузки: (потоков, мест в очереди) по умолчанию
+# Переопределяются через COMPUTE_<ТИП>_WORKERS и COMPUTE_<ТИП>_QUEUE
+WORKLOAD_LIMITS = {
+    'query': (4, 64),
+    'analytics': (2, 16),
+    'export': (1, 4),
+    'reload': (1, 2),
+}
+
+# Число последних замеров для перцентилей времени ожидания и выполнения
+METRIC_SAMPLES = 512
+
+
+class ComputeQueueFull(HTTPException):
+    """Очередь пула заполнена (503 с Retry-After)"""
+
+    def __init__(self, workload: str):
+        super().__init__(
+            status_code=503,
+            detail=f"Сервер занят: очередь задач '{workload}' заполнена, повторите запрос позже",
+            headers={"Retry-After": "1"}
+        )
+        self.workload = workload
+
+
+def _env_limit(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def _percentile_ms(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+
+class WorkloadPool:
+    """Пул потоков одного типа нагрузки с ограниченной очередью и метриками"""
+
+    def __init__(self, name: str, workers: int, queue_size: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"compute-{name}")
+        self._lock = threading.Lock()
+        # Задачи в пуле: ожидают в очереди + выполняются
+        self._pending = 0
+        self._running = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._cancelled = 0
+        self._queue_wait_total = 0.0
+        self._run_time_total = 0.0
+        self._queue_waits = deque(maxlen=METRIC_SAMPLES)
+        self._run_times = deque(maxlen=METRIC_SAMPLES)
+
+    def _admit(self):
+        with self._lock:
+            if self._pending >= self.workers + self.queue_size:
+                self._rejected += 1
+                raise ComputeQueueFull(self.name)
+            self._pending += 1
+            self._submitted += 1
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Выполняет fn(*args, **kwargs) в пуле и возвращает результат"""
+        self._admit()
+        submitted_at = time.perf_counter()
+
+        def task():
+            started_at = time.perf_counter()
+            with self._lock:
+                self._running += 1
+            failed = False
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                finished_at = time.perf_counter()
+                with self._lock:
+                    self._running -= 1
+                    self._pending -= 1
+                    self._completed += 1
+                    self._failed += int(failed)
+                    self._queue_wait_total += started_at - submitted_at
+                    self._run_time_total += finished_at - started_at
+                    self._queue_waits.append(started_at - submitted_at)
+                    self._run_times.append(finished_at - started_at)
+
+        def release_if_cancelled(future):
+            # Запрос отменен (клиент отключился, таймаут), пока задача ждала в очереди:
+            # task() не запустится, поэтому место в очереди освобождается здесь
+            if future.cancelled():
+                with self._lock:
+                    self._pending -= 1
+                    self._cancelled += 1
+
+        try:
+            future = self._executor.submit(task)
+        except RuntimeError:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(release_if_cancelled)
+        return await asyncio.wrap_future(future)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Текущая загрузка пула, время ожидания в очереди и выполнения"""
+        with self._lock:
+            completed = self._completed
+            queue_waits = list(self._queue_waits)
+            run_times = list(self._run_times)
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "submitted": self._submitted,
+                "completed": completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "cancelled": self._cancelled,
+                "queue_wait_ms": {
+                    "avg": round(self._queue_wait_total / completed * 1000, 2) if completed else 0.0,
+                    "p50": _percentile_ms(queue_waits, 0.5),
+                    "p95": _percentile_ms(queue_waits, 0.95),
+                    "max": _percentile_ms(queue_waits, 1.0),
+                },
+                "run_time_ms": {
+                    "avg": round(self._run_time_total / completed * 1000, 2) if completed else 0.0,
+                    "p50": _percentile_ms(run_times, 0.5),
+                    "p95": _percentile_ms(run_times, 0.95),
+                    "max": _percentile_ms(run_times, 1.0),
+                },
+            }
+
+
+class ComputeExecutor:
+    """Набор пулов по типам нагрузки"""
+
+    def __init__(self, limits: Optional[Dict[str, tuple]] = None):
+        self.pools: Dict[str, WorkloadPool] = {}
+        for name, (workers, queue_size) in (limits or WORKLOAD_LIMITS).items():
+            self.pools[name] = WorkloadPool(
+                name,
+                _env_limit(f"COMPUTE_{name.upper()}_WORKERS", workers),
+                _env_limit(f"COMPUTE_{name.upper()}_QUEUE", queue_size)
+            )
+
+    async def run(self, workload: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Выполняет синхронную функцию в пуле указанного типа нагрузки"""
+        pool = self.pools.get(workload)
+        if pool is None:
+            raise ValueError(f"Неизвестный тип нагрузки: {workload}")
+        return await pool.run(fn, *args, **kwargs)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        return {name: pool.metrics() for name, pool in self.pools.items()}
+
+
+# Глобальный экземпляр
+_executor_instance: Optional[ComputeExecutor] = None
+
+
+def get_compute_executor() -> ComputeExecutor:
+    """Получает глобальный набор пулов вычислений (singleton)"""
+    global _executor_instance
+    if _executor_instance is None:
+        _executor_instance = ComputeExecutor()
+    return _executor_instance
+
+
+async def run_compute(workload: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Выполняет fn(*args, **kwargs) в глобальном пуле типа workload"""
+    return await get_compute_executor().run(workload, fn, *args, **kwargs)
@@ -0,0 +1,142 @@
+"""
+Куб спроса версии каталога
+
+Тренды и временные ряды группируют строки по категории или бренду и периоду.
+Куб хранит агрегаты в ячейках (категория, бренд, день начала периода): сумму
+добавлений в избранное, число строк и число разных товаров, а также пары
+(ячейка, товар). Запрос сворачивает ячейки до нужного измерения и корзины
+(день, неделя, месяц). Суммы складываются по ячейкам, а число разных товаров
+считается по парам, поэтому товар из нескольких ячеек учитывается один раз.
+
+Куб строится один раз на версию каталога. Строки датафрейма при этом не меняются,
+и колонки дат для каждой строки не форматируются.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# Корзины периода
+BUCKETS = ('day', 'week', 'month')
+
+
+def _codes(values: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """Номера значений в порядке сортировки (-1 - пропуск) и сами значения"""
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes.astype(np.int64), np.asarray(uniques, dtype=object)
+
+
+def _bucket_starts(days: np.ndarray, bucket: str) -> np.ndarray:
+    """Начало корзины для каждого дня: день, понедельник недели или первое число месяца"""
+    if bucket == 'day':
+        return days
+    if bucket == 'week':
+        # 1970-01-01 - четверг: смещение от понедельника = (дни + 3) mod 7
+        offsets = (days.astype(np.int64) + 3) % 7
+        return days - offsets.astype('timedelta64[D]')
+    return days.astype('datetime64[M]').astype('datetime64[D]')
+
+
+class DemandCube:
+    """Агрегаты спроса по ячейкам (категория, бренд, день) и пары (ячейка, товар)"""
+
+    def __init__(self, df: pd.DataFrame):
+        category_codes, self.categories = _codes(df['category_level_1'])
+        brand_codes, self.brands = _codes(df['brand'])
+        days = pd.to_datetime(df['period_start'], errors='coerce').to_numpy(dtype='datetime64[D]')
+        valid = ~np.isnat(days)
+        self.days = np.unique(days[valid])
+        day_codes = np.full(len(days), -1, dtype=np.int64)
+        day_codes[valid] = np.searchsorted(self.days, days[valid])
+        product_codes, products = pd.factorize(df['id'])
+        self.product_count = max(len(products), 1)
+
+        # Ключ ячейки: номера со сдвигом на 1 (0 - пропуск значения)
+        self._brand_span = len(self.brands) + 1
+        self._day_span = len(self.days) + 1
+        keys = ((category_codes + 1) * self._brand_span + brand_codes + 1) * self._day_span + day_codes + 1
+        cells, inverse = np.unique(keys, return_inverse=True)
+        favorites = df['favorites_count'].to_numpy(dtype=np.float64, na_value=0.0)
+        self.favorites = np.bincount(inverse, weights=np.nan_to_num(favorites),
+                                     minlength=len(cells)).round().astype(np.int64)
+        self.rows = np.bincount(inverse, minlength=len(cells)).astype(np.int64)
+
+        self.cell_days = cells % self._day_span - 1
+        self.cell_brands = cells // self._day_span % self._brand_span - 1
+        self.cell_categories = cells // (self._day_span * self._brand_span) - 1
+
+        # Пары (ячейка, товар) без повторов - для числа разных товаров при свертке
+        pairs = np.unique(inverse * self.product_count + product_codes)
+        self.pair_cells = pairs // self.product_count
+        self.pair_products = pairs % self.product_count
+        self.products = np.bincount(self.pair_cells, minlength=len(cells)).astype(np.int64)
+
+    def __len__(self) -> int:
+        """Число ячеек куба"""
+        return len(self.favorites)
+
+    def _value_code(self, values: np.ndarray, value) -> int:
+        # Номер значения измерения (-2 - значения нет в каталоге)
+        matches = np.flatnonzero(values == value)
+        return int(matches[0]) if len(matches) else -2
+
+    def _selected(self, category: Optional[str], brand: Optional[str]) -> np.ndarray:
+        selected = np.ones(len(self), dtype=bool)
+        if category:
+            selected &= self.cell_categories == self._value_code(self.categories, category)
+        if brand:
+            selected &= self.cell_brands == self._value_code(self.brands, brand)
+        return selected
+
+    def rollup(self, dimension: Optional[str] = None, bucket: str = 'month',
+               category: Optional[str] = None, brand: Optional[str] = None) -> pd.DataFrame:
+        """
+        Свертка куба до (измерение, корзина периода)
+
+        dimension - 'category', 'brand' или None (только период), bucket - 'day',
+        'week' или 'month'. Фильтры category/brand - равенство категории 1 уровня
+        и бренда. Колонки результата: group (значение измерения, None - пропуск),
+        bucket (начало корзины, NaT - нет даты), favorites_count, rows,
+        unique_products. Строки упорядочены по значению измерения, затем по корзине.
+        """
+        if bucket not in BUCKETS:
+            raise ValueError(f"Неизвестная корзина периода: {bucket}")
+        cells = np.flatnonzero(self._selected(category, brand))
+
+        starts, bucket_of_day = np.unique(_bucket_starts(self.days, bucket), return_inverse=True)
+        bucket_of_day = np.r_[-1, bucket_of_day.astype(np.int64)]
+        buckets = bucket_of_day[self.cell_days[cells] + 1]
+        if dimension is None:
+            groups, values = np.full(len(cells), -1, dtype=np.int64), np.empty(0, dtype=object)
+        elif dimension == 'category':
+            groups, values = self.cell_categories[cells], self.categories
+        elif dimension == 'brand':
+            groups, values = self.cell_brands[cells], self.brands
+        else:
+            raise ValueError(f"Неизвестное измерение: {dimension}")
+
+        targets, inverse = np.unique((groups + 1) * (len(starts) + 1) + buckets + 1, return_inverse=True)
+        count = len(targets)
+        target_of_cell = np.full(len(self), -1, dtype=np.int64)
+        target_of_cell[cells] = inverse
+
+        pair_targets = target_of_cell[self.pair_cells]
+        selected_pairs = pair_targets >= 0
+        distinct = np.unique(pair_targets[selected_pairs] * self.product_count + self.pair_products[selected_pairs])
+
+        group_codes = targets // (len(starts) + 1) - 1
+        bucket_codes = targets % (len(starts) + 1) - 1
+        group_values = np.full(count, None, dtype=object)
+        present = group_codes >= 0
+        group_values[present] = values[group_codes[present]]
+        bucket_values = np.full(count, np.datetime64('NaT'), dtype='datetime64[D]')
+        bucket_values[bucket_codes >= 0] = starts[bucket_codes[bucket_codes >= 0]]
+
+        return pd.DataFrame({
+            'group': group_values,
+            'bucket': bucket_values,
+            'favorites_count': np.bincount(inverse, weights=self.favorites[cells], minlength=count).round().astype(np.int64),
+            'rows': np.bincount(inverse, weights=self.rows[cells], minlength=count).round().astype(np.int64),
+            'unique_products': np.bincount(distinct // self.product_count, minlength=count).astype(np.int64),
+        })
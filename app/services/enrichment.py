@@ -0,0 +1,218 @@
+"""
+Синтетическое обогащение каталога
+
+Дополняет каталог данными, которых нет в исходных Excel файлах: даты последнего
+наличия, дни отсутствия, цены конкурентов и товары с высоким спросом. Все шаги
+векторные и используют генератор NumPy с фиксированным зерном, поэтому для
+одинаковых входных данных и зерна результат воспроизводим.
+
+При прогрессивной загрузке каждый файл обогащается отдельно; ключ потока (имя
+файла) добавляется к зерну, чтобы строки разных файлов не получали одинаковые
+случайные значения. Канонический каталог - полная сборка (enrich_catalog по
+всему каталогу, без ключа потока); прогрессивный воспроизводим для того же
+зерна и набора файлов, но со значениями полной сборки не совпадает.
+"""
+import zlib
+from datetime import date, timedelta
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+# Конкуренты, для которых генерируются цены (словарь: номер колонки -> имя)
+COMPETITORS = ('Wildberries', 'Яндекс.Маркет', 'AliExpress', 'Amazon', 'eBay')
+
+# Цены конкурентов хранятся плотной матрицей float32 (товары x конкуренты) в колонках
+# каталога, рядом - дата обновления каждой цены (int32, дни от 1970-01-01)
+COMPETITOR_PRICE_COLUMNS = tuple(f'competitor_price_{i}' for i in range(len(COMPETITORS)))
+COMPETITOR_UPDATED_COLUMNS = tuple(f'competitor_price_updated_{i}' for i in range(len(COMPETITORS)))
+_EPOCH = date(1970, 1, 1)
+
+# Базовая цена по категории первого уровня (остальные категории - DEFAULT_BASE_PRICE)
+CATEGORY_BASE_PRICES = {
+    'ТВ и аудио': 50000,
+    'Малая бытовая техника': 15000,
+    'Красота и здоровье': 2000,
+    'Книги': 500,
+    'Электроника': 30000,
+}
+DEFAULT_BASE_PRICE = 1000
+
+# Зерно по умолчанию и номера шагов (каждый шаг получает свой поток случайных чисел)
+DEFAULT_SEED = 42
+_STEP_STOCK, _STEP_PRICES, _STEP_DEMAND = 1, 2, 3
+
+
+def _rng(seed: int, step: int, stream: Optional[str] = None) -> np.random.Generator:
+    """Генератор шага; stream (например, имя файла) дает отдельный поток с тем же зерном"""
+    entropy = [seed, step]
+    if stream is not None:
+        # crc32, а не hash(): значение не зависит от процесса и PYTHONHASHSEED
+        entropy.append(zlib.crc32(stream.encode('utf-8')))
+    return np.random.default_rng(np.random.SeedSequence(entropy))
+
+
+def _favorites(df: pd.DataFrame) -> np.ndarray:
+    """favorites_count как float64 (пропуски -> 0)"""
+    if 'favorites_count' not in df.columns:
+        return np.zeros(len(df), dtype=np.float64)
+    return pd.to_numeric(df['favorites_count'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+
+
+def _demand_tier(favorites: np.ndarray) -> np.ndarray:
+    """Уровень спроса: 0 - высокий (>10000), 1 - средний (>5000), 2 - низкий"""
+    return np.select([favorites > 10000, favorites > 5000], [0, 1], default=2)
+
+
+def _dates_before(today: date, days: np.ndarray) -> np.ndarray:
+    """Массив объектов date = today - days (объекты создаются на уникальные значения)"""
+    unique_days, codes = np.unique(days, return_inverse=True)
+    dates = np.array([today - timedelta(days=int(d)) for d in unique_days], dtype=object)
+    return dates[codes]
+
+
+def generate_missing_stock(df: pd.DataFrame, seed: int = DEFAULT_SEED,
+                           today: Optional[date] = None, stream: Optional[str] = None) -> pd.DataFrame:
+    """
+    Генерирует last_in_stock для строк без этой информации
+
+    Чем выше спрос, тем чаще дефицит: вероятность дефицита 70/50/30% и его
+    длительность 15-200/15-100/15-60 дней для высокого/среднего/низкого спроса,
+    иначе товар был в наличии 0-14 дней назад.
+    """
+    today = today or date.today()
+    mask = df['last_in_stock'].isna().to_numpy()
+    if not mask.any():
+        return df
+
+    rng = _rng(seed, _STEP_STOCK, stream)
+    tier = _demand_tier(_favorites(df)[mask])
+    deficit_probability = np.array([0.7, 0.5, 0.3])[tier]
+    deficit_max_days = np.array([200, 100, 60])[tier]
+    deficit = rng.random(len(tier)) < deficit_probability
+    days_out = np.where(
+        deficit,
+        rng.integers(15, deficit_max_days + 1),
+        rng.integers(0, 15, size=len(tier))
+    )
+
+    last_in_stock = df['last_in_stock'].to_numpy(dtype=object, copy=True)
+    last_in_stock[mask] = _dates_before(today, days_out)
+    df['last_in_stock'] = last_in_stock
+    return df
+
+
+def calculate_days_out_of_stock(df: pd.DataFrame, today: Optional[date] = None) -> pd.DataFrame:
+    """Дни с last_in_stock до сегодня (не меньше 0, пропуск если даты нет)"""
+    today = today or date.today()
+    codes, unique_dates = pd.factorize(df['last_in_stock'], use_na_sentinel=True)
+    unique_days = np.array([max((today - d).days, 0) for d in unique_dates], dtype=np.int64)
+    if (codes >= 0).all():
+        df['days_out_of_stock'] = unique_days[codes]
+    else:
+        days = np.full(len(codes), np.nan)
+        present = codes >= 0
+        days[present] = unique_days[codes[present]]
+        df['days_out_of_stock'] = days
+    return df
+
+
+def competitor_price_matrix(df: pd.DataFrame, seed: int = DEFAULT_SEED, stream: Optional[str] = None):
+    """
+    Цены конкурентов и наша цена
+
+    Базовая цена зависит от категории и растет на 20%/10% для высокого/среднего
+    спроса; цены конкурентов отклоняются от нее на -20%..+30%, наша - на -5%..+15%.
+    Возвращает (матрица цен строки x конкуренты, наша цена).
+    """
+    rng = _rng(seed, _STEP_PRICES, stream)
+    if 'category_level_1' in df.columns:
+        base_price = df['category_level_1'].map(CATEGORY_BASE_PRICES).fillna(DEFAULT_BASE_PRICE)
+        base_price = base_price.to_numpy(dtype=np.float64)
+    else:
+        base_price = np.full(len(df), float(DEFAULT_BASE_PRICE))
+    base_price = base_price * np.array([1.2, 1.1, 1.0])[_demand_tier(_favorites(df))]
+
+    variation = rng.uniform(-0.2, 0.3, size=(len(df), len(COMPETITORS)))
+    competitor_prices = np.round(base_price[:, None] * (1 + variation), 2)
+    our_price = np.round(base_price * rng.uniform(0.95, 1.15, size=len(df)), 2)
+    return competitor_prices, our_price
+
+
+def generate_competitor_prices(df: pd.DataFrame, seed: int = DEFAULT_SEED,
+                               today: Optional[date] = None, stream: Optional[str] = None) -> pd.DataFrame:
+    """Добавляет our_price и матрицу цен конкурентов с датами обновления"""
+    today = today or date.today()
+    competitor_prices, our_price = competitor_price_matrix(df, seed, stream)
+    df['our_price'] = our_price
+    updated_day = np.int32((today - _EPOCH).days)
+    for i, (price_col, updated_col) in enumerate(zip(COMPETITOR_PRICE_COLUMNS, COMPETITOR_UPDATED_COLUMNS)):
+        df[price_col] = competitor_prices[:, i].astype(np.float32)
+        df[updated_col] = np.full(len(df), updated_day, dtype=np.int32)
+    return df
+
+
+def has_competitor_prices(df: pd.DataFrame) -> bool:
+    """Есть ли в каталоге наша цена и матрица цен конкурентов"""
+    return 'our_price' in df.columns and all(col in df.columns for col in COMPETITOR_PRICE_COLUMNS)
+
+
+def read_competitor_prices(df: pd.DataFrame):
+    """
+    Матрица цен конкурентов каталога
+
+    Возвращает (имена конкурентов, цены float32 товары x конкуренты,
+    даты обновления int32 в днях от 1970-01-01).
+    """
+    prices = df[list(COMPETITOR_PRICE_COLUMNS)].to_numpy(dtype=np.float32)
+    if all(col in df.columns for col in COMPETITOR_UPDATED_COLUMNS):
+        updated = df[list(COMPETITOR_UPDATED_COLUMNS)].to_numpy(dtype=np.int32)
+    else:
+        updated = np.full(prices.shape, (date.today() - _EPOCH).days, dtype=np.int32)
+    return COMPETITORS, prices, updated
+
+
+def day_to_date(day: int) -> date:
+    """Дата по номеру дня от 1970-01-01"""
+    return _EPOCH + timedelta(days=int(day))
+
+
+def ensure_high_demand_products(df: pd.DataFrame, seed: int = DEFAULT_SEED) -> pd.DataFrame:
+    """
+    Гарантирует наличие товаров с favorites_count >= 5000 для тестирования workflow
+
+    Если таких товаров нет, топ 10% (минимум 50) по спросу получают
+    favorites_count: 30% - 10000-50000, 40% - 5000-10000, 30% - 10000-30000.
+    """
+    favorites = _favorites(df)
+    high_demand_count = int((favorites >= 5000).sum())
+    if high_demand_count > 0:
+        print(f"✓ Найдено {high_demand_count} товаров с favorites_count >= 5000")
+        return df
+
+    print("⚠️  Нет товаров с favorites_count >= 5000, генерирую...")
+    top_count = min(len(df), max(50, len(df) // 10))
+    top_positions = np.argsort(-favorites, kind='stable')[:top_count]
+
+    rng = _rng(seed, _STEP_DEMAND)
+    tier = rng.random(top_count)
+    new_favorites = np.select(
+        [tier < 0.3, tier < 0.7],
+        [rng.integers(10000, 50001, size=top_count), rng.integers(5000, 10001, size=top_count)],
+        default=rng.integers(10000, 30001, size=top_count)
+    )
+
+    column = df['favorites_count'].to_numpy(copy=True)
+    column[top_positions] = new_favorites
+    df['favorites_count'] = column
+    print(f"✓ Обновлено {top_count} товаров с favorites_count >= 5000")
+    return df
+
+
+def enrich_catalog(df: pd.DataFrame, seed: int = DEFAULT_SEED, today: Optional[date] = None) -> pd.DataFrame:
+    """Полный этап обогащения собранного каталога"""
+    df = generate_missing_stock(df, seed, today)
+    df = calculate_days_out_of_stock(df, today)
+    df = generate_competitor_prices(df, seed, today)
+    return ensure_high_demand_products(df, seed)
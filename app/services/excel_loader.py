@@ -1,16 +1,61 @@
 import pandas as pd
+import numpy as np
 import os
 import re
-import hashlib
+import time
 from datetime import date, datetime
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Any
 from pathlib import Path
 from dateutil import parser as date_parser
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 import threading
+from contextlib import contextmanager
 from app.services.mock_data import generate_mock_products
 from app.services.sqlite_cache import SQLiteCache
+from app.services.sidecar_cache import SidecarCache
+from app.services.snapshot import write_snapshot_file, map_snapshot_file, snapshot_stamp
+from app.services.product_keys import build_product_ids
+from app.services.id_index import ProductIdIndex
+from app.services.segment_store import SegmentStore
+from app.services.catalog_snapshot import CatalogSnapshot, ROLLUP_KEY
+from app.services.result_cache import invalidate_catalog_results
+from app.services.enrichment import (
+    DEFAULT_SEED, enrich_catalog, generate_missing_stock, calculate_days_out_of_stock,
+    generate_competitor_prices, ensure_high_demand_products
+)
+from app.services.excel_stream import (
+    COLUMN_MAPPING, read_excel_columns, decode_strings,
+    find_favorites_column, find_stock_column
+)
+
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка сборки недоступна
+    fcntl = None
+
+
+# Итоговый набор колонок нормализованного датафрейма
+REQUIRED_COLUMNS = ['id', 'name', 'brand', 'link', 'category_level_1',
+                    'category_level_2', 'category_level_3', 'category_level_4',
+                    'favorites_count', 'last_in_stock', 'period_start', 'period_end']
+
+# Движки чтения Excel: stream - потоковый колоночный, pandas - pd.read_excel
+EXCEL_ENGINES = ('stream', 'pandas')
+
+# Режимы параллельной загрузки: process - пул процессов, thread - пул потоков
+INGEST_MODES = ('process', 'thread')
+
+
+def _available_cores() -> int:
+    """Количество ядер, доступных процессу (с учетом ограничений контейнера)"""
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, os.cpu_count() or 1)
 
 
 class ExcelLoader:
@@ -18,19 +63,182 @@ class ExcelLoader:
     
     def __init__(self, data_dir: str = "data"):
         self.data_dir = Path(data_dir)
-        self._cache: Optional[pd.DataFrame] = None
+        # Каталог: база + сегменты, добавляемые при прогрессивной загрузке
+        self._segments = SegmentStore()
+        # Опубликованная версия каталога (читается без блокировок, см. get_snapshot)
+        self._catalog = CatalogSnapshot(0)
+        self._publish_lock = threading.Lock()
         self._file_metadata: Dict[str, Dict] = {}
         self._loading = False
+        # Замок писателей: загрузка и изменения каталога (читатели его не берут)
         self._load_lock = threading.Lock()
-        self._executor = ThreadPoolExecutor(max_workers=4)
+        # Готовность данных: Condition для синхронных вызовов (на том же замке)
+        # и asyncio.Event ожидающих async-маршрутов (цикл событий, событие)
+        self._ready_condition = threading.Condition(self._load_lock)
+        self._ready_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        self._ready_waiters_lock = threading.Lock()
+        # Идет фоновая догрузка реальных данных после демо-данных
+        self._background_loading = False
+        # Режим и число воркеров параллельной загрузки
+        self._ingest_mode = os.getenv("INGEST_MODE", "process")
+        if self._ingest_mode not in INGEST_MODES:
+            self._ingest_mode = "process"
+        try:
+            self._ingest_workers = max(1, int(os.getenv("INGEST_WORKERS", "0"))) if os.getenv("INGEST_WORKERS") else _available_cores()
+        except ValueError:
+            self._ingest_workers = _available_cores()
+        self._executor = ThreadPoolExecutor(max_workers=self._ingest_workers)
         self._using_mock_data = False
         self._data_ready = False
+        # Зерно синтетического обогащения: одинаковые данные дают одинаковый каталог
+        try:
+            self._enrichment_seed = int(os.getenv("ENRICHMENT_SEED", str(DEFAULT_SEED)))
+        except ValueError:
+            self._enrichment_seed = DEFAULT_SEED
+        self._engine = os.getenv("EXCEL_ENGINE", "stream")
+        if self._engine not in EXCEL_ENGINES:
+            self._engine = "stream"
         # Инициализируем SQLite кэш
         cache_dir = os.getenv("CACHE_DIR", "cache")
         if not os.path.isabs(cache_dir):
             base_dir = Path(__file__).parent.parent.parent
             cache_dir = str(base_dir / cache_dir)
         self._sqlite_cache = SQLiteCache(cache_dir)
+        # Пофайловый колоночный кэш: перезагрузка разбирает только новые/измененные файлы
+        self._sidecars = SidecarCache(cache_dir)
+        # Общий снимок каталога, который отображают в память все воркеры uvicorn
+        self._shared_snapshot = os.getenv("SHARED_SNAPSHOT", "1") != "0"
+        self._shared_snapshot_path = Path(cache_dir) / "catalog.snap"
+        self._build_lock_path = Path(cache_dir) / "catalog.lock"
+        # Отметка общего снимка, который отображен в текущей версии каталога
+        # (None - каталог собственный: демо-данные, прогрессивная загрузка)
+        self._shared_stamp: Optional[Tuple[int, int, int]] = None
+        self._follow_lock = threading.RLock()
+    
+    @property
+    def _cache(self) -> Optional[pd.DataFrame]:
+        """Датафрейм текущей версии каталога"""
+        return self._catalog.df
+    
+    @_cache.setter
+    def _cache(self, df: Optional[pd.DataFrame]):
+        self._publish(df)
+    
+    def get_snapshot(self) -> CatalogSnapshot:
+        """
+        Текущая версия каталога
+        
+        Версия неизменяема: запрос берет ее один раз и получает согласованные
+        данные, даже если в это время каталог догружается или изменяется.
+        Если общий снимок переписал другой воркер, сначала отображается он.
+        """
+        self._follow_shared_snapshot()
+        return self._catalog
+    
+    def get_catalog(self) -> CatalogSnapshot:
+        """Текущая версия каталога, при пустом каталоге - после загрузки данных"""
+        snapshot = self.get_snapshot()
+        if not snapshot.ready:
+            self.load_all_data()
+            snapshot = self._catalog
+        return snapshot
+    
+    @property
+    def catalog_version(self) -> int:
+        """Номер текущей версии каталога (растет при каждом изменении)"""
+        return self.get_snapshot().version
+    
+    @property
+    def published_version(self) -> int:
+        """
+        Номер версии, уже опубликованной в этом процессе
+        
+        В отличие от catalog_version не проверяет общий снимок (без обращения
+        к диску), поэтому годится для цикла событий.
+        """
+        return self._catalog.version
+    
+    def is_ready(self) -> bool:
+        """Данные загружены полностью: каталог есть, загрузка и фоновая догрузка завершены"""
+        return self._catalog.ready and not self._loading and not self._background_loading
+    
+    def _state_changed(self):
+        """Будит ожидающих после смены состояния загрузки (вызывается под _load_lock)"""
+        self._ready_condition.notify_all()
+        if not self.is_ready():
+            return
+        with self._ready_waiters_lock:
+            waiters, self._ready_waiters = self._ready_waiters, []
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # цикл событий уже закрыт
+    
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Ждет готовности данных без опроса; False, если истек таймаут"""
+        with self._ready_condition:
+            return self._ready_condition.wait_for(self.is_ready, timeout)
+    
+    async def wait_until_ready_async(self, timeout: Optional[float] = None) -> bool:
+        """Ждет готовности данных из async-маршрута, не блокируя цикл событий"""
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._ready_waiters_lock:
+            if self.is_ready():
+                return True
+            self._ready_waiters.append(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self.is_ready()
+        finally:
+            with self._ready_waiters_lock:
+                if waiter in self._ready_waiters:
+                    self._ready_waiters.remove(waiter)
+    
+    def _publish(self, df: Optional[pd.DataFrame], id_index: Optional[ProductIdIndex] = None,
+                 shared_stamp: Optional[Tuple[int, int, int]] = None):
+        """
+        Публикует новую версию каталога из одного датафрейма
+        
+        shared_stamp - отметка общего снимка, если df отображен из него.
+        """
+        with self._publish_lock:
+            self._segments.reset(df)
+            self._catalog = CatalogSnapshot(self._catalog.version + 1, df, id_index)
+            self._shared_stamp = shared_stamp
+        # Результаты запросов к прошлым версиям больше не нужны
+        invalidate_catalog_results(self)
+    
+    def _append_segment(self, segment: pd.DataFrame):
+        """Публикует версию с добавленным сегментом (прошлые строки не копируются)"""
+        with self._publish_lock:
+            frame = self._segments.append(segment)
+            self._catalog = CatalogSnapshot(self._catalog.version + 1, frame)
+            self._shared_stamp = None
+        invalidate_catalog_results(self)
+    
+    def _carry_rollup(self, previous: CatalogSnapshot, update):
+        """
+        Переносит сводку по товарам из прошлой версии в текущую
+
+        update(rollup, snapshot) пересчитывает только затронутые товары; если в прошлой
+        версии сводка не строилась, новая построится при первом обращении.
+        """
+        rollup = previous.built(ROLLUP_KEY)
+        if rollup is not None:
+            current = self._catalog
+            current.seed(ROLLUP_KEY, update(rollup, current))
+    
+    def _compact_segments(self):
+        """Ужимает буферы сегментов; содержимое не меняется, поэтому номер версии сохраняется"""
+        with self._publish_lock:
+            frame = self._segments.compact()
+            if frame is not None:
+                current = self._catalog
+                self._catalog = CatalogSnapshot(current.version, frame, current.built_id_index())
     
     def _parse_filename_dates(self, filename: str) -> Tuple[Optional[date], Optional[date]]:
         """Парсит даты из названия файла"""
@@ -65,26 +273,11 @@ class ExcelLoader:
     
     def _normalize_columns(self, df: pd.DataFrame, filename: str) -> pd.DataFrame:
         """Нормализует названия колонок и структуру данных"""
-        # Стандартные названия колонок
-        column_mapping = {
-            'Название товара': 'name',
-            'Бренд': 'brand',
-            'Ссылка на товар': 'link',
-            'Категория 1 уровня': 'category_level_1',
-            'Категория 2 уровня': 'category_level_2',
-            'Категория 3 уровня': 'category_level_3',
-            'Категория 4 уровня': 'category_level_4',
-        }
-        
         # Переименовываем колонки
-        df_normalized = df.rename(columns=column_mapping)
+        df_normalized = df.rename(columns=COLUMN_MAPPING)
         
         # Находим колонку с количеством добавлений в избранное
-        favorites_col = None
-        for col in df.columns:
-            if 'Количество добавлений' in col or 'добавлений в избранное' in col:
-                favorites_col = col
-                break
+        favorites_col = find_favorites_column(list(df.columns))
         
         if favorites_col:
             df_normalized['favorites_count'] = df[favorites_col]
@@ -92,11 +285,7 @@ class ExcelLoader:
             df_normalized['favorites_count'] = 0
         
         # Находим колонку с последним появлением в наличии
-        stock_col = None
-        for col in df.columns:
-            if 'Последнее появление' in col or 'появление в наличии' in col:
-                stock_col = col
-                break
+        stock_col = find_stock_column(list(df.columns))
         
         if stock_col:
             df_normalized['last_in_stock'] = pd.to_datetime(df[stock_col], errors='coerce').dt.date
@@ -108,197 +297,410 @@ class ExcelLoader:
         df_normalized['period_start'] = period_start
         df_normalized['period_end'] = period_end
         
-        # Создаем уникальный ID для товара
-        def create_product_id(row):
-            """Создает уникальный ID на основе названия, бренда и ссылки"""
-            key = f"{row.get('name', '')}|{row.get('brand', '')}|{row.get('link', '')}"
-            return hashlib.md5(key.encode()).hexdigest()[:16]
-        
-        df_normalized['id'] = df_normalized.apply(create_product_id, axis=1)
-        
-        # Выбираем только нужные колонки
-        required_cols = ['id', 'name', 'brand', 'link', 'category_level_1', 
-                        'category_level_2', 'category_level_3', 'category_level_4',
-                        'favorites_count', 'last_in_stock', 'period_start', 'period_end']
+        # Создаем уникальный ID для товара на основе названия, бренда и ссылки
+        df_normalized['id'] = build_product_ids(
+            *(df_normalized[col] if col in df_normalized.columns else None for col in ('name', 'brand', 'link')),
+            rows_count=len(df_normalized)
+        )
         
         # Добавляем отсутствующие колонки
-        for col in required_cols:
+        for col in REQUIRED_COLUMNS:
             if col not in df_normalized.columns:
                 df_normalized[col] = None
         
-        return df_normalized[required_cols]
+        # Выбираем только нужные колонки
+        return df_normalized[REQUIRED_COLUMNS]
     
-    def _generate_competitor_prices(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Генерирует данные о ценах конкурентов для товаров"""
-        import random
-        from datetime import date, timedelta
+    def _payload_to_frame(self, payload: Dict[str, Any], filename: str) -> pd.DataFrame:
+        """Собирает нормализованный датафрейм из колоночных данных потокового чтения"""
+        rows_count = payload['rows_count']
+        columns = {}
         
-        # Конкуренты
-        competitors = ['Wildberries', 'Яндекс.Маркет', 'AliExpress', 'Amazon', 'eBay']
+        for col in COLUMN_MAPPING.values():
+            if col in payload['strings']:
+                codes, values = payload['strings'][col]
+                columns[col] = decode_strings(codes, values)
         
-        def generate_competitor_data(row):
-            """Генерирует цены конкурентов для товара"""
-            favorites = row.get('favorites_count', 0) or 0
-            category = row.get('category_level_1', '')
-            
-            # Базовая цена на основе категории и спроса
-            base_price = 1000
-            if category == 'ТВ и аудио':
-                base_price = 50000
-            elif category == 'Малая бытовая техника':
-                base_price = 15000
-            elif category == 'Красота и здоровье':
-                base_price = 2000
-            elif category == 'Книги':
-                base_price = 500
-            elif category == 'Электроника':
-                base_price = 30000
-            
-            # Корректируем цену на основе спроса
-            if favorites > 10000:
-                base_price *= 1.2  # Высокий спрос = выше цена
-            elif favorites > 5000:
-                base_price *= 1.1
-            
-            # Генерируем цены для каждого конкурента
-            competitor_prices = {}
-            for competitor in competitors:
-                # Цена конкурента варьируется от -20% до +30% от базовой
-                variation = random.uniform(-0.2, 0.3)
-                competitor_prices[competitor] = round(base_price * (1 + variation), 2)
-            
-            # Наша цена (обычно в среднем диапазоне)
-            our_price = round(base_price * random.uniform(0.95, 1.15), 2)
-            
-            return {
-                'our_price': our_price,
-                'competitor_prices': competitor_prices
-            }
+        favorites = payload['favorites_count']
+        columns['favorites_count'] = favorites if favorites is not None else 0
+        
+        last_in_stock = payload['last_in_stock']
+        if last_in_stock is not None:
+            columns['last_in_stock'] = pd.Series(last_in_stock).dt.date
+        else:
+            columns['last_in_stock'] = None
+        
+        period_start, period_end = self._parse_filename_dates(filename)
+        columns['period_start'] = period_start
+        columns['period_end'] = period_end
+        
+        df = pd.DataFrame(columns, index=pd.RangeIndex(rows_count))
         
-        # Генерируем данные о ценах
-        price_data = df.apply(generate_competitor_data, axis=1, result_type='expand')
-        df['our_price'] = price_data['our_price']
-        df['competitor_prices'] = price_data['competitor_prices']
+        # ID строится так же, как в _normalize_columns (отсутствующая колонка -> '')
+        df['id'] = build_product_ids(
+            *(df[col] if col in df.columns else None for col in ('name', 'brand', 'link')),
+            rows_count=rows_count
+        )
         
-        return df
+        for col in REQUIRED_COLUMNS:
+            if col not in df.columns:
+                df[col] = None
+        
+        return df[REQUIRED_COLUMNS]
+    
+    def _generate_competitor_prices(self, df: pd.DataFrame, stream: Optional[str] = None) -> pd.DataFrame:
+        """Генерирует данные о ценах конкурентов для товаров (stream - имя файла сегмента)"""
+        return generate_competitor_prices(df, self._enrichment_seed, stream=stream)
     
     def _ensure_high_demand_products(self, df: pd.DataFrame) -> pd.DataFrame:
         """Гарантирует наличие товаров с favorites_count >= 5000 для тестирования workflow"""
-        import random
-        
-        # Проверяем, есть ли товары с favorites_count >= 5000
-        high_demand_count = len(df[df['favorites_count'] >= 5000])
-        
-        if high_demand_count == 0:
-            print("⚠️  Нет товаров с favorites_count >= 5000, генерирую...")
-            # Берем топ 10% товаров по favorites_count и увеличиваем их спрос
-            top_percent = max(50, len(df) // 10)  # Минимум 50 товаров
-            
-            # Сортируем по favorites_count и берем топ
-            df_sorted = df.sort_values('favorites_count', ascending=False)
-            top_products = df_sorted.head(top_percent).copy()
-            
-            # Увеличиваем favorites_count для этих товаров
-            # Создаем распределение: часть товаров с очень высоким спросом, часть со средним
-            for idx in top_products.index:
-                current_fav = df.loc[idx, 'favorites_count'] or 0
-                if current_fav < 5000:
-                    # Генерируем favorites_count от 5000 до 50000
-                    # 30% товаров с очень высоким спросом (10000+)
-                    # 40% товаров со средним спросом (5000-10000)
-                    # 30% товаров с высоким спросом (10000-30000)
-                    rand = random.random()
-                    if rand < 0.3:
-                        new_fav = random.randint(10000, 50000)
-                    elif rand < 0.7:
-                        new_fav = random.randint(5000, 10000)
-                    else:
-                        new_fav = random.randint(10000, 30000)
-                    
-                    df.loc[idx, 'favorites_count'] = new_fav
+        return ensure_high_demand_products(df, self._enrichment_seed)
+    
+    def _generate_missing_stock_data(self, df: pd.DataFrame, stream: Optional[str] = None) -> pd.DataFrame:
+        """Генерирует данные о наличии для товаров, у которых их нет (stream - имя файла сегмента)"""
+        return generate_missing_stock(df, self._enrichment_seed, stream=stream)
+    
+    def _calculate_days_out_of_stock(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Вычисляет количество дней отсутствия в наличии"""
+        return calculate_days_out_of_stock(df)
+    
+    def _load_single_file(self, file_path: Path, engine: Optional[str] = None) -> Optional[Tuple[pd.DataFrame, Dict]]:
+        """Загружает один Excel файл"""
+        engine = engine or self._engine
+        try:
+            if engine == "pandas":
+                df = pd.read_excel(file_path, engine='openpyxl')
+                df_normalized = self._normalize_columns(df, file_path.name)
+            else:
+                payload = self._sidecars.load(file_path)
+                if payload is None:
+                    payload = read_excel_columns(file_path)
+                    self._sidecars.save(file_path, payload)
+                df_normalized = self._payload_to_frame(payload, file_path.name)
             
-            print(f"✓ Обновлено {len(top_products)} товаров с favorites_count >= 5000")
-        else:
-            print(f"✓ Найдено {high_demand_count} товаров с favorites_count >= 5000")
-        
-        return df
+            return df_normalized, self._file_info(file_path, df_normalized)
+        except Exception as e:
+            print(f"Ошибка при загрузке файла {file_path.name}: {e}")
+            return None
+    
+    def _file_info(self, file_path: Path, df_normalized: pd.DataFrame) -> Dict:
+        """Метаданные загруженного файла"""
+        period_start, period_end = self._parse_filename_dates(file_path.name)
+        return {
+            'period_start': period_start,
+            'period_end': period_end,
+            'rows_count': len(df_normalized)
+        }
     
-    def _generate_missing_stock_data(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Генерирует данные о наличии для товаров, у которых их нет"""
-        from datetime import timedelta
-        import random
+    def _iter_loaded_files(self, files: List[Path]):
+        """
+        Параллельно загружает файлы и отдает (позиция, путь, (датафрейм, метаданные))
+        по мере готовности
         
-        today = date.today()
+        В режиме process разбор Excel выполняется в пуле процессов (обходит GIL),
+        воркеры возвращают компактные колоночные данные, а датафрейм собирается
+        в основном процессе. Режим thread использует общий пул потоков и подходит
+        для контейнеров с ограниченной памятью.
+        """
+        if not files:
+            return
         
-        def generate_last_in_stock(row):
-            # Если last_in_stock уже есть, оставляем как есть
-            if pd.notna(row.get('last_in_stock')) and row.get('last_in_stock') is not None:
-                return row['last_in_stock']
-            
-            # Генерируем last_in_stock на основе favorites_count
-            favorites = row.get('favorites_count', 0) or 0
-            
-            # Вероятность отсутствия зависит от спроса
-            # Высокий спрос -> чаще дефицит (больше дней отсутствия)
-            if favorites > 10000:
-                # Высокий спрос - часто дефицит
-                if random.random() < 0.7:
-                    days_out = random.randint(15, 200)  # Дефицит
-                else:
-                    days_out = random.randint(0, 14)  # В наличии недавно
-            elif favorites > 5000:
-                # Средний спрос
-                if random.random() < 0.5:
-                    days_out = random.randint(15, 100)
-                else:
-                    days_out = random.randint(0, 14)
-            else:
-                # Низкий спрос
-                if random.random() < 0.3:
-                    days_out = random.randint(15, 60)
-                else:
-                    days_out = random.randint(0, 14)
-            
-            return today - timedelta(days=days_out)
+        pending = dict(enumerate(files))
+        
+        if self._engine == "stream":
+            # Неизмененные файлы собираем из sidecar без разбора Excel
+            for position, file_path in list(pending.items()):
+                payload = self._sidecars.load(file_path)
+                if payload is None:
+                    continue
+                del pending[position]
+                df_normalized = self._payload_to_frame(payload, file_path.name)
+                yield position, file_path, (df_normalized, self._file_info(file_path, df_normalized))
+            if pending:
+                print(f"📄 Требуют разбора {len(pending)} из {len(files)} файлов (остальные из sidecar кэша)")
         
-        # Применяем генерацию только к строкам без last_in_stock
-        mask = df['last_in_stock'].isna() | (df['last_in_stock'].isnull())
-        if mask.any():
-            df.loc[mask, 'last_in_stock'] = df[mask].apply(generate_last_in_stock, axis=1)
+        if pending and self._ingest_mode == "process" and self._engine == "stream":
+            # Пул - только под файлы, которые действительно нужно разбирать
+            workers = min(self._ingest_workers, len(pending))
+            context = multiprocessing.get_context("spawn")
+            try:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                    futures = {pool.submit(read_excel_columns, file_path): position
+                               for position, file_path in pending.items()}
+                    for future in as_completed(futures):
+                        position = futures[future]
+                        file_path = pending[position]
+                        try:
+                            payload = future.result()
+                            self._sidecars.save(file_path, payload)
+                            df_normalized = self._payload_to_frame(payload, file_path.name)
+                        except BrokenProcessPool:
+                            raise
+                        except Exception as e:
+                            print(f"Ошибка при загрузке файла {file_path.name}: {e}")
+                            del pending[position]
+                            continue
+                        del pending[position]
+                        yield position, file_path, (df_normalized, self._file_info(file_path, df_normalized))
+            except BrokenProcessPool as e:
+                # Процессы недоступны (например, ограничения контейнера) - догружаем потоками
+                print(f"⚠️ Пул процессов недоступен ({e}), загружаю оставшиеся {len(pending)} файлов в потоках")
         
-        return df
+        futures = {self._executor.submit(self._load_single_file, file_path): position
+                   for position, file_path in pending.items()}
+        for future in as_completed(futures):
+            position = futures[future]
+            result = future.result()
+            if result is not None:
+                yield position, pending[position], result
     
-    def _calculate_days_out_of_stock(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Вычисляет количество дней отсутствия в наличии"""
-        today = date.today()
+    def benchmark_engines(self, files: Optional[List[Path]] = None) -> List[Dict[str, Any]]:
+        """
+        Сравнивает движки чтения Excel по каждому файлу
         
-        def calc_days(row):
-            if pd.isna(row['last_in_stock']) or row['last_in_stock'] is None:
-                return None
-            delta = today - row['last_in_stock']
-            return delta.days if delta.days >= 0 else 0
+        Возвращает время загрузки, строки/сек и ускорение потокового движка
+        относительно pd.read_excel, а также проверяет совпадение результатов.
+        """
+        if files is None:
+            files = sorted(self.data_dir.glob("*.xlsx"))
         
-        df['days_out_of_stock'] = df.apply(calc_days, axis=1)
-        return df
+        report = []
+        for file_path in files:
+            timings = {}
+            frames = {}
+            for engine in ("pandas", "stream"):
+                started = time.perf_counter()
+                result = self._load_single_file(file_path, engine=engine)
+                timings[engine] = time.perf_counter() - started
+                frames[engine] = result[0] if result is not None else None
+            
+            rows = len(frames["stream"]) if frames["stream"] is not None else 0
+            identical = (
+                frames["pandas"] is not None and frames["stream"] is not None
+                and frames["pandas"].equals(frames["stream"])
+            )
+            report.append({
+                'file': file_path.name,
+                'rows': rows,
+                'pandas_seconds': round(timings["pandas"], 3),
+                'stream_seconds': round(timings["stream"], 3),
+                'pandas_rows_per_sec': round(rows / timings["pandas"], 1) if timings["pandas"] > 0 else 0.0,
+                'stream_rows_per_sec': round(rows / timings["stream"], 1) if timings["stream"] > 0 else 0.0,
+                'speedup': round(timings["pandas"] / timings["stream"], 2) if timings["stream"] > 0 else 0.0,
+                'identical': identical
+            })
+        return report
     
-    def _load_single_file(self, file_path: Path) -> Optional[Tuple[pd.DataFrame, Dict]]:
-        """Загружает один Excel файл"""
+    @contextmanager
+    def _build_lock(self):
+        """
+        Межпроцессная блокировка сборки каталога
+        
+        Пока один воркер собирает каталог, остальные ждут и затем отображают
+        опубликованный им общий снимок вместо повторной сборки.
+        """
+        if fcntl is None or not self._shared_snapshot:
+            yield
+            return
+        with open(self._build_lock_path, "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    
+    def _load_shared_snapshot(self, exact: bool = True) -> Optional[Tuple[pd.DataFrame, Dict[str, Dict], Tuple]]:
+        """
+        Отображает в память общий снимок каталога
+        
+        exact=True - только снимок, собранный из текущего набора файлов.
+        Возвращает (датафрейм, метаданные файлов, отметка файла) или None.
+        """
+        if not self._shared_snapshot:
+            return None
+        # Отметка берется до отображения: если файл заменят в промежутке,
+        # следующая проверка увидит новую отметку и отобразит его еще раз
+        stamp = snapshot_stamp(self._shared_snapshot_path)
+        if stamp is None:
+            return None
         try:
-            df = pd.read_excel(file_path, engine='openpyxl')
-            df_normalized = self._normalize_columns(df, file_path.name)
-            
-            # Сохраняем метаданные файла
-            period_start, period_end = self._parse_filename_dates(file_path.name)
-            metadata = {
-                'period_start': period_start,
-                'period_end': period_end,
-                'rows_count': len(df)
-            }
-            
-            return df_normalized, metadata
+            df, header = map_snapshot_file(self._shared_snapshot_path)
         except Exception as e:
-            print(f"Ошибка при загрузке файла {file_path.name}: {e}")
+            print(f"⚠️ Ошибка чтения общего снимка: {e}")
+            return None
+        meta = header.get('meta', {})
+        if exact and meta.get('data_hash') != self._sqlite_cache.get_data_hash(self.data_dir):
             return None
+        if not meta.get('file_metadata'):
+            return None
+        print(f"✅ Общий снимок отображен в память: {len(df)} товаров")
+        return df, meta['file_metadata'], stamp
+    
+    def _adopt_shared_snapshot(self, shared: Tuple[pd.DataFrame, Dict[str, Dict], Tuple]):
+        """Публикует отображенный общий снимок версией каталога"""
+        df, file_metadata, stamp = shared
+        self._publish(df, shared_stamp=stamp)
+        self._file_metadata = file_metadata
+    
+    def _publish_shared_snapshot(self, df: pd.DataFrame, file_metadata: Dict[str, Dict],
+                                 id_index: Optional[ProductIdIndex] = None):
+        """
+        Публикует каталог как общий снимок для остальных воркеров
+        
+        Снимок записывается и отображается в память, и версией каталога становится
+        отображенный датафрейм, чтобы и этот процесс не держал собственную копию.
+        При ошибке публикуется исходный датафрейм.
+        """
+        with self._follow_lock:
+            stamp = None
+            if self._shared_snapshot:
+                try:
+                    write_snapshot_file(self._shared_snapshot_path, df, {
+                        'data_hash': self._sqlite_cache.get_data_hash(self.data_dir),
+                        'file_metadata': file_metadata
+                    })
+                    stamp = snapshot_stamp(self._shared_snapshot_path)
+                    df, _ = map_snapshot_file(self._shared_snapshot_path)
+                except Exception as e:
+                    print(f"⚠️ Ошибка публикации общего снимка: {e}")
+                    stamp = None
+            self._publish(df, id_index, stamp)
+            self._file_metadata = file_metadata
+    
+    def _follow_shared_snapshot(self):
+        """
+        Переходит на общий снимок, если его заменил другой воркер
+        
+        Проверяется только каталог, отображенный из общего снимка. Изменение товаров
+        и перезагрузка в любом воркере переписывают снимок, очистка кэша удаляет его.
+        Проверка - один stat файла.
+        """
+        stamp = self._shared_stamp
+        if stamp is None:
+            return
+        current = snapshot_stamp(self._shared_snapshot_path)
+        if current == stamp:
+            return
+        with self._follow_lock:
+            if self._shared_stamp != stamp:
+                return  # другой поток уже перешел на новый снимок
+            if current is None:
+                # Кэш очищен в другом воркере: каталог загрузится заново при обращении
+                print("🔄 Общий снимок удален, каталог будет загружен заново")
+                self._publish(None)
+                self._file_metadata = {}
+                return
+            shared = self._load_shared_snapshot(exact=False)
+            if shared is not None:
+                self._adopt_shared_snapshot(shared)
+    
+    @contextmanager
+    def _write_lock(self):
+        """
+        Замок изменения каталога
+        
+        Каталог из общего снимка меняется еще и под межпроцессной блокировкой:
+        изменения воркеров применяются по очереди, каждое к последнему снимку.
+        """
+        if self._shared_stamp is None:
+            with self._load_lock:
+                yield
+            return
+        with self._build_lock(), self._load_lock:
+            self._follow_shared_snapshot()
+            yield
+    
+    def _publish_change(self, df: pd.DataFrame, id_index: Optional[ProductIdIndex]):
+        """Публикует измененный каталог; каталог из общего снимка переписывает снимок"""
+        if self._shared_stamp is not None:
+            self._publish_shared_snapshot(df, self._file_metadata, id_index)
+        else:
+            self._publish(df, id_index)
+    
+    def ensure_writable(self) -> Optional[pd.DataFrame]:
+        """
+        Возвращает собственную копию каталога, если колонки доступны только для чтения
+        
+        Колонки общего снимка отображены из файла: копия публикуется новой версией
+        (индекс ID переносится - строки совпадают).
+        """
+        with self._load_lock:
+            snapshot = self._catalog
+            df = snapshot.df
+            if df is not None and any(
+                not df[col].to_numpy().flags.writeable
+                for col in df.columns if df[col].dtype != object
+            ):
+                self._publish(df.copy(), snapshot.built_id_index())
+            return self._catalog.df
+    
+    def get_id_index(self) -> Optional[ProductIdIndex]:
+        """Индекс ID -> позиции строк для текущей версии каталога (строится при первом обращении)"""
+        return self.get_snapshot().id_index
+    
+    def find_product_positions(self, product_id: str) -> np.ndarray:
+        """Позиции строк товара в текущей версии каталога (пустой массив, если товара нет)"""
+        return self.get_snapshot().positions(product_id)
+    
+    def append_products(self, new_df: pd.DataFrame) -> pd.DataFrame:
+        """Добавляет строки в конец каталога (новая версия с обновленным индексом ID)"""
+        with self._write_lock():
+            snapshot = self._catalog
+            if not snapshot.ready:
+                self._publish(new_df.reset_index(drop=True))
+                return self._catalog.df
+            index = snapshot.id_index.copy()
+            index.append(new_df['id'].tolist())
+            self._publish_change(pd.concat([snapshot.df, new_df], ignore_index=True), index)
+            self._carry_rollup(snapshot, lambda rollup, current: rollup.appended(
+                current.df, current.id_index, new_df['id'].tolist()))
+            return self._catalog.df
+    
+    def update_products(self, product_id: str, values: Dict[str, Any]) -> int:
+        """
+        Изменяет значения колонок у всех строк товара, возвращает число строк
+        
+        Новая версия разделяет с текущей неизменные колонки, измененные колонки
+        копируются, поэтому читатели текущей версии не видят частичных изменений.
+        """
+        with self._write_lock():
+            snapshot = self._catalog
+            positions = snapshot.positions(product_id)
+            if len(positions) == 0:
+                return 0
+            df = snapshot.df
+            updated_df = df.copy(deep=False)
+            for column, value in values.items():
+                column_values = df[column].copy() if column in df.columns else pd.Series(None, index=df.index, dtype=object)
+                if isinstance(column_values.dtype, pd.CategoricalDtype):
+                    # Колонка общего снимка: нового значения может не быть в словаре
+                    column_values = column_values.astype(object)
+                column_values.iloc[positions] = value
+                updated_df[column] = column_values
+            self._publish_change(updated_df, snapshot.built_id_index())
+            if 'id' not in values:
+                self._carry_rollup(snapshot, lambda rollup, current: rollup.updated(
+                    current.df, current.id_index, [product_id]))
+            return len(positions)
+    
+    def delete_products(self, product_ids: List[str]) -> int:
+        """Удаляет товары из каталога по ID, возвращает количество удаленных строк"""
+        with self._write_lock():
+            snapshot = self._catalog
+            if not snapshot.ready:
+                return 0
+            positions = [snapshot.positions(product_id) for product_id in set(product_ids)]
+            positions = np.unique(np.concatenate(positions)) if positions else np.empty(0, dtype=np.int64)
+            if len(positions) == 0:
+                return 0
+            keep = np.ones(len(snapshot), dtype=bool)
+            keep[positions] = False
+            index = snapshot.id_index.copy()
+            index.delete(positions)
+            self._publish_change(snapshot.df[keep].reset_index(drop=True), index)
+            self._carry_rollup(snapshot, lambda rollup, current: rollup.deleted(
+                current.df, current.id_index, keep, product_ids))
+            return len(positions)
     
     def load_all_data(self, force_reload: bool = False) -> pd.DataFrame:
         """Загружает все данные из Excel файлов с кэшированием и параллельной загрузкой"""
@@ -307,100 +709,112 @@ class ExcelLoader:
                 return self._cache
             
             if self._loading:
-                # Если загрузка уже идет, ждем ее завершения
-                while self._loading:
-                    import time
-                    time.sleep(0.1)
+                # Если загрузка уже идет, ждем ее завершения (замок освобождается на время ожидания)
+                self._ready_condition.wait_for(lambda: not self._loading)
                 if self._cache is not None:
                     return self._cache
             
             self._loading = True
         
-        # Пробуем загрузить из SQLite кэша
+        # Пробуем загрузить из SQLite кэша (только если он соответствует текущим файлам)
         if not force_reload:
-            cached_df = self._sqlite_cache.get_cached_data(self.data_dir)
-            if cached_df is not None:
+            shared = self._load_shared_snapshot()
+            if shared is not None:
                 with self._load_lock:
-                    self._cache = cached_df
-                    self._file_metadata = self._sqlite_cache.get_file_metadata()
+                    self._adopt_shared_snapshot(shared)
                     self._loading = False
                     self._using_mock_data = False
-                return cached_df
+                    self._state_changed()
+                return self._cache
+            
+            cached_df = self._sqlite_cache.get_cached_data(self.data_dir, exact=True)
+            cached_metadata = self._sqlite_cache.get_file_metadata() if cached_df is not None else {}
+            # Кэш без метаданных файлов считается неполным и пересобирается из sidecar
+            if cached_df is not None and cached_metadata:
+                # Общего снимка еще нет: публикуем его для остальных воркеров
+                with self._load_lock:
+                    self._publish_shared_snapshot(cached_df, cached_metadata)
+                    self._loading = False
+                    self._using_mock_data = False
+                    self._state_changed()
+                return self._cache
         
         try:
-            if not self.data_dir.exists():
-                raise FileNotFoundError(f"Директория {self.data_dir} не найдена")
-            
-            excel_files = list(self.data_dir.glob("*.xlsx"))
-            
-            if not excel_files:
-                raise FileNotFoundError(f"Excel файлы не найдены в {self.data_dir}")
-            
-            print(f"Начинаю загрузку {len(excel_files)} файлов...")
-            
-            # Параллельная загрузка файлов
-            all_dataframes = []
-            file_metadata = {}
-            
-            # Используем ThreadPoolExecutor для параллельной загрузки
-            futures = []
-            for file_path in excel_files:
-                future = self._executor.submit(self._load_single_file, file_path)
-                futures.append((future, file_path.name))
-            
-            # Собираем результаты
-            for future, filename in futures:
-                result = future.result()
-                if result is not None:
-                    df_normalized, metadata = result
-                    all_dataframes.append(df_normalized)
-                    file_metadata[filename] = metadata
-                    print(f"✓ Загружен файл: {filename} ({metadata['rows_count']} строк)")
-            
-            if not all_dataframes:
-                raise ValueError("Не удалось загрузить данные из файлов")
-            
-            print(f"Объединяю {len(all_dataframes)} датафреймов...")
-            
-            # Объединяем все данные
-            combined_df = pd.concat(all_dataframes, ignore_index=True)
-            
-            print("Генерирую данные о наличии для товаров без этой информации...")
-            # Генерируем last_in_stock для товаров без этой информации
-            combined_df = self._generate_missing_stock_data(combined_df)
-            
-            print("Вычисляю дни отсутствия в наличии...")
-            # Вычисляем дни отсутствия в наличии
-            combined_df = self._calculate_days_out_of_stock(combined_df)
-            
-            print("Генерирую данные о ценах конкурентов...")
-            # Генерируем данные о ценах конкурентов
-            combined_df = self._generate_competitor_prices(combined_df)
-            
-            print("Гарантирую наличие товаров с высоким спросом...")
-            # Гарантируем наличие товаров с favorites_count >= 5000
-            combined_df = self._ensure_high_demand_products(combined_df)
-            
-            # Кэшируем результат
-            with self._load_lock:
-                self._cache = combined_df
-                self._file_metadata = file_metadata
-                self._loading = False
-                self._using_mock_data = False
-            
-            # Сохраняем в SQLite кэш
-            self._sqlite_cache.save_data(self.data_dir, combined_df)
-            self._sqlite_cache.save_file_metadata(file_metadata)
-            
-            print(f"✓ Данные загружены: {len(combined_df)} товаров из {len(file_metadata)} файлов")
-            
-            return combined_df
-            
+            with self._build_lock():
+                if not force_reload:
+                    # Пока ждали блокировку, каталог мог собрать другой воркер
+                    shared = self._load_shared_snapshot()
+                    if shared is not None:
+                        with self._load_lock:
+                            self._adopt_shared_snapshot(shared)
+                            self._loading = False
+                            self._using_mock_data = False
+                            self._state_changed()
+                        return self._cache
+                return self._build_catalog()
         except Exception as e:
             with self._load_lock:
                 self._loading = False
+                self._state_changed()
             raise e
     
+    def _build_catalog(self) -> pd.DataFrame:
+        """Собирает каталог из Excel файлов и сохраняет его в кэши"""
+        if not self.data_dir.exists():
+            raise FileNotFoundError(f"Директория {self.data_dir} не найдена")
+        
+        excel_files = list(self.data_dir.glob("*.xlsx"))
+        
+        if not excel_files:
+            raise FileNotFoundError(f"Excel файлы не найдены в {self.data_dir}")
+        
+        print(f"Начинаю загрузку {len(excel_files)} файлов...")
+        
+        # Параллельная загрузка файлов (пул процессов или потоков)
+        loaded = []
+        for position, file_path, (df_normalized, metadata) in self._iter_loaded_files(excel_files):
+            loaded.append((position, file_path.name, df_normalized, metadata))
+            print(f"✓ Загружен файл: {file_path.name} ({metadata['rows_count']} строк)")
+        
+        # Сохраняем исходный порядок файлов независимо от порядка завершения
+        loaded.sort(key=lambda item: item[0])
+        all_dataframes = [df_normalized for _, _, df_normalized, _ in loaded]
+        file_metadata = {filename: metadata for _, filename, _, metadata in loaded}
+        
+        if not all_dataframes:
+            raise ValueError("Не удалось загрузить данные из файлов")
+        
+        print(f"Объединяю {len(all_dataframes)} датафреймов...")
+        
+        # Объединяем все данные
+        combined_df = pd.concat(all_dataframes, ignore_index=True)
+        
+        print("Обогащаю каталог: наличие, дни отсутствия, цены конкурентов, спрос...")
+        # Единый векторный этап обогащения (воспроизводим для заданного зерна)
+        combined_df = enrich_catalog(combined_df, self._enrichment_seed)
+        
+        # Кэшируем результат
+        with self._load_lock:
+            self._cache = combined_df
+            self._file_metadata = file_metadata
+            self._loading = False
+            self._using_mock_data = False
+            self._state_changed()
+        
+        # Сохраняем в SQLite кэш
+        self._sqlite_cache.save_data(self.data_dir, combined_df)
+        self._sqlite_cache.save_file_metadata(file_metadata)
+        
+        # Публикуем общий снимок и переключаемся на его отображение в память
+        with self._load_lock:
+            if self._cache is combined_df:
+                self._publish_shared_snapshot(combined_df, file_metadata)
+            combined_df = self._cache
+        
+        print(f"✓ Данные загружены: {len(combined_df)} товаров из {len(file_metadata)} файлов")
+        
+        return combined_df
+    
     def get_file_metadata(self) -> Dict[str, Dict]:
         """Возвращает метаданные загруженных файлов"""
         if self._cache is None:
@@ -408,15 +822,32 @@ class ExcelLoader:
         return self._file_metadata
     
     def clear_cache(self):
-        """Очищает кэш"""
-        with self._load_lock:
+        """
+        Очищает кэш
+        
+        Общий снимок удаляется: следующая загрузка берет данные из SQLite кэша или
+        файлов, а остальные воркеры, увидев удаление, тоже загружают каталог заново.
+        """
+        with self._build_lock(), self._load_lock:
+            if self._shared_snapshot:
+                self._shared_snapshot_path.unlink(missing_ok=True)
             self._cache = None
             self._file_metadata = {}
     
     def load_quick_start_file(self) -> pd.DataFrame:
         """Быстрая загрузка данных для немедленного старта приложения"""
-        # Сначала проверяем SQLite кэш
+        # Сначала проверяем общий снимок и SQLite кэш
         print("⚡ Быстрый старт: проверяю кэш...")
+        shared = self._load_shared_snapshot(exact=False)
+        if shared is not None:
+            with self._load_lock:
+                self._adopt_shared_snapshot(shared)
+                self._loading = False
+                self._using_mock_data = False
+                self._data_ready = True
+                self._state_changed()
+            return self._cache
+        
         cached_df = self._sqlite_cache.get_cached_data(self.data_dir)
         
         if cached_df is not None and len(cached_df) > 0:
@@ -427,6 +858,7 @@ class ExcelLoader:
                 self._loading = False
                 self._using_mock_data = False
                 self._data_ready = True
+                self._state_changed()
             return cached_df
         
         # Если кэша нет, загружаем мок данные для мгновенного старта
@@ -435,8 +867,9 @@ class ExcelLoader:
         # Генерируем мок данные (1000 товаров, 70% с days_out_of_stock >= 15)
         mock_df = generate_mock_products(1000)
         
-        # Вычисляем days_out_of_stock для мок данных
+        # Вычисляем days_out_of_stock и цены конкурентов для мок данных
         mock_df = self._calculate_days_out_of_stock(mock_df)
+        mock_df = self._generate_competitor_prices(mock_df)
         
         with self._load_lock:
             self._cache = mock_df
@@ -444,6 +877,7 @@ class ExcelLoader:
             self._loading = False
             self._using_mock_data = True
             self._data_ready = True
+            self._state_changed()
         
         high_priority_count = len(mock_df[mock_df['days_out_of_stock'] >= 15])
         print(f"✅ Демонстрационные данные загружены: {len(mock_df)} товаров")
@@ -455,9 +889,6 @@ class ExcelLoader:
         """Асинхронная загрузка реальных данных в фоновом режиме с заменой мок данных"""
         def load_in_background():
             try:
-                import time
-                time.sleep(2)  # Небольшая задержка, чтобы мок данные успели загрузиться
-                
                 print("🔄 Начинаю загрузку реальных данных из Excel файлов...")
                 print("📊 Демонстрационные данные будут постепенно заменены на реальные")
                 
@@ -482,8 +913,9 @@ class ExcelLoader:
                         result = self._load_single_file(quick_start_path)
                         if result is not None:
                             df_normalized, metadata = result
-                            df_normalized = self._generate_missing_stock_data(df_normalized)
+                            df_normalized = self._generate_missing_stock_data(df_normalized, quick_start_file)
                             df_normalized = self._calculate_days_out_of_stock(df_normalized)
+                            df_normalized = self._generate_competitor_prices(df_normalized, quick_start_file)
                             
                             with self._load_lock:
                                 # Заменяем мок данные на реальные
@@ -503,37 +935,33 @@ class ExcelLoader:
                     print(f"📦 Загружаю {len(remaining_files)} дополнительных файлов...")
                     loaded_count = 0
                     
-                    for file_path in remaining_files:
+                    # Файлы разбираются параллельно и добавляются по мере готовности
+                    for _, file_path, (df_normalized, metadata) in self._iter_loaded_files(remaining_files):
                         try:
-                            result = self._load_single_file(file_path)
-                            if result is not None:
-                                df_normalized, metadata = result
-                                loaded_count += 1
-                                print(f"✓ Загружен файл: {file_path.name} ({metadata['rows_count']} строк)")
-                                
-                                # Объединяем с существующим кэшем
-                                with self._load_lock:
-                                    if self._cache is not None:
-                                        df_normalized = self._generate_missing_stock_data(df_normalized)
-                                        self._cache = pd.concat([self._cache, df_normalized], ignore_index=True)
-                                        self._cache = self._calculate_days_out_of_stock(self._cache)
-                                    else:
-                                        df_normalized = self._generate_missing_stock_data(df_normalized)
-                                        self._cache = df_normalized
-                                        self._cache = self._calculate_days_out_of_stock(self._cache)
-                                    
-                                    if file_path.name not in self._file_metadata:
-                                        self._file_metadata[file_path.name] = metadata
-                                    
-                                    self._using_mock_data = False
-                                
-                                print(f"  📊 Всего товаров в кэше: {len(self._cache)}")
+                            loaded_count += 1
+                            print(f"✓ Загружен файл: {file_path.name} ({metadata['rows_count']} строк)")
+                            
+                            # Обогащаем только новый сегмент (дни отсутствия и цены зависят лишь от строки);
+                            # имя файла дает сегменту свой поток случайных чисел
+                            df_normalized = self._generate_missing_stock_data(df_normalized, file_path.name)
+                            df_normalized = self._calculate_days_out_of_stock(df_normalized)
+                            df_normalized = self._generate_competitor_prices(df_normalized, file_path.name)
+                            
+                            # Дописываем сегмент в буферы без копирования уже загруженных строк
+                            with self._load_lock:
+                                self._append_segment(df_normalized)
+                                if file_path.name not in self._file_metadata:
+                                    self._file_metadata[file_path.name] = metadata
+                                self._using_mock_data = False
+                            
+                            print(f"  📊 Всего товаров в кэше: {len(self._segments)}")
                         except Exception as e:
                             print(f"❌ Ошибка при загрузке файла {file_path.name}: {e}")
                             continue
                     
+                    self._compact_segments()
                     with self._load_lock:
-                        print(f"✅ Загрузка завершена: {len(self._cache)} товаров из {len(self._file_metadata)} файлов")
+                        print(f"✅ Загрузка завершена: {len(self._segments)} товаров из {len(self._file_metadata)} файлов")
                         print("✅ Все данные заменены на реальные")
                 else:
                     print("✅ Все файлы загружены")
@@ -541,11 +969,30 @@ class ExcelLoader:
             except Exception as e:
                 print(f"❌ Ошибка при фоновой загрузке: {e}")
                 print("⚠️ Продолжаем использовать демонстрационные данные")
+            finally:
+                with self._load_lock:
+                    self._background_loading = False
+                    self._state_changed()
         
+        # Флаг ставится до старта потока: ожидающие готовности не проснутся раньше времени
+        with self._load_lock:
+            self._background_loading = True
         thread = threading.Thread(target=load_in_background, daemon=True)
         thread.start()
         return thread
     
+    def refresh_in_background(self) -> threading.Thread:
+        """Фоновая инкрементальная перезагрузка данных (текущий кэш остается доступным)"""
+        def refresh():
+            try:
+                self.load_all_data(force_reload=True)
+            except Exception as e:
+                print(f"❌ Ошибка при фоновом обновлении кэша: {e}")
+        
+        thread = threading.Thread(target=refresh, daemon=True)
+        thread.start()
+        return thread
+    
     def preload_data_async(self):
         """Предзагрузка данных: сначала из кэша/мок, затем реальные"""
         # Сначала загружаем данные из кэша или мок данные мгновенно
@@ -553,8 +1000,13 @@ class ExcelLoader:
         
         # Если загрузили из кэша и это не мок данные, не нужно загружать реальные
         if not self._using_mock_data:
-            print("✅ Используются данные из кэша, пропускаю загрузку реальных данных")
-            return None
+            if self._sqlite_cache.is_current(self.data_dir):
+                print("✅ Используются данные из кэша, пропускаю загрузку реальных данных")
+                return None
+            # Набор файлов изменился: отдаем прежний кэш и обновляем его в фоне,
+            # разбирая только новые/измененные файлы (остальные - из sidecar кэша)
+            print("🔄 Набор файлов изменился, обновляю кэш в фоне...")
+            return self.refresh_in_background()
         
         # Если это мок данные, загружаем реальные в фоне
         return self.load_remaining_files_async()
@@ -0,0 +1,407 @@
+"""
+Потоковое чтение Excel файлов (xlsx) без построения объектной модели openpyxl
+
+Читает XML первого листа через iterparse, пропускает ненужные колонки и сразу
+собирает типизированные колоночные массивы: строки кодируются словарем
+(коды + уникальные значения), количество добавлений - int64, даты - datetime64.
+"""
+import re
+import zipfile
+import posixpath
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Any
+from xml.etree.ElementTree import iterparse, fromstring
+
+import numpy as np
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+
+
+# Стандартные названия колонок
+COLUMN_MAPPING = {
+    'Название товара': 'name',
+    'Бренд': 'brand',
+    'Ссылка на товар': 'link',
+    'Категория 1 уровня': 'category_level_1',
+    'Категория 2 уровня': 'category_level_2',
+    'Категория 3 уровня': 'category_level_3',
+    'Категория 4 уровня': 'category_level_4',
+}
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+_ROW_TAG = _MAIN_NS + 'row'
+_CELL_TAG = _MAIN_NS + 'c'
+_VALUE_TAG = _MAIN_NS + 'v'
+_INLINE_TAG = _MAIN_NS + 'is'
+_SI_TAG = _MAIN_NS + 'si'
+
+# Эпохи Excel (1900 и 1904) в днях от 1970-01-01
+_EPOCH_1900 = np.datetime64('1899-12-30', 'D')
+_EPOCH_1904 = np.datetime64('1904-01-01', 'D')
+_INT_RE = re.compile(r'^-?\d+$')
+
+# Строки, которые pd.read_excel по умолчанию считает пропусками
+_NA_STRINGS = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+])
+
+
+def find_favorites_column(columns: List[Any]) -> Optional[Any]:
+    """Находит колонку с количеством добавлений в избранное"""
+    for col in columns:
+        if not isinstance(col, str):
+            continue
+        if 'Количество добавлений' in col or 'добавлений в избранное' in col:
+            return col
+    return None
+
+
+def find_stock_column(columns: List[Any]) -> Optional[Any]:
+    """Находит колонку с последним появлением в наличии"""
+    for col in columns:
+        if not isinstance(col, str):
+            continue
+        if 'Последнее появление' in col or 'появление в наличии' in col:
+            return col
+    return None
+
+
+def _column_index(ref: str) -> int:
+    """Преобразует ссылку на ячейку (например, 'AB12') в индекс колонки с нуля"""
+    index = 0
+    for ch in ref:
+        if ch.isdigit():
+            break
+        index = index * 26 + (ord(ch) - 64)
+    return index - 1
+
+
+def _first_sheet_path(archive: zipfile.ZipFile) -> str:
+    """Возвращает путь к XML первого листа книги (как pd.read_excel с sheet_name=0)"""
+    workbook = fromstring(archive.read('xl/workbook.xml'))
+    sheets = workbook.find(_MAIN_NS + 'sheets')
+    first_sheet = sheets[0]
+    rel_id = first_sheet.get(_REL_NS + 'id')
+
+    rels = fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for rel in rels.iter(_PKG_REL_NS + 'Relationship'):
+        if rel.get('Id') == rel_id:
+            target = rel.get('Target')
+            if target.startswith('/'):
+                return target.lstrip('/')
+            return posixpath.normpath(posixpath.join('xl', target))
+    return 'xl/worksheets/sheet1.xml'
+
+
+def _uses_1904_epoch(archive: zipfile.ZipFile) -> bool:
+    """Проверяет, использует ли книга систему дат 1904"""
+    workbook = fromstring(archive.read('xl/workbook.xml'))
+    props = workbook.find(_MAIN_NS + 'workbookPr')
+    if props is None:
+        return False
+    return props.get('date1904') in ('1', 'true')
+
+
+def _read_shared_strings(archive: zipfile.ZipFile) -> List[str]:
+    """Читает таблицу общих строк"""
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as fh:
+        for _, element in iterparse(fh):
+            if element.tag == _SI_TAG:
+                strings.append(''.join(element.itertext()))
+                element.clear()
+    return strings
+
+
+def _read_date_styles(archive: zipfile.ZipFile) -> set:
+    """Возвращает индексы стилей ячеек (cellXfs), которые форматируют дату"""
+    if 'xl/styles.xml' not in archive.namelist():
+        return set()
+    styles = fromstring(archive.read('xl/styles.xml'))
+
+    custom_formats = {}
+    num_fmts = styles.find(_MAIN_NS + 'numFmts')
+    if num_fmts is not None:
+        for fmt in num_fmts:
+            custom_formats[int(fmt.get('numFmtId'))] = fmt.get('formatCode', '')
+
+    date_styles = set()
+    cell_xfs = styles.find(_MAIN_NS + 'cellXfs')
+    if cell_xfs is None:
+        return date_styles
+    for style_index, xf in enumerate(cell_xfs):
+        fmt_id = int(xf.get('numFmtId', 0))
+        fmt_code = custom_formats.get(fmt_id, BUILTIN_FORMATS.get(fmt_id, 'General'))
+        if is_date_format(fmt_code):
+            date_styles.add(style_index)
+    return date_styles
+
+
+def _cell_text(cell) -> Optional[str]:
+    """Возвращает текстовое содержимое ячейки (значение или inline строку)"""
+    value = cell.find(_VALUE_TAG)
+    if value is not None:
+        return value.text
+    inline = cell.find(_INLINE_TAG)
+    if inline is not None:
+        return ''.join(inline.itertext())
+    return None
+
+
+def _iter_sheet_rows(archive: zipfile.ZipFile, sheet_path: str, wanted: Optional[set]):
+    """
+    Потоково перебирает строки листа
+
+    Возвращает для каждой строки словарь {индекс колонки: (тип, текст, стиль)}
+    только для колонок из wanted (None - все колонки).
+    """
+    with archive.open(sheet_path) as fh:
+        for _, element in iterparse(fh):
+            if element.tag != _ROW_TAG:
+                continue
+            cells = {}
+            position = 0
+            for cell in element:
+                if cell.tag != _CELL_TAG:
+                    continue
+                ref = cell.get('r')
+                col = _column_index(ref) if ref else position
+                position = col + 1
+                if wanted is not None and col not in wanted:
+                    continue
+                text = _cell_text(cell)
+                if text is None:
+                    continue
+                cells[col] = (cell.get('t', 'n'), text, cell.get('s'))
+            element.clear()
+            yield cells
+
+
+def _scalar(cell_type: str, text: str, shared: List[str]) -> Any:
+    """Преобразует ячейку в скалярное значение так же, как это делает openpyxl"""
+    if cell_type == 's':
+        return shared[int(text)]
+    if cell_type in ('str', 'inlineStr'):
+        return text
+    if cell_type == 'b':
+        return text == '1'
+    if cell_type == 'e':
+        return None
+    if _INT_RE.match(text):
+        return int(text)
+    return float(text)
+
+
+class _StringColumn:
+    """Накопитель строковой колонки со словарным кодированием"""
+
+    def __init__(self, shared: List[str]):
+        self._shared = shared
+        self._codes: List[int] = []
+        self._extra: Dict[Any, int] = {}
+
+    def append(self, cell: Optional[Tuple[str, str, Optional[str]]]):
+        if cell is None:
+            self._codes.append(-1)
+            return
+        cell_type, text, _ = cell
+        if cell_type == 's':
+            # Индекс общей строки уже является кодом словаря
+            self._codes.append(int(text))
+            return
+        value = _scalar(cell_type, text, self._shared)
+        if value is None:
+            self._codes.append(-1)
+            return
+        code = self._extra.get(value)
+        if code is None:
+            code = len(self._shared) + len(self._extra)
+            self._extra[value] = code
+        self._codes.append(code)
+
+    def finish(self) -> Tuple[np.ndarray, List[Any]]:
+        """Возвращает (коды int32 с -1 для пропусков, уникальные значения)"""
+        raw = np.asarray(self._codes, dtype=np.int64)
+        present = raw >= 0
+        unique_raw, inverse = np.unique(raw[present], return_inverse=True)
+
+        extra_values = {code: value for value, code in self._extra.items()}
+        shared_size = len(self._shared)
+        values = [
+            self._shared[code] if code < shared_size else extra_values[code]
+            for code in unique_raw.tolist()
+        ]
+
+        codes = np.full(len(raw), -1, dtype=np.int32)
+        codes[present] = inverse.astype(np.int32)
+
+        na_values = np.array([isinstance(v, str) and v in _NA_STRINGS for v in values] + [False])
+        if na_values.any():
+            codes[na_values[codes]] = -1
+        return codes, values
+
+
+def _numeric_column(cells: List[Optional[Tuple[str, str, Optional[str]]]], shared: List[str]) -> np.ndarray:
+    """Собирает числовую колонку: int64 без пропусков, иначе float64 с NaN"""
+    values = np.full(len(cells), np.nan, dtype=np.float64)
+    for i, cell in enumerate(cells):
+        if cell is None:
+            continue
+        value = _scalar(cell[0], cell[1], shared)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[i] = value
+        elif isinstance(value, str):
+            try:
+                values[i] = float(value)
+            except ValueError:
+                pass
+    if not np.isnan(values).any() and np.all(np.mod(values, 1) == 0):
+        return values.astype(np.int64)
+    return values
+
+
+def _date_column(cells: List[Optional[Tuple[str, str, Optional[str]]]], shared: List[str],
+                 date_styles: set, epoch_1904: bool) -> np.ndarray:
+    """
+    Собирает колонку дат в datetime64[ns] (NaT для пропусков)
+
+    Числа со стилем даты переводятся из серийного формата Excel векторно,
+    остальные значения разбираются через pd.to_datetime(errors='coerce').
+    """
+    import pandas as pd
+
+    serials = np.full(len(cells), np.nan, dtype=np.float64)
+    fallback_idx = []
+    fallback_values = []
+    for i, cell in enumerate(cells):
+        if cell is None:
+            continue
+        cell_type, text, style = cell
+        if cell_type == 'n' and style is not None and int(style) in date_styles:
+            serials[i] = float(text)
+            continue
+        value = _scalar(cell_type, text, shared)
+        if value is not None:
+            fallback_idx.append(i)
+            fallback_values.append(value)
+
+    result = np.full(len(cells), np.datetime64('NaT'), dtype='datetime64[ns]')
+    has_serial = ~np.isnan(serials)
+    if has_serial.any():
+        serial = serials[has_serial]
+        if epoch_1904:
+            epoch = np.full(len(serial), _EPOCH_1904)
+        else:
+            # Ошибка Excel с 29.02.1900: до 60-го дня эпоха смещена на день
+            epoch = np.where(serial < 60, _EPOCH_1900 + np.timedelta64(1, 'D'), _EPOCH_1900)
+        micros = np.round(serial * 86400 * 1_000_000).astype(np.int64)
+        result[has_serial] = (epoch.astype('datetime64[us]') + micros.astype('timedelta64[us]')).astype('datetime64[ns]')
+    if fallback_idx:
+        parsed = pd.to_datetime(pd.Series(fallback_values, dtype=object), errors='coerce')
+        result[np.asarray(fallback_idx)] = parsed.to_numpy(dtype='datetime64[ns]')
+    return result
+
+
+def read_excel_columns(file_path: Path) -> Dict[str, Any]:
+    """
+    Читает из Excel файла только нужные колонки в колоночном виде
+
+    Возвращает словарь:
+        rows_count - количество строк данных
+        strings - {колонка: (коды int32, уникальные значения)} для COLUMN_MAPPING
+        favorites_count - np.ndarray (int64 или float64 с NaN) или None
+        last_in_stock - np.ndarray datetime64[ns] или None
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        sheet_path = _first_sheet_path(archive)
+        shared = _read_shared_strings(archive)
+        date_styles = _read_date_styles(archive)
+        epoch_1904 = _uses_1904_epoch(archive)
+
+        rows = _iter_sheet_rows(archive, sheet_path, wanted=None)
+        header_cells = next(rows, {})
+        header = {
+            col: _scalar(cell_type, text, shared)
+            for col, (cell_type, text, _) in header_cells.items()
+        }
+        header_names = [header[col] for col in sorted(header)]
+
+        string_cols = {col: COLUMN_MAPPING[name] for col, name in header.items() if name in COLUMN_MAPPING}
+        favorites_name = find_favorites_column(header_names)
+        stock_name = find_stock_column(header_names)
+        favorites_col = next((col for col, name in header.items() if name == favorites_name), None)
+        stock_col = next((col for col, name in header.items() if name == stock_name), None)
+
+        wanted = set(string_cols)
+        if favorites_col is not None:
+            wanted.add(favorites_col)
+        if stock_col is not None:
+            wanted.add(stock_col)
+
+        # Заголовок уже прочитан из общего итератора, дальше читаем только нужные колонки
+        rows.close()
+        rows = _iter_sheet_rows(archive, sheet_path, wanted=wanted)
+        next(rows, None)
+
+        accumulators = {col: _StringColumn(shared) for col in string_cols}
+        favorites_cells = []
+        stock_cells = []
+        trailing_empty = 0
+        rows_count = 0
+        for cells in rows:
+            rows_count += 1
+            trailing_empty = trailing_empty + 1 if not cells else 0
+            for col, acc in accumulators.items():
+                acc.append(cells.get(col))
+            if favorites_col is not None:
+                favorites_cells.append(cells.get(favorites_col))
+            if stock_col is not None:
+                stock_cells.append(cells.get(stock_col))
+
+    # Как и pandas, отбрасываем пустые строки в конце листа
+    rows_count -= trailing_empty
+    strings = {}
+    for col, acc in accumulators.items():
+        codes, values = acc.finish()
+        strings[string_cols[col]] = (codes[:rows_count], values)
+
+    favorites = None
+    if favorites_col is not None:
+        favorites = _numeric_column(favorites_cells[:rows_count], shared)
+
+    last_in_stock = None
+    if stock_col is not None:
+        last_in_stock = _date_column(stock_cells[:rows_count], shared, date_styles, epoch_1904)
+
+    return {
+        'rows_count': rows_count,
+        'strings': strings,
+        'favorites_count': favorites,
+        'last_in_stock': last_in_stock,
+    }
+
+
+def decode_strings(codes: np.ndarray, values: List[Any]) -> np.ndarray:
+    """Декодирует словарную колонку в object массив (NaN для пропусков)"""
+    lookup = np.empty(len(values) + 1, dtype=object)
+    lookup[:len(values)] = values
+    lookup[len(values)] = np.nan
+    return lookup[np.where(codes < 0, len(values), codes)]
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    from app.services.excel_loader import ExcelLoader
+
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else os.getenv("DATA_DIR", "data")
+    report = ExcelLoader(data_dir).benchmark_engines()
+    print(f"{'Файл':<70} {'строк':>7} {'pandas, с':>10} {'stream, с':>10} {'строк/с':>10} {'ускорение':>10}")
+    for item in report:
+        print(f"{item['file']:<70} {item['rows']:>7} {item['pandas_seconds']:>10.2f} "
+              f"{item['stream_seconds']:>10.2f} {item['stream_rows_per_sec']:>10.0f} {item['speedup']:>9.1f}x")
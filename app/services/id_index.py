@@ -0,0 +1,102 @@
+"""
+Хэш-индекс ID товара -> позиции строк каталога
+
+Ключом индекса служит uint64 ключ ID (см. product_keys), позиции строк одного
+ID хранятся в общем массиве, сгруппированными по ID (CSR). Поиск и проверка
+наличия выполняются за O(1) без сканирования колонки id.
+"""
+import copy
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from app.services.product_keys import ids_to_keys, product_key
+
+
+class ProductIdIndex:
+    """Индекс ID товара -> позиции строк, поддерживаемый при изменениях каталога"""
+
+    def __init__(self, ids: Sequence[str]):
+        codes, uniques = pd.factorize(pd.Series(ids, dtype=object), use_na_sentinel=False)
+        self._ids: List[str] = uniques.tolist()
+        self._groups: Dict[int, int] = {}
+        # ID с совпавшим uint64 ключом (возможно только для ID нестандартного вида)
+        self._overflow: Dict[str, int] = {}
+        for group, key in enumerate(ids_to_keys(self._ids).tolist()):
+            if self._groups.setdefault(key, group) != group:
+                self._overflow[self._ids[group]] = group
+        self._rows = len(codes)
+        self._set_entries(codes.astype(np.int64), np.arange(len(codes), dtype=np.int64))
+
+    def _set_entries(self, groups: np.ndarray, positions: np.ndarray):
+        """Перестраивает сгруппированный массив позиций"""
+        order = np.argsort(groups, kind="stable")
+        self._positions = positions[order]
+        self._offsets = np.zeros(len(self._ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(groups, minlength=len(self._ids)), out=self._offsets[1:])
+        # Позиции строк, добавленных после построения (группа -> позиции)
+        self._appended: Dict[int, List[int]] = {}
+
+    def _group(self, product_id: str) -> Optional[int]:
+        group = self._groups.get(product_key(product_id))
+        if group is not None and self._ids[group] == product_id:
+            return group
+        return self._overflow.get(product_id)
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def __contains__(self, product_id: str) -> bool:
+        return len(self.positions(product_id)) > 0
+
+    def positions(self, product_id: str) -> np.ndarray:
+        """Позиции строк товара (по возрастанию), пустой массив если товара нет"""
+        group = self._group(product_id)
+        if group is None:
+            return np.empty(0, dtype=np.int64)
+        positions = np.empty(0, dtype=np.int64)
+        if group < len(self._offsets) - 1:
+            positions = self._positions[self._offsets[group]:self._offsets[group + 1]]
+        appended = self._appended.get(group)
+        if appended:
+            positions = np.concatenate([positions, np.array(appended, dtype=np.int64)])
+        return positions
+
+    def copy(self) -> 'ProductIdIndex':
+        """Копия для изменения: исходный индекс остается за опубликованной версией каталога"""
+        clone = copy.copy(self)
+        clone._ids = list(self._ids)
+        clone._groups = dict(self._groups)
+        clone._overflow = dict(self._overflow)
+        clone._appended = {group: list(items) for group, items in self._appended.items()}
+        return clone
+
+    def append(self, ids: Sequence[str]):
+        """Регистрирует строки, добавленные в конец каталога"""
+        for product_id in ids:
+            group = self._group(product_id)
+            if group is None:
+                group = len(self._ids)
+                self._ids.append(product_id)
+                if self._groups.setdefault(product_key(product_id), group) != group:
+                    self._overflow[product_id] = group
+            self._appended.setdefault(group, []).append(self._rows)
+            self._rows += 1
+
+    def delete(self, positions: np.ndarray):
+        """Удаляет строки и сдвигает позиции последующих (как reset_index после фильтра)"""
+        removed = np.unique(np.asarray(positions, dtype=np.int64))
+        if len(removed) == 0:
+            return
+        groups = np.repeat(np.arange(len(self._offsets) - 1, dtype=np.int64), np.diff(self._offsets))
+        all_positions = self._positions
+        if self._appended:
+            appended_groups = [g for g, items in self._appended.items() for _ in items]
+            appended_positions = [p for items in self._appended.values() for p in items]
+            groups = np.concatenate([groups, np.array(appended_groups, dtype=np.int64)])
+            all_positions = np.concatenate([all_positions, np.array(appended_positions, dtype=np.int64)])
+        keep = ~np.isin(all_positions, removed)
+        groups, kept = groups[keep], all_positions[keep]
+        self._rows -= int(np.isin(removed, all_positions).sum())
+        self._set_entries(groups, kept - np.searchsorted(removed, kept))
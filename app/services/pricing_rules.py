@@ -0,0 +1,294 @@
+"""
+Правила ценообразования
+
+Уровни спроса, веса приоритета и рекомендации метрик ценообразования и анализа
+цен конкурентов задаются декларативно. По умолчанию действуют встроенные правила.
+Их можно переопределить JSON-файлом из PRICING_RULES_FILE: секции, которых нет
+в файле, берутся из встроенных правил. Изменение файла подхватывается каждым
+воркером при следующем запросе.
+
+    {
+      "demand_tiers": [
+        {"level": "high", "quantile": 0.75, "score": 3},
+        {"level": "medium", "quantile": 0.25, "score": 2},
+        {"level": "low", "score": 1}
+      ],
+      "priority_weights": {"favorites_count": 70, "days_out_of_stock": 30},
+      "pricing_recommendations": [
+        {"when": [["demand_level", "==", "high"], ["days_out_of_stock", ">", 30]],
+         "recommendation": "Критично: ..."},
+        {"recommendation": "Низкий приоритет: мониторинг ситуации."}
+      ],
+      "price_recommendations": [
+        {"when": [["price_diff_percent", ">", 15]], "recommendation": "..."},
+        {"recommendation": "..."}
+      ]
+    }
+
+Правило срабатывает, если выполнены все его условия [колонка, оператор, значение].
+Из нескольких правил действует первое подходящее, правило без условий - значение
+по умолчанию. Набор правил компилируется в маски над колонками всех товаров и
+применяется одним np.select, без вызова Python-функции на каждую строку.
+"""
+import copy
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.result_cache import get_result_cache, register_dependency_check
+
+
+DEFAULT_RULES: Dict[str, Any] = {
+    # Уровни спроса по квантилям суммы добавлений в избранное (последний - остальные)
+    "demand_tiers": [
+        {"level": "high", "quantile": 0.75, "score": 3},
+        {"level": "medium", "quantile": 0.25, "score": 2},
+        {"level": "low", "score": 1},
+    ],
+    # Приоритет 0-100: доли от максимума по выборке с весами
+    "priority_weights": {"favorites_count": 70, "days_out_of_stock": 30},
+    # Рекомендации метрик ценообразования (пополнение)
+    "pricing_recommendations": [
+        {"when": [["demand_level", "==", "high"], ["days_out_of_stock", ">", 30]],
+         "recommendation": "Критично: высокий спрос, товар отсутствует более месяца. Срочное пополнение."},
+        {"when": [["demand_level", "==", "high"]],
+         "recommendation": "Высокий приоритет: высокий спрос, рекомендуется пополнить в ближайшее время."},
+        {"when": [["days_out_of_stock", ">", 60]],
+         "recommendation": "Средний приоритет: товар отсутствует длительное время, рассмотреть пополнение."},
+        {"recommendation": "Низкий приоритет: мониторинг ситуации."},
+    ],
+    # Рекомендации по разнице нашей цены и средней цены конкурентов (в процентах)
+    "price_recommendations": [
+        {"when": [["price_diff_percent", ">", 15]],
+         "recommendation": "⚠️ Наша цена значительно выше конкурентов. Рекомендуется снизить цену для конкурентоспособности."},
+        {"when": [["price_diff_percent", ">", 5]],
+         "recommendation": "📊 Наша цена немного выше средней. Можно рассмотреть небольшое снижение."},
+        {"when": [["price_diff_percent", "<", -15]],
+         "recommendation": "💰 Наша цена значительно ниже конкурентов. Можно рассмотреть повышение цены."},
+        {"when": [["price_diff_percent", "<", -5]],
+         "recommendation": "✅ Наша цена ниже конкурентов. Хорошая позиция для привлечения клиентов."},
+        {"recommendation": "✅ Наша цена в среднем диапазоне. Конкурентная позиция."},
+    ],
+}
+
+_OPERATORS = {
+    '==': np.equal,
+    '!=': np.not_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+}
+
+
+class Condition:
+    """Условие правила: колонка, оператор и значение"""
+
+    def __init__(self, column: str, op: str, value: Any):
+        if op not in _OPERATORS and op != 'in':
+            raise ValueError(f"Неизвестный оператор условия: {op}")
+        if op == 'in' and not isinstance(value, (list, tuple)):
+            raise ValueError(f"Оператор in требует список значений: {column}")
+        self.column = column
+        self.op = op
+        self.value = value
+
+    def mask(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        if self.column not in columns:
+            raise ValueError(f"Неизвестная колонка в правиле: {self.column}")
+        values = columns[self.column]
+        if self.op == 'in':
+            return np.isin(values, list(self.value))
+        with np.errstate(invalid='ignore'):
+            return np.asarray(_OPERATORS[self.op](values, self.value), dtype=bool)
+
+    def to_list(self) -> list:
+        return [self.column, self.op, self.value]
+
+
+class RuleSet:
+    """Упорядоченные правила «условия -> рекомендация» (первое подходящее)"""
+
+    def __init__(self, rules: Sequence[Dict[str, Any]]):
+        self.rules: List[Tuple[List[Condition], str]] = []
+        self.default = ""
+        for rule in rules:
+            if "recommendation" not in rule:
+                raise ValueError("В правиле нет рекомендации")
+            conditions = []
+            for condition in rule.get("when") or []:
+                if not isinstance(condition, (list, tuple)) or len(condition) != 3:
+                    raise ValueError(f"Условие должно быть [колонка, оператор, значение]: {condition}")
+                conditions.append(Condition(*condition))
+            if not conditions:
+                # Правило без условий - значение по умолчанию, следующие правила недостижимы
+                self.default = str(rule["recommendation"])
+                break
+            self.rules.append((conditions, str(rule["recommendation"])))
+
+    def apply(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """Рекомендация для каждого элемента колонок (массив строк)"""
+        size = len(next(iter(columns.values()))) if columns else 0
+        choices = np.array([text for _, text in self.rules] + [self.default], dtype=object)
+        masks = []
+        for conditions, _ in self.rules:
+            mask = np.ones(size, dtype=bool)
+            for condition in conditions:
+                mask &= condition.mask(columns)
+            masks.append(mask)
+        codes = np.select(masks, np.arange(len(self.rules)), default=len(self.rules)) if masks \
+            else np.full(size, 0, dtype=np.int64)
+        return choices[codes]
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        rules = [{"when": [c.to_list() for c in conditions], "recommendation": text}
+                 for conditions, text in self.rules]
+        return rules + [{"recommendation": self.default}]
+
+
+class PricingRules:
+    """Уровни спроса, веса приоритета и наборы рекомендаций"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = {**DEFAULT_RULES, **(config or {})}
+        self.tiers = [dict(tier) for tier in config["demand_tiers"]]
+        if not self.tiers or any("level" not in tier for tier in self.tiers):
+            raise ValueError("Уровни спроса должны содержать level")
+        if any("quantile" not in tier for tier in self.tiers[:-1]):
+            raise ValueError("Все уровни спроса, кроме последнего, должны содержать quantile")
+        weights = config["priority_weights"]
+        self.favorites_weight = float(weights.get("favorites_count", 0))
+        self.days_weight = float(weights.get("days_out_of_stock", 0))
+        self.pricing = RuleSet(config["pricing_recommendations"])
+        self.price = RuleSet(config["price_recommendations"])
+
+    def demand_tiers(self, favorites: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Уровень спроса и его балл для каждого товара (пороги - квантили по выборке)"""
+        favorites = np.asarray(favorites, dtype=np.float64)
+        levels = np.array([str(tier["level"]) for tier in self.tiers], dtype=object)
+        scores = np.array([tier.get("score", 0) for tier in self.tiers])
+        if len(favorites) == 0:
+            return levels[:0], scores[:0]
+        quantiles = [float(tier["quantile"]) for tier in self.tiers[:-1]]
+        thresholds = np.quantile(favorites, quantiles) if quantiles else []
+        masks = [favorites >= threshold for threshold in thresholds]
+        codes = np.select(masks, np.arange(len(masks)), default=len(self.tiers) - 1) if masks \
+            else np.zeros(len(favorites), dtype=np.int64)
+        return levels[codes], scores[codes]
+
+    def priority(self, favorites: np.ndarray, days: np.ndarray) -> np.ndarray:
+        """
+        Приоритет 0-100: спрос и дни отсутствия с весами
+
+        Оба слагаемых нормируются на максимум по всем товарам выборки (а не только
+        по попавшим в ответ), поэтому оценка товара не зависит от limit.
+        """
+        favorites = np.asarray(favorites, dtype=np.float64)
+        days = np.asarray(days, dtype=np.float64)
+        max_favorites = np.nanmax(favorites) if len(favorites) else 0.0
+        max_days = np.nanmax(days) if len(days) else 0.0
+        demand = favorites / max_favorites if max_favorites > 0 else np.zeros_like(favorites)
+        absence = days / max_days if max_days > 0 else np.zeros_like(days)
+        return np.clip(demand * self.favorites_weight + absence * self.days_weight, 0, 100)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "demand_tiers": copy.deepcopy(self.tiers),
+            "priority_weights": {"favorites_count": self.favorites_weight,
+                                 "days_out_of_stock": self.days_weight},
+            "pricing_recommendations": self.pricing.to_list(),
+            "price_recommendations": self.price.to_list(),
+        }
+
+
+def load_pricing_rules(path: Optional[str] = None) -> PricingRules:
+    """Правила из JSON-файла (по умолчанию - PRICING_RULES_FILE) или встроенные"""
+    path = path or os.getenv("PRICING_RULES_FILE")
+    if not path:
+        return PricingRules()
+    with open(path, encoding="utf-8") as file:
+        config = json.load(file)
+    if not isinstance(config, dict):
+        raise ValueError("Файл правил должен содержать JSON-объект")
+    return PricingRules(config)
+
+
+# Глобальный экземпляр (заменяется целиком при перезагрузке) и его источник:
+# (путь к файлу правил, отметка файла при чтении)
+_rules_instance: Optional[PricingRules] = None
+_rules_source: Tuple[Optional[str], Optional[Tuple[int, int]]] = (None, None)
+_rules_lock = threading.Lock()
+
+
+def _file_stamp(path: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Отметка файла правил (время изменения, размер) или None, если файла нет"""
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_pricing_rules() -> PricingRules:
+    """Получает текущие правила ценообразования (singleton, следит за изменением файла)"""
+    refresh_pricing_rules()
+    return _rules_instance
+
+
+def refresh_pricing_rules() -> None:
+    """
+    Перечитывает правила, если файл, из которого они загружены, изменился
+
+    Каждый воркер uvicorn держит свои правила, поэтому изменение файла (или
+    перезагрузка в другом воркере) подхватывается по отметке файла при следующем
+    обращении; кэш результатов воркера при этом сбрасывается. При ошибке в файле
+    действуют прежние правила.
+    """
+    global _rules_instance, _rules_source
+    path = _rules_source[0] if _rules_instance is not None else os.getenv("PRICING_RULES_FILE")
+    stamp = _file_stamp(path)
+    if _rules_instance is not None and (path, stamp) == _rules_source:
+        return
+    with _rules_lock:
+        if _rules_instance is not None and (path, stamp) == _rules_source:
+            return
+        changed = _rules_instance is not None
+        try:
+            _rules_instance = load_pricing_rules(path)
+        except (OSError, ValueError, TypeError) as e:
+            if _rules_instance is None:
+                print(f"⚠️ Не удалось загрузить правила ценообразования: {e}. Используются встроенные")
+                _rules_instance = PricingRules()
+            else:
+                print(f"⚠️ Не удалось перечитать правила ценообразования: {e}. Действуют прежние")
+            changed = False
+        _rules_source = (path, stamp)
+    if changed:
+        get_result_cache().clear()
+        print("✅ Правила ценообразования перечитаны: файл изменился")
+
+
+def reload_pricing_rules(path: Optional[str] = None) -> PricingRules:
+    """
+    Перечитывает правила из файла и сбрасывает кэш результатов
+
+    При ошибке в файле действуют прежние правила, ошибка передается вызывающему.
+    """
+    global _rules_instance, _rules_source
+    path = path or os.getenv("PRICING_RULES_FILE")
+    stamp = _file_stamp(path)
+    rules = load_pricing_rules(path)
+    with _rules_lock:
+        _rules_instance = rules
+        _rules_source = (path, stamp)
+    get_result_cache().clear()
+    print("✅ Правила ценообразования перезагружены")
+    return rules
+
+
+register_dependency_check(refresh_pricing_rules)
@@ -0,0 +1,103 @@
+"""
+Идентификаторы товаров
+
+Внешний ID товара - первые 16 hex-символов md5 от "name|brand|link". Эти же
+8 байт дайджеста, прочитанные как big-endian uint64, служат компактным
+внутренним ключом: ID и ключ однозначно переводятся друг в друга.
+"""
+import hashlib
+from typing import Any, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+# ASCII-коды hex-символов и обратная таблица (255 - не hex-символ)
+_HEX_CHARS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+_HEX_VALUES = np.full(256, 255, dtype=np.uint8)
+_HEX_VALUES[_HEX_CHARS] = np.arange(16, dtype=np.uint8)
+_HEX_DIGITS = frozenset("0123456789abcdef")
+
+
+def product_id_for(name: Any, brand: Any, link: Any) -> str:
+    """ID одного товара (формат ключа совпадает с построчной генерацией)"""
+    return hashlib.md5(f"{name}|{brand}|{link}".encode()).hexdigest()[:16]
+
+
+def _key_strings(name: Optional[pd.Series], brand: Optional[pd.Series],
+                 link: Optional[pd.Series], rows_count: int) -> pd.Series:
+    """Склеивает "name|brand|link" по колонкам (отсутствующая колонка -> '')"""
+    parts = []
+    for values in (name, brand, link):
+        if values is None:
+            parts.append(pd.Series([''] * rows_count, dtype=object))
+        else:
+            # astype(str) дает то же представление, что и f-строка ('nan' для пропусков)
+            parts.append(pd.Series(values, copy=False).reset_index(drop=True).astype(str))
+    return parts[0] + '|' + parts[1] + '|' + parts[2]
+
+
+def hash_keys(keys: Sequence[str]) -> np.ndarray:
+    """Хэширует строки ключей в uint64 (первые 8 байт md5)"""
+    md5 = hashlib.md5
+    digests = b"".join([md5(key.encode()).digest()[:8] for key in keys])
+    return np.frombuffer(digests, dtype=">u8").astype(np.uint64)
+
+
+def keys_to_ids(keys: np.ndarray) -> np.ndarray:
+    """Переводит uint64 ключи в 16-символьные hex ID (object массив строк)"""
+    digest_bytes = np.ascontiguousarray(keys, dtype=">u8").view(np.uint8).reshape(-1, 8)
+    chars = np.empty((len(digest_bytes), 16), dtype=np.uint8)
+    chars[:, 0::2] = _HEX_CHARS[digest_bytes >> 4]
+    chars[:, 1::2] = _HEX_CHARS[digest_bytes & 0x0F]
+    return chars.view("S16").ravel().astype("U16").astype(object)
+
+
+def ids_to_keys(ids: Sequence[Any]) -> np.ndarray:
+    """
+    Переводит ID в uint64 ключи
+
+    Для ID в стандартном формате ключ - это их hex-значение. ID другого вида
+    (демо-данные, ID, заданные вручную) хэшируются тем же md5.
+    """
+    ids = list(ids)
+    if not ids:
+        return np.array([], dtype=np.uint64)
+    raw = [str(product_id).encode() for product_id in ids]
+    lengths = np.fromiter(map(len, raw), dtype=np.int64, count=len(raw))
+    encoded = np.array(raw, dtype="S16")
+    nibbles = _HEX_VALUES[encoded.view(np.uint8).reshape(-1, 16)]
+    standard = (lengths == 16) & (nibbles != 255).all(axis=1)
+
+    keys = np.zeros(len(ids), dtype=np.uint64)
+    if standard.any():
+        values = nibbles[standard].astype(np.uint64)
+        shifts = np.arange(60, -1, -4, dtype=np.uint64)
+        keys[standard] = np.bitwise_or.reduce(values << shifts, axis=1)
+    for i in np.flatnonzero(~standard).tolist():
+        keys[i] = product_key(ids[i])
+    return keys
+
+
+def product_key(product_id: Any) -> int:
+    """uint64 ключ одного ID"""
+    product_id = str(product_id)
+    if len(product_id) == 16 and _HEX_DIGITS.issuperset(product_id):
+        return int(product_id, 16)
+    return int.from_bytes(hashlib.md5(product_id.encode()).digest()[:8], "big")
+
+
+def build_product_ids(name: Optional[pd.Series], brand: Optional[pd.Series],
+                      link: Optional[pd.Series], rows_count: int) -> np.ndarray:
+    """
+    Строит ID товаров по колонкам name/brand/link
+
+    Ключи склеиваются поколоночно, md5 считается один раз на уникальный ключ,
+    hex-строки собираются векторно из uint64. Результат совпадает с построчным
+    product_id_for.
+    """
+    if rows_count == 0:
+        return np.array([], dtype=object)
+    codes, uniques = pd.factorize(_key_strings(name, brand, link, rows_count))
+    return keys_to_ids(hash_keys(uniques.tolist()))[codes]
+
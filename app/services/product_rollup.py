@@ -0,0 +1,294 @@
+"""
+Сводка по товарам версии каталога
+
+Аналитические методы группируют строки по ID товара. Сводка хранит для каждой строки
+номер товара (товары упорядочены по ID, как в groupby('id')) и материализованную
+таблицу по всему каталогу - строку на товар:
+- favorites_count - сумма добавлений в избранное;
+- days_out_of_stock - максимум дней отсутствия;
+- last_in_stock - самая ранняя дата наличия;
+- period_start / period_end - первый и последний период;
+- name, brand, category_level_1 - первое непустое значение;
+- first_row - позиция первой строки товара.
+
+Запрос без фильтров читает готовую таблицу. Для отфильтрованных строк (категория,
+период, пороги) та же сводка считается только по их позициям через номера товаров -
+bincount и reduceat без groupby, с той же семантикой, что у groupby по строкам.
+
+Таблица строится один раз на версию; при изменении товаров через CRUD новая версия
+получает сводку, в которой пересчитаны только затронутые товары.
+"""
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+# Колонки «первое непустое значение»
+FIRST_COLUMNS = ('name', 'brand', 'category_level_1')
+
+# Колонки дат: (колонка, агрегат)
+DATE_COLUMNS = (('last_in_stock', 'min'), ('period_start', 'min'), ('period_end', 'max'))
+
+ROLLUP_COLUMNS = ('id',) + FIRST_COLUMNS + (
+    'favorites_count', 'days_out_of_stock', 'last_in_stock', 'period_start', 'period_end', 'first_row'
+)
+
+
+def _dates(values: pd.Series) -> np.ndarray:
+    """Даты (date) -> datetime64[D] с NaT для пропусков"""
+    return pd.to_datetime(values, errors='coerce').to_numpy(dtype='datetime64[D]')
+
+
+def row_dates(df: pd.DataFrame, positions: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """Колонки дат строк (все или positions) в виде datetime64[D]"""
+    if positions is None:
+        return {column: _dates(df[column]) for column, _ in DATE_COLUMNS}
+    return {column: _dates(df[column].iloc[positions]) for column, _ in DATE_COLUMNS}
+
+
+def aggregate_rows(df: pd.DataFrame, positions: np.ndarray, codes: np.ndarray,
+                   ids: np.ndarray, dates: Optional[Dict[str, np.ndarray]] = None) -> pd.DataFrame:
+    """
+    Сводка по товарам для строк с позициями positions
+
+    «Первые» значения и first_row берутся в порядке positions, как у groupby по
+    строкам в этом порядке. codes - номера товаров строк каталога, ids - ID товаров
+    по номерам, dates - даты строк каталога (datetime64[D]), если уже посчитаны.
+    Товары в результате упорядочены по ID.
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    row_codes = codes[positions]
+    valid = row_codes >= 0
+    if not valid.all():
+        positions, row_codes = positions[valid], row_codes[valid]
+    products, inverse = np.unique(row_codes, return_inverse=True)
+    count = len(products)
+    result = {'id': ids[products]}
+    if count == 0:
+        table = pd.DataFrame({column: pd.Series(dtype=object) for column in ROLLUP_COLUMNS})
+        return table.astype({'favorites_count': np.int64, 'first_row': np.int64})
+
+    # Строки, сгруппированные по товару (внутри товара - в порядке каталога)
+    order = np.argsort(inverse, kind='stable')
+    starts = np.flatnonzero(np.r_[True, inverse[order][1:] != inverse[order][:-1]])
+    sorted_positions = positions[order]
+
+    for column in FIRST_COLUMNS:
+        values = df[column].to_numpy(dtype=object)[positions]
+        present = pd.notna(values)
+        first = np.full(count, None, dtype=object)
+        if present.any():
+            groups, first_index = np.unique(inverse[present], return_index=True)
+            first[groups] = values[present][first_index]
+        result[column] = first
+
+    favorites = df['favorites_count'].to_numpy(dtype=np.float64, na_value=0.0)[positions]
+    result['favorites_count'] = np.bincount(inverse, weights=np.nan_to_num(favorites),
+                                            minlength=count).round().astype(np.int64)
+
+    days = df['days_out_of_stock'].to_numpy(dtype=np.float64, na_value=np.nan)[sorted_positions]
+    with np.errstate(invalid='ignore'):
+        result['days_out_of_stock'] = np.fmax.reduceat(days, starts)
+
+    for column, how in DATE_COLUMNS:
+        values = dates[column][sorted_positions] if dates is not None else _dates(df[column].iloc[sorted_positions])
+        reduce = np.fmin if how == 'min' else np.fmax
+        result[column] = reduce.reduceat(values, starts).astype(object)
+
+    result['first_row'] = sorted_positions[starts]
+    table = pd.DataFrame(result, columns=list(ROLLUP_COLUMNS))
+    for column, _ in DATE_COLUMNS:
+        table[column] = table[column].where(table[column].notna(), None)
+    return table
+
+
+class ProductRollup:
+    """Номера товаров строк и материализованная сводка по всему каталогу"""
+
+    def __init__(self, df: pd.DataFrame, codes: Optional[np.ndarray] = None,
+                 ids: Optional[np.ndarray] = None, table: Optional[pd.DataFrame] = None,
+                 dates: Optional[Dict[str, np.ndarray]] = None):
+        if codes is None:
+            codes, ids = pd.factorize(df['id'], sort=True)
+            ids = np.asarray(ids, dtype=object)
+        self.codes = np.asarray(codes, dtype=np.int64)
+        self.ids = ids
+        self.dates = dates if dates is not None else row_dates(df)
+        if table is None:
+            table = aggregate_rows(df, np.arange(len(df), dtype=np.int64), self.codes, self.ids, self.dates)
+        self.table = table
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def aggregate(self, df: pd.DataFrame, positions: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """
+        Сводка по товарам для строк positions
+
+        None - готовая таблица всего каталога (общая для всех запросов версии,
+        изменять ее нельзя).
+        """
+        if positions is None:
+            return self.table
+        return aggregate_rows(df, positions, self.codes, self.ids, self.dates)
+
+    def measures(self, df: pd.DataFrame, positions: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """
+        Числовые агрегаты товаров строк positions без сборки таблицы
+
+        products - номера товаров (по возрастанию, то есть по ID), favorites_count -
+        сумма, days_out_of_stock - максимум (NaN - нет данных). None - все строки
+        (готовые колонки таблицы).
+        """
+        if positions is None:
+            return {
+                'products': np.arange(len(self.ids), dtype=np.int64),
+                'favorites_count': self.table['favorites_count'].to_numpy(dtype=np.int64),
+                'days_out_of_stock': self.table['days_out_of_stock'].to_numpy(dtype=np.float64),
+            }
+        positions = np.asarray(positions, dtype=np.int64)
+        row_codes = self.codes[positions]
+        valid = row_codes >= 0
+        if not valid.all():
+            positions, row_codes = positions[valid], row_codes[valid]
+        count = len(self.ids)
+        products = np.flatnonzero(np.bincount(row_codes, minlength=count))
+        favorites = df['favorites_count'].to_numpy(dtype=np.float64, na_value=0.0)[positions]
+        sums = np.bincount(row_codes, weights=np.nan_to_num(favorites), minlength=count)
+        days = np.full(count, -np.inf)
+        np.fmax.at(days, row_codes, df['days_out_of_stock'].to_numpy(dtype=np.float64, na_value=np.nan)[positions])
+        days = days[products]
+        days[np.isneginf(days)] = np.nan
+        return {
+            'products': products,
+            'favorites_count': sums[products].round().astype(np.int64),
+            'days_out_of_stock': days,
+        }
+
+    def select(self, df: pd.DataFrame, positions: Optional[np.ndarray], products: np.ndarray) -> pd.DataFrame:
+        """Сводка только по товарам products (номера, в заданном порядке) по строкам positions"""
+        products = np.asarray(products, dtype=np.int64)
+        if positions is None:
+            return self.table.iloc[products].reset_index(drop=True)
+        # Строки выбранных товаров (номер -1 указывает на последний, всегда ложный, элемент)
+        wanted = np.zeros(len(self.ids) + 1, dtype=bool)
+        wanted[products] = True
+        positions = np.asarray(positions, dtype=np.int64)
+        table = aggregate_rows(df, positions[wanted[self.codes[positions]]], self.codes, self.ids, self.dates)
+        order = np.searchsorted(np.sort(products), products)
+        return table.iloc[order].reset_index(drop=True)
+
+    def group_measures(self, df: pd.DataFrame, positions: Optional[np.ndarray],
+                       row_groups: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Суммы спроса по парам (группа строки, товар) для строк positions
+
+        row_groups - номер группы каждой строки каталога (-1 - нет группы). Товар,
+        строки которого относятся к разным группам (например, к нескольким категориям),
+        попадает в каждую из них со своими строками. Пары упорядочены по группе, затем по ID.
+        """
+        if positions is None:
+            positions = np.arange(len(self.codes), dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+        row_codes = self.codes[positions]
+        groups = np.asarray(row_groups, dtype=np.int64)[positions]
+        valid = (row_codes >= 0) & (groups >= 0)
+        positions, row_codes, groups = positions[valid], row_codes[valid], groups[valid]
+        span = max(len(self.ids), 1)
+        pairs, inverse = np.unique(groups * span + row_codes, return_inverse=True)
+        favorites = df['favorites_count'].to_numpy(dtype=np.float64, na_value=0.0)[positions]
+        sums = np.bincount(inverse, weights=np.nan_to_num(favorites), minlength=len(pairs))
+        return {
+            'groups': pairs // span,
+            'products': pairs % span,
+            'favorites_count': sums.round().astype(np.int64),
+        }
+
+    def select_groups(self, df: pd.DataFrame, positions: Optional[np.ndarray], row_groups: np.ndarray,
+                      groups: np.ndarray, products: np.ndarray) -> pd.DataFrame:
+        """Сводка по парам (группа, товар) в заданном порядке - только по строкам своей группы"""
+        if positions is None:
+            positions = np.arange(len(self.codes), dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+        span = max(len(self.ids), 1)
+        wanted = np.asarray(groups, dtype=np.int64) * span + np.asarray(products, dtype=np.int64)
+        # Номер пары каждой строки (-1 - строка не относится к выбранным парам)
+        row_groups = np.asarray(row_groups, dtype=np.int64)
+        row_codes = self.codes[positions]
+        keys = row_groups[positions] * span + row_codes
+        order = np.argsort(wanted)
+        found = np.searchsorted(wanted[order], keys)
+        found = np.minimum(found, max(len(wanted) - 1, 0))
+        matched = (row_codes >= 0) & (row_groups[positions] >= 0) & (len(wanted) > 0)
+        if len(wanted):
+            matched &= wanted[order][found] == keys
+        pair_codes = np.full(len(self.codes), -1, dtype=np.int64)
+        pair_codes[positions[matched]] = order[found[matched]]
+        return aggregate_rows(df, positions[matched], pair_codes, self.ids[np.asarray(products, dtype=np.int64)], self.dates)
+
+    def _rebuilt(self, df: pd.DataFrame, id_index, codes: np.ndarray, ids: np.ndarray,
+                 dates: Dict[str, np.ndarray], old_codes_for_new: np.ndarray,
+                 first_rows: np.ndarray, touched: Iterable[str]) -> "ProductRollup":
+        """Новая сводка: строки незатронутых товаров переносятся, затронутые пересчитываются"""
+        carried = old_codes_for_new >= 0
+        table = self.table.iloc[np.where(carried, old_codes_for_new, 0)].reset_index(drop=True)
+        table['id'] = ids
+        table['first_row'] = np.where(carried, first_rows, 0)
+        touched_positions = [id_index.positions(product_id) for product_id in set(touched)]
+        touched_positions = [positions for positions in touched_positions if len(positions)]
+        if touched_positions:
+            positions = np.sort(np.concatenate(touched_positions))
+            fresh = aggregate_rows(df, positions, codes, ids, dates)
+            rows = np.searchsorted(ids, fresh['id'].to_numpy(dtype=object))
+            for column in ROLLUP_COLUMNS:
+                values = table[column].to_numpy(dtype=object if table[column].dtype == object else None, copy=True)
+                values[rows] = fresh[column].to_numpy(dtype=values.dtype)
+                table[column] = values
+        return ProductRollup(df, codes, ids, table, dates)
+
+    def updated(self, df: pd.DataFrame, id_index, product_ids: Iterable[str]) -> "ProductRollup":
+        """Сводка после изменения значений у строк товаров (строки и ID не меняются)"""
+        product_ids = set(product_ids)
+        dates = {column: values.copy() for column, values in self.dates.items()}
+        positions = [id_index.positions(product_id) for product_id in product_ids]
+        positions = np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
+        for column, values in row_dates(df, positions).items():
+            dates[column][positions] = values
+        old_codes = np.arange(len(self.ids), dtype=np.int64)
+        return self._rebuilt(df, id_index, self.codes, self.ids, dates, old_codes,
+                             self.table['first_row'].to_numpy(), product_ids)
+
+    def appended(self, df: pd.DataFrame, id_index, new_ids: Iterable[str]) -> "ProductRollup":
+        """Сводка после добавления строк в конец каталога"""
+        new_ids = list(new_ids)
+        old_rows = len(self.codes)
+        ids = np.union1d(self.ids, np.asarray(new_ids, dtype=object)).astype(object)
+        remap = np.searchsorted(ids, self.ids)
+        codes = np.empty(len(df), dtype=np.int64)
+        codes[:old_rows] = np.where(self.codes >= 0, remap[self.codes], -1)
+        codes[old_rows:] = np.searchsorted(ids, df['id'].to_numpy(dtype=object)[old_rows:])
+        old_codes_for_new = np.full(len(ids), -1, dtype=np.int64)
+        old_codes_for_new[remap] = np.arange(len(self.ids))
+        first_rows = np.zeros(len(ids), dtype=np.int64)
+        first_rows[remap] = self.table['first_row'].to_numpy()
+        appended_dates = row_dates(df, np.arange(old_rows, len(df)))
+        dates = {column: np.concatenate([self.dates[column], appended_dates[column]])
+                 for column in self.dates}
+        return self._rebuilt(df, id_index, codes, ids, dates, old_codes_for_new, first_rows, new_ids)
+
+    def deleted(self, df: pd.DataFrame, id_index, keep: np.ndarray,
+                product_ids: Iterable[str]) -> "ProductRollup":
+        """Сводка после удаления строк (keep - маска оставшихся строк прежней версии)"""
+        remaining = np.zeros(len(self.ids), dtype=bool)
+        kept_codes = self.codes[keep]
+        remaining[kept_codes[kept_codes >= 0]] = True
+        # Новые номера товаров и позиции строк после удаления
+        product_remap = np.cumsum(remaining) - 1
+        codes = np.where(kept_codes >= 0, product_remap[np.maximum(kept_codes, 0)], -1)
+        ids = self.ids[remaining]
+        row_remap = np.cumsum(keep) - 1
+        old_codes_for_new = np.flatnonzero(remaining)
+        first_rows = row_remap[self.table['first_row'].to_numpy()[remaining]]
+        dates = {column: values[keep] for column, values in self.dates.items()}
+        return self._rebuilt(df, id_index, codes, ids, dates, old_codes_for_new, first_rows, product_ids)
@@ -1,10 +1,13 @@
 import pandas as pd
+import numpy as np
 from typing import List, Optional
 import os
 from pathlib import Path
 from datetime import date
 from app.services.excel_loader import get_loader
-from app.models import Product, ProductFilter
+from app.models import Product, ProductFilter, CategoryTreeNode
+from app.services.result_cache import cached_result
+from app.services.query_planner import QueryPlanner, predicates_from_filter, analytics_predicates
 
 
 class ProductService:
@@ -36,6 +39,7 @@ class ProductService:
             days_out_of_stock=int(row['days_out_of_stock']) if pd.notna(row['days_out_of_stock']) else None
         )
     
+    @cached_result
     def search_products(
         self,
         filters: ProductFilter,
@@ -43,60 +47,46 @@ class ProductService:
         page_size: int = 50
     ) -> tuple[List[Product], int]:
         """Поиск товаров с фильтрацией и пагинацией"""
-        # Используем кэш если доступен
-        if self.loader._cache is not None:
-            df = self.loader._cache
-        else:
-            df = self.loader.load_all_data()
-        
-        # Применяем фильтры
-        if filters.category_level_1:
-            df = df[df['category_level_1'] == filters.category_level_1]
-        if filters.category_level_2:
-            df = df[df['category_level_2'] == filters.category_level_2]
-        if filters.category_level_3:
-            df = df[df['category_level_3'] == filters.category_level_3]
-        if filters.category_level_4:
-            df = df[df['category_level_4'] == filters.category_level_4]
-        if filters.brand:
-            df = df[df['brand'] == filters.brand]
-        if filters.min_favorites_count is not None:
-            df = df[df['favorites_count'] >= filters.min_favorites_count]
-        if filters.period_start:
-            df = df[df['period_start'] >= filters.period_start]
-        if filters.period_end:
-            df = df[df['period_end'] <= filters.period_end]
-        if filters.out_of_stock_days is not None:
-            df = df[df['days_out_of_stock'] >= filters.out_of_stock_days]
+        # Текущая версия каталога (берется один раз на запрос)
+        snapshot = self.loader.get_catalog()
+        df = snapshot.df
         
-        total = len(df)
+        # Планировщик оценивает условия по индексам версии и выполняет их по позициям
+        # кандидатов или над битсетами; строки берутся один раз - только для страницы
+        result = QueryPlanner(snapshot).run(predicates_from_filter(filters))
+        total = result.total
         
-        # Пагинация
+        # Пагинация: декодируются и читаются только строки текущей страницы
         start_idx = (page - 1) * page_size
         end_idx = start_idx + page_size
-        df_page = df.iloc[start_idx:end_idx]
+        df_page = df.iloc[result.page(start_idx, end_idx)]
         
         # Конвертируем в модели
         products = [self._df_to_product(row) for _, row in df_page.iterrows()]
         
         return products, total
     
+    def explain_search(self, filters: ProductFilter) -> dict:
+        """План выполнения фильтра поиска (для отладки)"""
+        planner = QueryPlanner(self.loader.get_catalog())
+        plan = planner.plan(predicates_from_filter(filters))
+        planner.execute(plan)
+        return plan.explain()
+    
     def get_product_by_id(self, product_id: str) -> Optional[Product]:
         """Получает товар по ID"""
-        # Используем кэш если доступен
-        if self.loader._cache is not None:
-            df = self.loader._cache
-        else:
-            df = self.loader.load_all_data()
-        product_df = df[df['id'] == product_id]
+        # Поиск и чтение строки - в одной версии каталога
+        snapshot = self.loader.get_catalog()
+        positions = snapshot.positions(product_id)
         
-        if product_df.empty:
+        if len(positions) == 0:
             return None
         
         # Берем первую запись (если есть дубликаты)
-        row = product_df.iloc[0]
+        row = snapshot.df.iloc[positions[0]]
         return self._df_to_product(row)
     
+    @cached_result
     def get_out_of_stock_products(
         self,
         min_days: int = 15,
@@ -106,53 +96,50 @@ class ProductService:
         period_end: Optional[date] = None
     ) -> List[Product]:
         """Получает товары, отсутствующие в наличии более указанного количества дней"""
-        # Используем кэш если доступен
-        if self.loader._cache is not None:
-            df = self.loader._cache
-        else:
-            df = self.loader.load_all_data()
-        
-        # Фильтруем по дням отсутствия
-        df = df[df['days_out_of_stock'] >= min_days]
+        # Текущая версия каталога (берется один раз на запрос)
+        snapshot = self.loader.get_catalog()
+        df = snapshot.df
         
-        # Дополнительные фильтры
-        if category:
-            df = df[df['category_level_1'] == category]
-        if brand:
-            df = df[df['brand'] == brand]
-        if period_start:
-            df = df[df['period_start'] >= period_start]
-        if period_end:
-            df = df[df['period_end'] <= period_end]
+        # Дни отсутствия, категория, бренд и период - через планировщик
+        predicates = analytics_predicates(category, brand, period_start, period_end, min_days=min_days)
+        positions = QueryPlanner(snapshot).run(predicates).positions()
         
-        # Сортируем по количеству добавлений в избранное (по убыванию)
-        df = df.sort_values('favorites_count', ascending=False)
+        # Порядок по количеству добавлений в избранное (по убыванию) - по рангам индекса
+        positions = snapshot.sorted_index('favorites_count').sort_positions(positions, descending=True)
+        df = df.iloc[positions]
         
         products = [self._df_to_product(row) for _, row in df.iterrows()]
         return products
     
     def get_categories(self) -> List[str]:
         """Получает список всех категорий 1 уровня"""
-        # Используем кэш если доступен
-        if self.loader._cache is not None:
-            df = self.loader._cache
-        else:
-            df = self.loader.load_all_data()
-        categories = df['category_level_1'].dropna().unique().tolist()
-        return sorted([str(c) for c in categories])
+        # Значения инвертированного индекса текущей версии каталога
+        index = self.loader.get_catalog().inverted_index('category_level_1')
+        return sorted([str(c) for c in index.values])
+    
+    @cached_result
+    def get_category_tree(self, path: Optional[List[str]] = None,
+                          depth: Optional[int] = None) -> Optional[CategoryTreeNode]:
+        """Поддерево категорий от узла path (None - весь каталог) до глубины depth"""
+        # Готовое дерево текущей версии каталога: переход по пути - поиск в словарях узлов
+        node = self.loader.get_catalog().category_tree().find(path or [])
+        if node is None:
+            return None
+        return CategoryTreeNode(**node.to_dict(depth))
     
     def get_brands(self, category: Optional[str] = None) -> List[str]:
         """Получает список всех брендов"""
-        # Используем кэш если доступен
-        if self.loader._cache is not None:
-            df = self.loader._cache
-        else:
-            df = self.loader.load_all_data()
+        snapshot = self.loader.get_catalog()
+        brand_index = snapshot.inverted_index('brand')
         
         if category:
-            df = df[df['category_level_1'] == category]
+            # Коды брендов у строк категории (позиции - из индекса категорий)
+            positions = snapshot.inverted_index('category_level_1').positions(category)
+            codes = np.unique(brand_index.codes[positions])
+            brands = [brand_index.values[code] for code in codes[codes >= 0].tolist()]
+        else:
+            brands = brand_index.values
         
-        brands = df['brand'].dropna().unique().tolist()
         return sorted([str(b) for b in brands])
 
 
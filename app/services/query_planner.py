@@ -0,0 +1,243 @@
+"""
+Планировщик фильтров каталога
+
+Фильтр (ProductFilter или аргументы аналитики) разбирается на условия по колонкам.
+Для каждого условия по индексам версии оценивается число строк (частоты значений
+инвертированного индекса, ранги отсортированного), условия упорядочиваются по
+избирательности и выбирается способ выполнения:
+- scan - условий нет, берется весь каталог;
+- index - самое избирательное условие дает позиции кандидатов, остальные
+  проверяются по кодам/рангам кандидатов одной объединенной маской;
+- bitmap - выборка широкая: условия объединяются AND над битсетами.
+
+Строки датафрейма выбираются один раз в конце (по позициям результата). План с
+оценками и фактическим числом строк доступен для отладки через explain().
+"""
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.models import ProductFilter
+from app.services.catalog_index import SORTED_INDEX_COLUMNS, filter_positions
+from app.services.bitmap_index import filter_bitmap, popcount, decode_range, decode_all
+
+
+# Если самое избирательное условие оставляет больше 1/INDEX_SCAN_RATIO каталога,
+# условия выполняются над битсетами, иначе - по позициям кандидатов
+INDEX_SCAN_RATIO = 32
+
+_OPERATORS = {'eq': '=', 'ge': '>=', 'le': '<='}
+
+
+class Predicate:
+    """Условие по колонке: равенство или граница диапазона"""
+
+    def __init__(self, column: str, op: str, value: Any):
+        if op not in _OPERATORS:
+            raise ValueError(f"Неизвестный оператор условия: {op}")
+        self.column = column
+        self.op = op
+        self.value = value
+
+    def __repr__(self) -> str:
+        return f"{self.column} {_OPERATORS[self.op]} {self.value}"
+
+
+def predicates_from_filter(filters: ProductFilter) -> List[Predicate]:
+    """Условия фильтра поиска товаров"""
+    predicates = []
+    for column in ('category_level_1', 'category_level_2', 'category_level_3',
+                   'category_level_4', 'brand'):
+        value = getattr(filters, column)
+        if value:
+            predicates.append(Predicate(column, 'eq', value))
+    if filters.period_start:
+        predicates.append(Predicate('period_start', 'ge', filters.period_start))
+    if filters.period_end:
+        predicates.append(Predicate('period_end', 'le', filters.period_end))
+    if filters.min_favorites_count is not None:
+        predicates.append(Predicate('favorites_count', 'ge', filters.min_favorites_count))
+    if filters.out_of_stock_days is not None:
+        predicates.append(Predicate('days_out_of_stock', 'ge', filters.out_of_stock_days))
+    return predicates
+
+
+def analytics_predicates(
+    category: Optional[str] = None,
+    brand: Optional[str] = None,
+    period_start=None,
+    period_end=None,
+    min_favorites: Optional[int] = None,
+    min_days: Optional[int] = None
+) -> List[Predicate]:
+    """Условия по аргументам аналитических методов"""
+    predicates = []
+    if category:
+        predicates.append(Predicate('category_level_1', 'eq', category))
+    if brand:
+        predicates.append(Predicate('brand', 'eq', brand))
+    if period_start:
+        predicates.append(Predicate('period_start', 'ge', period_start))
+    if period_end:
+        predicates.append(Predicate('period_end', 'le', period_end))
+    if min_favorites is not None:
+        predicates.append(Predicate('favorites_count', 'ge', min_favorites))
+    if min_days is not None:
+        predicates.append(Predicate('days_out_of_stock', 'ge', min_days))
+    return predicates
+
+
+class PlanStep:
+    """Условие плана с оценкой числа строк и способом проверки"""
+
+    def __init__(self, predicate: Predicate, index, condition, estimated_rows: int, row_count: int):
+        self.predicate = predicate
+        self.index = index
+        self.condition = condition
+        self.estimated_rows = estimated_rows
+        self.selectivity = estimated_rows / row_count if row_count else 0.0
+        self.access = 'mask'
+
+    def explain(self) -> Dict[str, Any]:
+        return {
+            "predicate": repr(self.predicate),
+            "access": self.access,
+            "estimated_rows": self.estimated_rows,
+            "selectivity": round(self.selectivity, 6),
+        }
+
+
+class QueryPlan:
+    """План выполнения фильтра: условия по избирательности и стратегия"""
+
+    def __init__(self, row_count: int, steps: List[PlanStep]):
+        self.row_count = row_count
+        self.steps = sorted(steps, key=lambda step: step.estimated_rows)
+        if not self.steps:
+            self.strategy = 'scan'
+        elif self.steps[0].estimated_rows * INDEX_SCAN_RATIO <= row_count:
+            self.strategy = 'index'
+            self.steps[0].access = 'index'
+        else:
+            self.strategy = 'bitmap'
+            for step in self.steps:
+                step.access = 'bitmap'
+        # Оценка результата в предположении независимости условий
+        estimate = float(row_count)
+        for step in self.steps:
+            estimate *= step.selectivity
+        self.estimated_rows = int(round(estimate))
+        self.actual_rows: Optional[int] = None
+        self.elapsed_ms: Optional[float] = None
+
+    def explain(self) -> Dict[str, Any]:
+        """План для отладки: стратегия, условия, оценки и факт"""
+        return {
+            "strategy": self.strategy,
+            "row_count": self.row_count,
+            "estimated_rows": self.estimated_rows,
+            "actual_rows": self.actual_rows,
+            "elapsed_ms": self.elapsed_ms,
+            "steps": [step.explain() for step in self.steps],
+        }
+
+
+class QueryResult:
+    """Результат фильтра: позиции строк (по возрастанию) или битсет"""
+
+    def __init__(self, plan: QueryPlan, df: pd.DataFrame,
+                 positions: Optional[np.ndarray] = None, bitmap: Optional[np.ndarray] = None):
+        self.plan = plan
+        self._df = df
+        self._positions = positions
+        self._bitmap = bitmap
+        if positions is not None:
+            self.total = len(positions)
+        elif bitmap is not None:
+            self.total = popcount(bitmap)
+        else:
+            self.total = plan.row_count
+
+    def positions(self) -> np.ndarray:
+        """Позиции всех строк результата (по возрастанию)"""
+        if self._positions is None:
+            if self._bitmap is not None:
+                self._positions = decode_all(self._bitmap)
+            else:
+                self._positions = np.arange(self.plan.row_count, dtype=np.int64)
+        return self._positions
+
+    def page(self, start: int, stop: int) -> np.ndarray:
+        """Позиции строк результата с номерами [start, stop)"""
+        if self._positions is None and self._bitmap is not None:
+            return decode_range(self._bitmap, start, stop)
+        if self._positions is None:
+            return np.arange(min(start, self.total), min(stop, self.total), dtype=np.int64)
+        return self._positions[start:stop]
+
+    def subset(self) -> Optional[np.ndarray]:
+        """Позиции строк результата или None, если условий нет (весь каталог)"""
+        if self.plan.strategy == 'scan':
+            return None
+        return self.positions()
+
+    def frame(self) -> pd.DataFrame:
+        """Строки результата (без условий - сам датафрейм версии, без копии)"""
+        if self.plan.strategy == 'scan':
+            return self._df
+        return self._df.iloc[self.positions()]
+
+
+class QueryPlanner:
+    """Планировщик фильтров для версии каталога"""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def _step(self, predicate: Predicate, row_count: int) -> PlanStep:
+        column = predicate.column
+        if column in SORTED_INDEX_COLUMNS:
+            index = self.snapshot.sorted_index(column)
+            if predicate.op == 'ge':
+                condition = index.bounds(low=predicate.value)
+            elif predicate.op == 'le':
+                condition = index.bounds(high=predicate.value)
+            else:
+                condition = index.bounds(low=predicate.value, high=predicate.value)
+        else:
+            index = self.snapshot.inverted_index(column)
+            value = predicate.value
+            if predicate.op == 'ge':
+                condition = index.groups_where(lambda item: item >= value)
+            elif predicate.op == 'le':
+                condition = index.groups_where(lambda item: item <= value)
+            else:
+                condition = index.group_mask(value)
+        return PlanStep(predicate, index, condition, index.count_for(condition), row_count)
+
+    def plan(self, predicates: List[Predicate]) -> QueryPlan:
+        """Оценивает условия по индексам версии и выбирает стратегию"""
+        row_count = len(self.snapshot)
+        return QueryPlan(row_count, [self._step(predicate, row_count) for predicate in predicates])
+
+    def execute(self, plan: QueryPlan) -> QueryResult:
+        """Выполняет план"""
+        started_at = time.perf_counter()
+        df = self.snapshot.df
+        if plan.strategy == 'scan':
+            result = QueryResult(plan, df)
+        elif plan.strategy == 'index':
+            positions = filter_positions(plan.row_count, [(step.index, step.condition) for step in plan.steps])
+            result = QueryResult(plan, df, positions=positions)
+        else:
+            terms = [(self.snapshot.bitmap_index(step.predicate.column), step.condition) for step in plan.steps]
+            result = QueryResult(plan, df, bitmap=filter_bitmap(plan.row_count, terms))
+        plan.actual_rows = result.total
+        plan.elapsed_ms = round((time.perf_counter() - started_at) * 1000, 3)
+        return result
+
+    def run(self, predicates: List[Predicate]) -> QueryResult:
+        """Планирует и выполняет условия"""
+        return self.execute(self.plan(predicates))
@@ -0,0 +1,222 @@
+"""
+Кэш результатов запросов к каталогу
+
+Дашборд и сценарии n8n повторяют одни и те же запросы (метрики ценообразования,
+товары без остатков, топ спроса), и каждый раз заново считают группировки.
+Результаты методов сервисов кэшируются по ключу (метод, нормализованные параметры,
+каталог, версия каталога): после перезагрузки или изменения товаров версия растет, и старые
+записи больше не совпадают с ключами запросов - при первой встрече новой версии
+они удаляются.
+
+Размер кэша ограничен числом записей (вытесняются давно не использованные),
+время жизни записи - TTL. Метрики: попадания, промахи, вытеснения, устаревшие
+по TTL и удаленные при смене версии записи.
+"""
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from app.services.single_flight import get_single_flight
+
+
+# Число записей и время жизни записи (секунды) по умолчанию
+# Переопределяются через RESULT_CACHE_SIZE и RESULT_CACHE_TTL (0 - кэш выключен)
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_TTL = 300.0
+
+_MISSING = object()
+
+
+def _env_number(name: str, default, cast):
+    try:
+        return max(0, cast(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def normalize_value(value: Any) -> Hashable:
+    """Приводит параметр запроса к хешируемому виду (модели фильтров - к кортежам)"""
+    if isinstance(value, BaseModel):
+        return tuple(sorted((key, normalize_value(item)) for key, item in value.model_dump().items()))
+    if isinstance(value, dict):
+        return tuple(sorted((key, normalize_value(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = (normalize_value(item) for item in value)
+        return tuple(sorted(items, key=repr)) if isinstance(value, (set, frozenset)) else tuple(items)
+    if value is None or isinstance(value, (str, bool, int, float, date)):
+        return value
+    return repr(value)
+
+
+class ResultCache:
+    """LRU-кэш результатов с TTL и привязкой к версии каталога"""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, ttl_seconds: float = RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Последняя встреченная версия каждого каталога (загрузчика)
+        self._versions: Dict[Hashable, int] = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def _observe_version(self, scope: Hashable, version: int) -> bool:
+        # Вызывается под self._lock: новая версия каталога делает его старые записи
+        # недостижимыми. False - версия устарела (каталог уже изменился)
+        current = self._versions.get(scope)
+        if current is not None and version < current:
+            return False
+        if current is not None and version > current:
+            stale = [key for key in self._entries if key[2] == scope and key[3] < version]
+            for key in stale:
+                del self._entries[key]
+            self._invalidations += len(stale)
+        self._versions[scope] = version
+        return True
+
+    def get(self, method: str, params: Hashable, version: int, scope: Hashable = None) -> Any:
+        """Результат из кэша или _MISSING"""
+        key = (method, params, scope, version)
+        now = time.monotonic()
+        with self._lock:
+            self._observe_version(scope, version)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def put(self, method: str, params: Hashable, version: int, value: Any, scope: Hashable = None):
+        """Сохраняет результат запроса для версии каталога"""
+        key = (method, params, scope, version)
+        with self._lock:
+            if not self._observe_version(scope, version):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, scope: Hashable, version: int):
+        """Удаляет записи каталога scope для версий старше version"""
+        with self._lock:
+            self._observe_version(scope, version)
+
+    def clear(self) -> int:
+        """Удаляет все записи; возвращает их число"""
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._invalidations += count
+            return count
+
+    def metrics(self) -> Dict[str, Any]:
+        """Размер, настройки и счетчики кэша"""
+        with self._lock:
+            requests = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / requests, 4) if requests else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+            }
+
+
+# Глобальный экземпляр
+_result_cache_instance: Optional[ResultCache] = None
+
+
+def get_result_cache() -> ResultCache:
+    """Получает глобальный кэш результатов (singleton)"""
+    global _result_cache_instance
+    if _result_cache_instance is None:
+        _result_cache_instance = ResultCache(
+            _env_number("RESULT_CACHE_SIZE", RESULT_CACHE_SIZE, int),
+            _env_number("RESULT_CACHE_TTL", RESULT_CACHE_TTL, float)
+        )
+    return _result_cache_instance
+
+
+# Проверки внешних зависимостей результатов (например, файла правил), выполняются перед поиском в кэше
+_dependency_checks: List[Callable[[], None]] = []
+
+
+def register_dependency_check(check: Callable[[], None]) -> None:
+    """
+    Регистрирует проверку зависимости кэшированных результатов
+
+    Проверка должна быть дешевой и сама сбрасывать кэш, если зависимость изменилась.
+    """
+    if check not in _dependency_checks:
+        _dependency_checks.append(check)
+
+
+def invalidate_catalog_results(loader) -> None:
+    """Сразу удаляет результаты прошлых версий каталога загрузчика (после изменения каталога)"""
+    get_result_cache().invalidate(id(loader), loader.catalog_version)
+
+
+def cached_result(method: Callable) -> Callable:
+    """
+    Кэширует результат метода сервиса по (метод, параметры, версия каталога)
+
+    Перед поиском выполняются зарегистрированные проверки зависимостей. Промах
+    вычисляется один раз на ключ: одинаковые одновременные вызовы ждут
+    ведущий (single-flight). Версия берется из self.loader до и после вычисления:
+    если каталог изменился во время запроса, результат возвращается, но не сохраняется.
+    """
+    name = method.__qualname__
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        for check in _dependency_checks:
+            check()
+        cache = get_result_cache()
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        params = tuple((key, normalize_value(value)) for key, value in bound.arguments.items() if key != 'self')
+        scope = id(self.loader)
+        version = self.loader.catalog_version
+        if cache.enabled:
+            value = cache.get(name, params, version, scope)
+            if value is not _MISSING:
+                return value
+
+        def compute():
+            value = method(self, *args, **kwargs)
+            if cache.enabled and self.loader.catalog_version == version:
+                cache.put(name, params, version, value, scope)
+            return value
+
+        return get_single_flight().do((name, params, scope, version), compute)
+
+    return wrapper
@@ -0,0 +1,123 @@
+"""
+Сегментное хранилище каталога для прогрессивной загрузки
+
+Строки каталога лежат в столбцовых буферах с запасом емкости (как у списка):
+сегмент очередного файла дописывается в свободный хвост буферов под коротким
+замком, а версия каталога получает датафрейм-представление первых N строк без
+копирования. Опубликованные версии не видят дописанных позже строк, а при
+исчерпании емкости буферы перевыделяются с ростом в GROWTH_FACTOR раз, поэтому
+суммарное копирование линейно по числу строк, сколько бы версий ни читалось
+во время загрузки.
+"""
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+
+# Во сколько раз растет емкость буферов при перевыделении
+GROWTH_FACTOR = 2.0
+
+
+class SegmentStore:
+    """Столбцовые буферы каталога: добавление сегментов и представления версий"""
+
+    def __init__(self, growth_factor: float = GROWTH_FACTOR):
+        self._lock = threading.Lock()
+        self._growth_factor = growth_factor
+        self._frame: Optional[pd.DataFrame] = None
+        self._buffers: Optional[Dict[str, np.ndarray]] = None
+        self._rows = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._rows
+
+    def reset(self, df: Optional[pd.DataFrame]):
+        """Заменяет содержимое одним датафреймом (буферы создаются при первом добавлении)"""
+        with self._lock:
+            self._frame = df
+            self._buffers = None
+            self._rows = len(df) if df is not None else 0
+
+    def frame(self) -> Optional[pd.DataFrame]:
+        """Текущий каталог одним датафреймом"""
+        with self._lock:
+            return self._frame
+
+    def append(self, segment: pd.DataFrame) -> pd.DataFrame:
+        """
+        Дописывает сегмент и возвращает датафрейм всех строк
+
+        Уже загруженные строки копируются, только если не хватило емкости или
+        колонки сегмента не совпадают с каталогом по составу и типам.
+        """
+        with self._lock:
+            if self._frame is None:
+                self._frame = segment.reset_index(drop=True)
+                self._rows = len(self._frame)
+                return self._frame
+
+            rows = self._rows + len(segment)
+            if not self._compatible(segment):
+                # Типы разошлись (например, int и float) - объединяем по правилам pandas
+                merged = pd.concat([self._frame, segment], ignore_index=True)
+                self._buffers = self._allocate(merged, self._grown(rows))
+                self._rows = rows
+                self._frame = self._view() if self._buffers is not None else merged
+                return self._frame
+
+            if self._buffers is None or len(next(iter(self._buffers.values()))) < rows:
+                self._buffers = self._allocate(self._frame, self._grown(rows))
+            for column, buffer in self._buffers.items():
+                buffer[self._rows:rows] = segment[column].to_numpy()
+            self._rows = rows
+            self._frame = self._view()
+            return self._frame
+
+    def compact(self) -> Optional[pd.DataFrame]:
+        """
+        Ужимает буферы до фактического числа строк (после окончания загрузки)
+
+        Возвращает новый датафрейм или None, если запаса емкости нет.
+        """
+        with self._lock:
+            if self._buffers is None:
+                return None
+            self._frame = pd.DataFrame({column: buffer[:self._rows]
+                                        for column, buffer in self._buffers.items()})
+            self._buffers = None
+            return self._frame
+
+    def _grown(self, rows: int) -> int:
+        return max(rows, int(rows * self._growth_factor))
+
+    def _compatible(self, segment: pd.DataFrame) -> bool:
+        """Совпадают ли колонки сегмента с каталогом и хранятся ли они numpy-массивами"""
+        if self._frame.columns.has_duplicates or list(segment.columns) != list(self._frame.columns):
+            return False
+        return all(isinstance(dtype, np.dtype) and dtype == segment_dtype
+                   for dtype, segment_dtype in zip(self._frame.dtypes, segment.dtypes))
+
+    @staticmethod
+    def _allocate(frame: pd.DataFrame, capacity: int) -> Optional[Dict[str, np.ndarray]]:
+        """Буферы заданной емкости с копией строк frame (None - есть не-numpy колонки)"""
+        if frame.columns.has_duplicates or not all(isinstance(dtype, np.dtype) for dtype in frame.dtypes):
+            return None
+        buffers = {}
+        for column in frame.columns:
+            values = frame[column].to_numpy()
+            buffer = np.empty(capacity, dtype=values.dtype)
+            buffer[:len(values)] = values
+            buffers[column] = buffer
+        return buffers
+
+    def _view(self) -> pd.DataFrame:
+        """Датафрейм первых строк буферов; срезы только для чтения, чтобы версия не менялась"""
+        columns = {}
+        for column, buffer in self._buffers.items():
+            view = buffer[:self._rows]
+            view.flags.writeable = False
+            columns[column] = view
+        return pd.DataFrame(columns, copy=False)
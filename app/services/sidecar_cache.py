@@ -0,0 +1,150 @@
+"""
+Пофайловый колоночный кэш (sidecar) для Excel файлов
+
+Для каждого Excel файла хранит результат потокового чтения в NumPy .npz,
+ключом служит отпечаток файла (имя, время изменения, размер). При перезагрузке
+разбираются только новые или измененные файлы, остальные собираются из sidecar.
+"""
+import os
+import hashlib
+from pathlib import Path
+from typing import Dict, Any, Optional, List
+
+import numpy as np
+
+
+# Версия формата sidecar; при изменении структуры данных старые файлы игнорируются
+SIDECAR_VERSION = 1
+
+# Типы значений в словарях строковых колонок
+_KIND_STR, _KIND_INT, _KIND_FLOAT, _KIND_BOOL = 0, 1, 2, 3
+
+
+def file_fingerprint(file_path: Path) -> str:
+    """Отпечаток файла на основе имени, времени изменения и размера"""
+    stat = file_path.stat()
+    content = f"{file_path.name}:{stat.st_mtime_ns}:{stat.st_size}"
+    return hashlib.md5(content.encode()).hexdigest()
+
+
+def _encode_values(values: List[Any]) -> Dict[str, np.ndarray]:
+    """Кодирует уникальные значения словаря в массивы без pickle"""
+    kinds = np.zeros(len(values), dtype=np.int8)
+    texts = []
+    for i, value in enumerate(values):
+        if isinstance(value, bool):
+            kinds[i] = _KIND_BOOL
+        elif isinstance(value, int):
+            kinds[i] = _KIND_INT
+        elif isinstance(value, float):
+            kinds[i] = _KIND_FLOAT
+        texts.append(repr(value) if isinstance(value, float) else str(value))
+    return {
+        'values': np.array(texts, dtype=str) if texts else np.array([], dtype='<U1'),
+        'kinds': kinds
+    }
+
+
+def _without_metadata(array: np.ndarray) -> np.ndarray:
+    """
+    Массив без метаданных dtype
+
+    datetime64, пришедший из пула процессов, распаковывается с пустыми метаданными,
+    а np.savez на такие dtype выдает предупреждение.
+    """
+    if array.dtype.metadata is None:
+        return array
+    return array.view(np.dtype(array.dtype.str))
+
+
+def _decode_values(texts: np.ndarray, kinds: np.ndarray) -> List[Any]:
+    """Восстанавливает уникальные значения словаря"""
+    values = texts.tolist()
+    if kinds.any():
+        for i in np.flatnonzero(kinds).tolist():
+            kind = kinds[i]
+            if kind == _KIND_INT:
+                values[i] = int(values[i])
+            elif kind == _KIND_FLOAT:
+                values[i] = float(values[i])
+            elif kind == _KIND_BOOL:
+                values[i] = values[i] == 'True'
+    return values
+
+
+class SidecarCache:
+    """Кэш колоночных данных отдельных Excel файлов"""
+
+    def __init__(self, cache_dir: str = "cache"):
+        self.sidecar_dir = Path(cache_dir) / "sidecars"
+        self.sidecar_dir.mkdir(parents=True, exist_ok=True)
+
+    def _prefix(self, file_path: Path) -> str:
+        """Префикс имен sidecar файлов для конкретного Excel файла"""
+        return hashlib.md5(file_path.name.encode()).hexdigest()[:12]
+
+    def _path(self, file_path: Path, fingerprint: str) -> Path:
+        return self.sidecar_dir / f"{self._prefix(file_path)}.{fingerprint}.npz"
+
+    def load(self, file_path: Path) -> Optional[Dict[str, Any]]:
+        """Загружает колоночные данные файла, если sidecar актуален"""
+        try:
+            sidecar_path = self._path(file_path, file_fingerprint(file_path))
+            if not sidecar_path.exists():
+                return None
+
+            with np.load(sidecar_path, allow_pickle=False) as data:
+                if int(data['version']) != SIDECAR_VERSION:
+                    return None
+
+                strings = {}
+                for col in data['string_columns'].tolist():
+                    values = _decode_values(data[f's:{col}:values'], data[f's:{col}:kinds'])
+                    strings[col] = (data[f's:{col}:codes'], values)
+
+                return {
+                    'rows_count': int(data['rows_count']),
+                    'strings': strings,
+                    'favorites_count': data['favorites_count'] if 'favorites_count' in data else None,
+                    'last_in_stock': data['last_in_stock'] if 'last_in_stock' in data else None,
+                }
+        except Exception as e:
+            print(f"⚠️ Ошибка чтения sidecar для {file_path.name}: {e}")
+            return None
+
+    def save(self, file_path: Path, payload: Dict[str, Any]):
+        """Сохраняет колоночные данные файла и удаляет устаревшие sidecar этого файла"""
+        try:
+            fingerprint = file_fingerprint(file_path)
+            arrays = {
+                'version': np.array(SIDECAR_VERSION),
+                'rows_count': np.array(payload['rows_count']),
+                'string_columns': np.array(list(payload['strings']), dtype=str),
+            }
+            for col, (codes, values) in payload['strings'].items():
+                encoded = _encode_values(values)
+                arrays[f's:{col}:codes'] = _without_metadata(codes)
+                arrays[f's:{col}:values'] = encoded['values']
+                arrays[f's:{col}:kinds'] = encoded['kinds']
+            if payload['favorites_count'] is not None:
+                arrays['favorites_count'] = _without_metadata(payload['favorites_count'])
+            if payload['last_in_stock'] is not None:
+                arrays['last_in_stock'] = _without_metadata(payload['last_in_stock'])
+
+            sidecar_path = self._path(file_path, fingerprint)
+            tmp_path = sidecar_path.with_name(sidecar_path.name + f".{os.getpid()}.tmp")
+            with open(tmp_path, 'wb') as fh:
+                np.savez(fh, **arrays)
+            os.replace(tmp_path, sidecar_path)
+
+            # Удаляем sidecar от предыдущих версий этого файла
+            for stale in self.sidecar_dir.glob(f"{self._prefix(file_path)}.*.npz"):
+                if stale != sidecar_path:
+                    stale.unlink(missing_ok=True)
+        except Exception as e:
+            print(f"⚠️ Ошибка сохранения sidecar для {file_path.name}: {e}")
+
+    def clear(self):
+        """Удаляет все sidecar файлы"""
+        for sidecar_path in self.sidecar_dir.glob("*.npz"):
+            sidecar_path.unlink(missing_ok=True)
@@ -0,0 +1,127 @@
+"""
+Объединение одинаковых одновременных запросов (single-flight)
+
+При загрузке дашборда или срабатывании сценария n8n по расписанию одновременно
+приходит несколько одинаковых тяжелых запросов. Первый запрос с данным ключом
+(метод или выгрузка, параметры, версия каталога) выполняет вычисление, остальные
+ждут его и получают тот же результат (или ту же ошибку). После завершения ключ
+освобождается: следующий запрос считает заново (или берет результат из кэша).
+
+Ожидание доступно и из потоков пулов (do), и из async-обработчиков (run): в
+последнем случае повторные запросы ждут, не занимая мест в очереди пула.
+
+Ожидающим передаются только ошибки вычисления (Exception). В async-варианте
+вычисление выполняется отдельной задачей: отмена ведущего запроса (клиент
+отключился, истек таймаут) не прерывает его, и ожидающие получают результат.
+Если же вычисление прервано (CancelledError, KeyboardInterrupt), ожидающие
+не получают чужую отмену: ключ освобождается, и один из них считает заново.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+# Результат для ожидающих, если вычисление прервано: запрос нужно повторить
+_RETRY = object()
+
+class SingleFlight:
+    """Выполняемые вычисления по ключам и ожидающие их запросы"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._leaders = 0
+        self._shared = 0
+        self._failed = 0
+
+    def _join(self, key: Hashable):
+        # (future, True) - запрос ведущий и должен выполнить вычисление
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self._shared += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self._leaders += 1
+            return future, True
+
+    def _finish(self, key: Hashable, future: Future, result: Any = None,
+                error: Optional[BaseException] = None):
+        with self._lock:
+            self._calls.pop(key, None)
+            if error is not None:
+                self._failed += 1
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            future.set_result(_RETRY)
+
+    def _finish_task(self, key: Hashable, future: Future, task: "asyncio.Future"):
+        # Завершение задачи вычисления async-варианта (исключение задачи считается полученным)
+        if task.cancelled():
+            self._finish(key, future, error=asyncio.CancelledError())
+        elif task.exception() is not None:
+            self._finish(key, future, error=task.exception())
+        else:
+            self._finish(key, future, task.result())
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Выполняет fn или ждет уже выполняемое вычисление с тем же ключом (в потоке)"""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            result = future.result()
+            if result is not _RETRY:
+                return result
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as error:
+            self._finish(key, future, error=error)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Async-вариант: ведущий запрос запускает fn() задачей, все запросы ждут ее результат"""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            # shield: отмена ожидающего не отменяет общий Future
+            result = await asyncio.shield(asyncio.wrap_future(future))
+            if result is not _RETRY:
+                return result
+        try:
+            task = asyncio.ensure_future(fn())
+        except BaseException as error:
+            self._finish(key, future, error=error)
+            raise
+        task.add_done_callback(lambda done: self._finish_task(key, future, done))
+        return await asyncio.shield(task)
+
+    def metrics(self) -> Dict[str, int]:
+        """Выполняемые вычисления и число запросов, получивших чужой результат"""
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self._leaders,
+                "shared": self._shared,
+                "failed": self._failed,
+            }
+
+
+# Глобальный экземпляр
+_single_flight_instance: Optional[SingleFlight] = None
+
+
+def get_single_flight() -> SingleFlight:
+    """Получает глобальный объединитель запросов (singleton)"""
+    global _single_flight_instance
+    if _single_flight_instance is None:
+        _single_flight_instance = SingleFlight()
+    return _single_flight_instance
@@ -0,0 +1,441 @@
+"""
+Колоночный формат снимка каталога
+
+Снимок заменяет pickle всего датафрейма. Структура:
+
+    MAGIC (8 байт) | длина заголовка (uint64 LE) | заголовок JSON | тело
+
+Заголовок описывает версию формата, кодек, число строк, схему колонок
+(тип, dtype, смещения буферов в теле) и контрольную сумму CRC32 тела.
+Числовые колонки хранятся сырыми буферами, строки - словарем уникальных
+значений (UTF-8) и кодами, даты - уникальными днями от эпохи (int32) и кодами.
+Коды хранятся в том же целом типе, что pandas выбирает для категориальной
+колонки с таким словарем. Тело может быть сжато zlib или lzma; без сжатия
+буферы выровнены по 8 байт и читаются через np.frombuffer без копирования.
+"""
+import json
+import lzma
+import mmap
+import os
+import zlib
+from datetime import date
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+
+SNAPSHOT_MAGIC = b"DPSNAP\x00\x01"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_CODECS = ("none", "zlib", "lzma")
+
+# Пропуск в колонках дат
+_MISSING_DAY = np.iinfo(np.int32).min
+
+# Типы значений словаря строковой колонки
+_KIND_STR, _KIND_INT, _KIND_FLOAT, _KIND_BOOL = 0, 1, 2, 3
+
+_ALIGN = 8
+_SEPARATOR = "\x00"
+
+
+class SnapshotError(ValueError):
+    """Поврежденный или несовместимый снимок"""
+
+
+def is_snapshot(data: Union[bytes, memoryview]) -> bool:
+    """Проверяет сигнатуру снимка"""
+    return bytes(data[:len(SNAPSHOT_MAGIC)]) == SNAPSHOT_MAGIC
+
+
+def _codes_dtype(count: int) -> np.dtype:
+    """Тип кодов категориальной колонки pandas со словарем из count значений"""
+    for dtype in (np.int8, np.int16, np.int32):
+        if count < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _missing_marker(values: pd.Series) -> str:
+    """Определяет, каким значением в колонке обозначены пропуски"""
+    missing = values[values.isna()]
+    if missing.empty:
+        return "nan"
+    first = missing.iloc[0]
+    if first is None:
+        return "none"
+    if first is pd.NaT:
+        return "nat"
+    return "nan"
+
+
+def _missing_value(marker: str):
+    return {"none": None, "nat": pd.NaT}.get(marker, np.nan)
+
+
+class _BodyWriter:
+    """Собирает тело снимка из выровненных буферов"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.size = 0
+
+    def add(self, array: np.ndarray) -> Dict[str, Any]:
+        buffer = np.ascontiguousarray(array).tobytes()
+        ref = {"offset": self.size, "length": len(buffer)}
+        padding = (-len(buffer)) % _ALIGN
+        self.chunks.append(buffer)
+        if padding:
+            self.chunks.append(b"\x00" * padding)
+        self.size += len(buffer) + padding
+        return ref
+
+    def add_texts(self, texts: List[str]) -> Dict[str, Any]:
+        """
+        Сохраняет список строк одним UTF-8 блоком
+        
+        Строки разделяются символом NUL, что позволяет восстановить список одним
+        вызовом split. Если NUL встречается в данных, сохраняются смещения символов.
+        """
+        joined = _SEPARATOR.join(texts)
+        text_ref = self.add(np.frombuffer(joined.encode("utf-8"), dtype=np.uint8))
+        if joined.count(_SEPARATOR) == max(len(texts) - 1, 0):
+            return {"text": text_ref, "count": len(texts)}
+        lengths = np.fromiter((len(t) + 1 for t in texts), dtype=np.int64, count=len(texts))
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return {"text": text_ref, "offsets": self.add(offsets)}
+
+
+def _encode_dictionary(writer: _BodyWriter, values: List[Any]) -> Dict[str, Any]:
+    """Кодирует уникальные значения строковой колонки"""
+    if all(type(value) is str for value in values):
+        return writer.add_texts(values)
+
+    kinds = np.array([
+        _KIND_STR if isinstance(value, str)
+        else _KIND_BOOL if isinstance(value, (bool, np.bool_))
+        else _KIND_INT if isinstance(value, (int, np.integer))
+        else _KIND_FLOAT
+        for value in values
+    ], dtype=np.int8)
+    texts = [
+        repr(float(value)) if kind == _KIND_FLOAT else str(value)
+        for value, kind in zip(values, kinds.tolist())
+    ]
+    ref = writer.add_texts(texts)
+    ref["kinds"] = writer.add(kinds)
+    return ref
+
+
+def _classify_object_column(values: pd.Series) -> str:
+    """Выбирает способ хранения object-колонки"""
+    present = values[values.notna()]
+    if present.empty:
+        return "string"
+    types = set(map(type, present.tolist()))
+    if types == {date}:
+        return "date"
+    if types == {dict}:
+        return "dict"
+    if types <= {str, int, float, bool, np.int64, np.float64, np.bool_}:
+        return "string"
+    return "json"
+
+
+def _encode_dict_column(writer: _BodyWriter, column: Dict[str, Any], values: pd.Series) -> bool:
+    """
+    Кодирует колонку словарей с числовыми значениями матрицей float64
+    
+    Возвращает False, если значения не числовые и колонку нужно хранить как JSON.
+    """
+    records = [d if isinstance(d, dict) else None for d in values.tolist()]
+    keys = list(dict.fromkeys(k for d in records if d for k in d))
+    if not all(isinstance(k, str) for k in keys):
+        return False
+    matrix = np.full((len(records), len(keys)), np.nan, dtype=np.float64)
+    present = np.zeros((len(records), len(keys)), dtype=bool)
+    int_keys = []
+    for j, key in enumerate(keys):
+        key_values = [d.get(key) if d else None for d in records]
+        types = set(map(type, key_values))
+        if not types <= {float, int, type(None)}:
+            return False
+        if int in types:
+            int_keys.append(key)
+        if type(None) in types:
+            mask = np.array([v is not None for v in key_values], dtype=bool)
+            matrix[mask, j] = np.array([v for v in key_values if v is not None], dtype=np.float64)
+        else:
+            mask = np.ones(len(records), dtype=bool)
+            matrix[:, j] = np.array(key_values, dtype=np.float64)
+        present[:, j] = mask
+    column["keys"] = keys
+    column["int_keys"] = int_keys
+    column["data"] = writer.add(matrix)
+    column["present"] = writer.add(present)
+    column["rows"] = writer.add(np.array([d is not None for d in records], dtype=bool))
+    return True
+
+
+def _encode_column(writer: _BodyWriter, name: str, values: pd.Series) -> Dict[str, Any]:
+    """Кодирует одну колонку и возвращает ее описание для заголовка"""
+    column: Dict[str, Any] = {"name": name}
+
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = values.cat.categories
+        if categories.inferred_type == "string" and categories.is_monotonic_increasing:
+            # Колонка отображенного снимка: словарь и коды берутся как есть
+            codes_dtype = _codes_dtype(len(categories))
+            column.update(kind="string", missing="nan", codes_dtype=codes_dtype.str)
+            column["codes"] = writer.add(values.cat.codes.to_numpy().astype(codes_dtype, copy=False))
+            column["dictionary"] = _encode_dictionary(writer, categories.tolist())
+            return column
+        values = values.astype(object)
+
+    if values.dtype != object:
+        array = values.to_numpy()
+        if array.dtype.kind not in "biufcmM":
+            raise SnapshotError(f"Неподдерживаемый тип колонки {name}: {values.dtype}")
+        column.update(kind="array", dtype=array.dtype.str, data=writer.add(array))
+        return column
+
+    kind = _classify_object_column(values)
+    column["missing"] = _missing_marker(values)
+    if kind == "dict" and not _encode_dict_column(writer, column, values):
+        kind = "json"
+    column["kind"] = kind
+
+    if kind == "string":
+        # Словарь по возрастанию: порядок категорий отображенной колонки совпадает
+        # с порядком строк (сортировка, factorize(sort=True)); смешанные типы - как есть
+        try:
+            codes, uniques = pd.factorize(values, sort=True, use_na_sentinel=True)
+        except TypeError:
+            codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        codes_dtype = _codes_dtype(len(uniques))
+        column["codes_dtype"] = codes_dtype.str
+        column["codes"] = writer.add(codes.astype(codes_dtype))
+        column["dictionary"] = _encode_dictionary(writer, uniques.tolist())
+    elif kind == "date":
+        # Уникальных дат немного: в дни переводятся только они
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        codes_dtype = _codes_dtype(len(uniques))
+        column["codes_dtype"] = codes_dtype.str
+        column["codes"] = writer.add(codes.astype(codes_dtype))
+        column["days"] = writer.add(np.array(uniques.tolist(), dtype="datetime64[D]").astype(np.int32))
+    elif kind == "json":
+        texts = [json.dumps(v, ensure_ascii=False, default=str) for v in values.tolist()]
+        column["data"] = writer.add_texts(texts)
+
+    return column
+
+
+def encode_snapshot(df: pd.DataFrame, codec: str = "zlib", meta: Optional[Dict[str, Any]] = None) -> bytes:
+    """Сериализует датафрейм в колоночный снимок (meta сохраняется в заголовке)"""
+    if codec not in SNAPSHOT_CODECS:
+        raise SnapshotError(f"Неизвестный кодек снимка: {codec}")
+
+    writer = _BodyWriter()
+    columns = [_encode_column(writer, str(name), df[name]) for name in df.columns]
+
+    header: Dict[str, Any] = {
+        "version": SNAPSHOT_VERSION,
+        "codec": codec,
+        "rows": len(df),
+        "columns": columns,
+        "meta": meta or {},
+    }
+    if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+        header["index"] = {"dtype": df.index.dtype.str, "data": writer.add(df.index.to_numpy())}
+
+    body = b"".join(writer.chunks)
+    header["raw_size"] = len(body)
+    if codec == "zlib":
+        body = zlib.compress(body, 1)
+    elif codec == "lzma":
+        body = lzma.compress(body, preset=1)
+    header["checksum"] = zlib.crc32(body)
+
+    header_bytes = json.dumps(header, ensure_ascii=False, default=str).encode("utf-8")
+    header_bytes += b" " * ((-(len(SNAPSHOT_MAGIC) + 8 + len(header_bytes))) % _ALIGN)
+    return b"".join([
+        SNAPSHOT_MAGIC,
+        np.uint64(len(header_bytes)).tobytes(),
+        header_bytes,
+        body,
+    ])
+
+
+def read_header(data: Union[bytes, memoryview]) -> Tuple[Dict[str, Any], int]:
+    """Читает заголовок снимка, возвращает (заголовок, смещение тела)"""
+    if not is_snapshot(data):
+        raise SnapshotError("Неверная сигнатура снимка")
+    start = len(SNAPSHOT_MAGIC)
+    header_len = int(np.frombuffer(data, dtype="<u8", count=1, offset=start)[0])
+    header = json.loads(bytes(data[start + 8:start + 8 + header_len]).decode("utf-8"))
+    if header.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Неподдерживаемая версия снимка: {header.get('version')}")
+    return header, start + 8 + header_len
+
+
+class _BodyReader:
+    """Читает буферы из тела снимка без копирования"""
+
+    def __init__(self, body: Union[bytes, memoryview]):
+        self.body = body
+
+    def array(self, ref: Dict[str, Any], dtype) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        return np.frombuffer(self.body, dtype=dtype, count=ref["length"] // dtype.itemsize,
+                             offset=ref["offset"])
+
+    def texts(self, ref: Dict[str, Any]) -> List[str]:
+        text = self.array(ref["text"], np.uint8).tobytes().decode("utf-8")
+        if "offsets" not in ref:
+            return text.split(_SEPARATOR) if ref["count"] else []
+        offsets = self.array(ref["offsets"], np.int64).tolist()
+        return [text[offsets[i]:offsets[i + 1] - 1] for i in range(len(offsets) - 1)]
+
+
+def _decode_dictionary(reader: _BodyReader, ref: Dict[str, Any]) -> List[Any]:
+    values: List[Any] = reader.texts(ref)
+    if "kinds" in ref:
+        kinds = reader.array(ref["kinds"], np.int8)
+        for i in np.flatnonzero(kinds).tolist():
+            kind = kinds[i]
+            if kind == _KIND_INT:
+                values[i] = int(values[i])
+            elif kind == _KIND_FLOAT:
+                values[i] = float(values[i])
+            elif kind == _KIND_BOOL:
+                values[i] = values[i] == "True"
+    return values
+
+
+def _decode_column(reader: _BodyReader, column: Dict[str, Any], rows: int, copy: bool):
+    kind = column["kind"]
+    if kind == "array":
+        array = reader.array(column["data"], column["dtype"])
+        return array.copy() if copy else array
+
+    missing = _missing_value(column["missing"])
+    result = np.empty(rows, dtype=object)
+
+    if kind == "string":
+        codes = reader.array(column["codes"], column.get("codes_dtype", "<i4"))
+        values = _decode_dictionary(reader, column["dictionary"])
+        if not copy:
+            # Коды остаются представлением буфера, строки создаются только для словаря
+            return pd.Categorical.from_codes(codes, categories=pd.Index(values, dtype=object))
+        dictionary = np.empty(len(values) + 1, dtype=object)
+        dictionary[:-1] = values
+        dictionary[-1] = missing
+        # Код -1 указывает на последний элемент словаря - значение пропуска
+        result[:] = dictionary[codes]
+    elif kind == "date":
+        if "codes" in column:
+            # Код -1 указывает на последний день - пропуск
+            codes = reader.array(column["codes"], column["codes_dtype"])
+            unique_days = np.append(reader.array(column["days"], np.int32), np.int32(_MISSING_DAY))
+        else:
+            # Снимок прежней раскладки: дни для каждой строки
+            unique_days, codes = np.unique(reader.array(column["data"], np.int32), return_inverse=True)
+        # Объекты date создаются только для уникальных дней и разделяются строками
+        dates = unique_days.astype("datetime64[D]").astype(object)
+        dates[unique_days == _MISSING_DAY] = missing
+        result[:] = dates[codes]
+    elif kind == "dict":
+        keys = column["keys"]
+        int_keys = set(column["int_keys"])
+        matrix = reader.array(column["data"], np.float64).reshape(rows, len(keys))
+        present = reader.array(column["present"], np.bool_).reshape(rows, len(keys))
+        is_row = reader.array(column["rows"], np.bool_)
+        if present.all() and not int_keys:
+            records = [dict(zip(keys, row)) for row in matrix.tolist()]
+        else:
+            records = []
+            for row, mask in zip(matrix.tolist(), present.tolist()):
+                records.append({
+                    key: (int(value) if key in int_keys and value.is_integer() else value)
+                    for key, value, flag in zip(keys, row, mask) if flag
+                })
+        result[:] = records
+        if not is_row.all():
+            result[~is_row] = missing
+    else:
+        result[:] = [json.loads(text) for text in reader.texts(column["data"])]
+    return result
+
+
+def decode_snapshot(data: Union[bytes, memoryview], copy: bool = True) -> pd.DataFrame:
+    """
+    Восстанавливает датафрейм из колоночного снимка
+    
+    copy=False оставляет числовые колонки представлениями буфера снимка
+    (только для чтения), а строки возвращает категориальными колонками над кодами
+    из буфера. Так с отображенным в память файлом можно работать, не создавая
+    строку на каждую строку каталога. Даты остаются object-колонками (объекты
+    date разделяются строками), чтобы их можно было сравнивать с датами.
+    """
+    header, body_offset = read_header(data)
+    body = memoryview(data)[body_offset:]
+    if zlib.crc32(body) != header["checksum"]:
+        raise SnapshotError("Контрольная сумма снимка не совпадает")
+
+    codec = header["codec"]
+    if codec == "zlib":
+        body = zlib.decompress(body)
+    elif codec == "lzma":
+        body = lzma.decompress(body)
+    elif codec != "none":
+        raise SnapshotError(f"Неизвестный кодек снимка: {codec}")
+
+    reader = _BodyReader(body)
+    rows = header["rows"]
+    columns = {column["name"]: _decode_column(reader, column, rows, copy) for column in header["columns"]}
+    index = None
+    if "index" in header:
+        index = pd.Index(reader.array(header["index"]["data"], header["index"]["dtype"]))
+    return pd.DataFrame(columns, index=index, copy=False)
+
+
+def write_snapshot_file(path: Path, df: pd.DataFrame, meta: Optional[Dict[str, Any]] = None):
+    """Атомарно записывает несжатый снимок в файл для отображения в память"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as fh:
+        fh.write(encode_snapshot(df, "none", meta))
+    os.replace(tmp_path, path)
+
+
+def snapshot_stamp(path: Path) -> Optional[Tuple[int, int, int]]:
+    """
+    Отметка файла снимка: (inode, время изменения, размер); None - файла нет
+
+    Снимок заменяется целиком через os.replace, поэтому каждая запись дает новую отметку.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def map_snapshot_file(path: Path) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Отображает файл снимка в память только для чтения
+    
+    Числовые колонки и коды строковых колонок остаются представлениями страниц файла,
+    поэтому процессы, отобразившие один и тот же файл, разделяют одну копию этих
+    данных через страничный кэш ОС. Собственными у процесса остаются только
+    словари строковых колонок (по объекту на уникальное значение).
+    Возвращает (датафрейм, заголовок).
+    """
+    with open(path, "rb") as fh:
+        mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    header, _ = read_header(mapped)
+    if header["codec"] != "none":
+        raise SnapshotError("Отображать в память можно только несжатый снимок")
+    return decode_snapshot(mapped, copy=False), header
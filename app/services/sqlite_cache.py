@@ -3,13 +3,19 @@ SQLite кэш для сохранения данных между запуска
 """
 import sqlite3
 import pandas as pd
-import pickle
 import hashlib
 from pathlib import Path
 from typing import Optional
 from datetime import datetime
 import os
 
+from app.services.snapshot import SNAPSHOT_CODECS, encode_snapshot, decode_snapshot, is_snapshot
+
+
+# Версия набора колонок каталога: входит в ключ кэша, поэтому кэш со старой
+# структурой не считается актуальным и пересобирается
+CATALOG_SCHEMA_VERSION = 2
+
 
 class SQLiteCache:
     """Кэш данных в SQLite для быстрого доступа"""
@@ -18,6 +24,10 @@ class SQLiteCache:
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(exist_ok=True)
         self.db_path = self.cache_dir / "data_cache.db"
+        # Кодек сжатия колоночного снимка: none (по умолчанию), zlib или lzma
+        self.codec = os.getenv("SNAPSHOT_CODEC", "none")
+        if self.codec not in SNAPSHOT_CODECS:
+            self.codec = "none"
         self._init_db()
     
     def _init_db(self):
@@ -47,7 +57,7 @@ class SQLiteCache:
         conn.commit()
         conn.close()
     
-    def _get_data_hash(self, data_dir: Path) -> str:
+    def get_data_hash(self, data_dir: Path) -> str:
         """Вычисляет хэш всех Excel файлов для проверки изменений"""
         excel_files = sorted(data_dir.glob("*.xlsx"))
         if not excel_files:
@@ -62,14 +72,32 @@ class SQLiteCache:
             except:
                 pass
         
-        content = "|".join(file_info)
+        content = f"schema={CATALOG_SCHEMA_VERSION}|" + "|".join(file_info)
         return hashlib.md5(content.encode()).hexdigest()
     
-    def get_cached_data(self, data_dir: Path) -> Optional[pd.DataFrame]:
-        """Получает закэшированные данные"""
+    def is_current(self, data_dir: Path) -> bool:
+        """Проверяет, есть ли кэш, соответствующий текущему набору файлов"""
+        try:
+            cache_key = f"products_{self.get_data_hash(data_dir)}"
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM data_cache WHERE key = ?", (cache_key,))
+            result = cursor.fetchone()
+            conn.close()
+            return result is not None
+        except Exception:
+            return False
+    
+    def get_cached_data(self, data_dir: Path, exact: bool = False) -> Optional[pd.DataFrame]:
+        """
+        Получает закэшированные данные
+        
+        exact=True - только кэш, соответствующий текущему набору файлов;
+        иначе при отсутствии точного совпадения возвращается последний кэш.
+        """
         try:
             # Сначала пробуем найти кэш по хэшу текущих файлов
-            data_hash = self._get_data_hash(data_dir)
+            data_hash = self.get_data_hash(data_dir)
             cache_key = f"products_{data_hash}"
             
             conn = sqlite3.connect(self.db_path)
@@ -83,7 +111,7 @@ class SQLiteCache:
             result = cursor.fetchone()
             
             # Если не нашли по точному хэшу, берем последний кэш
-            if not result:
+            if not result and not exact:
                 cursor.execute("""
                     SELECT data FROM data_cache 
                     ORDER BY updated_at DESC 
@@ -95,7 +123,11 @@ class SQLiteCache:
             
             if result:
                 data_bytes = result[0]
-                df = pickle.loads(data_bytes)
+                if not is_snapshot(data_bytes):
+                    # Кэш старого формата (pickle) не читаем: он будет пересобран
+                    print("⚠️ Кэш в устаревшем формате, требуется пересборка")
+                    return None
+                df = decode_snapshot(data_bytes)
                 print(f"✅ Данные загружены из кэша: {len(df)} товаров")
                 return df
             
@@ -107,10 +139,10 @@ class SQLiteCache:
     def save_data(self, data_dir: Path, df: pd.DataFrame):
         """Сохраняет данные в кэш"""
         try:
-            data_hash = self._get_data_hash(data_dir)
+            data_hash = self.get_data_hash(data_dir)
             cache_key = f"products_{data_hash}"
             
-            data_bytes = pickle.dumps(df)
+            data_bytes = encode_snapshot(df, self.codec)
             
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
@@ -140,11 +172,13 @@ class SQLiteCache:
             
             now = datetime.now().isoformat()
             
+            # Метаданные описывают текущий набор файлов: удаленные файлы не сохраняем
+            cursor.execute("DELETE FROM file_metadata")
             for filename, meta in metadata.items():
                 cursor.execute("""
                     INSERT OR REPLACE INTO file_metadata (filename, metadata, updated_at)
                     VALUES (?, ?, ?)
-                """, (filename, json.dumps(meta), now))
+                """, (filename, json.dumps(meta, default=str), now))
             
             conn.commit()
             conn.close()
@@ -0,0 +1,67 @@
+"""
+Выбор топ-K по готовым оценкам
+
+Ранжированные запросы (топ спроса, приоритет отсутствующих товаров, метрики
+ценообразования, анализ цен конкурентов) раньше сортировали все товары, чтобы
+взять первые limit. Здесь K лучших выбираются частичным разбиением
+(np.argpartition, O(n)), и сортируются только они и товары с той же оценкой,
+что у K-го.
+
+Для топа в каждой группе (категории, бренде) элементы один раз сортируются по
+группе и оценке, и из каждой группы берется начало.
+
+Порядок детерминирован: по убыванию оценки, при равенстве - по возрастанию номера
+(товары сводки идут в порядке ID). Поэтому первые K результатов не зависят от K:
+топ-10 всегда совпадает с началом топ-50. Пропуски (NaN) идут последними.
+"""
+import numpy as np
+
+
+def rank_order(scores: np.ndarray) -> np.ndarray:
+    """Номера всех элементов по убыванию оценки (при равенстве - по возрастанию номера)"""
+    scores = np.asarray(scores, dtype=np.float64)
+    keys = np.where(np.isnan(scores), -np.inf, scores)
+    return np.lexsort((np.arange(len(keys)), np.isnan(scores), -keys))
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Номера k элементов с наибольшей оценкой в порядке ранга
+
+    Результат совпадает с rank_order(scores)[:k], но полностью сортируются только
+    кандидаты: k лучших по argpartition и элементы с той же оценкой, что у k-го.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    count = len(scores)
+    if k <= 0 or count == 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= count:
+        return rank_order(scores)
+    keys = np.where(np.isnan(scores), -np.inf, scores)
+    # Оценка k-го элемента: все, кто не хуже нее, - кандидаты (включая равные k-му)
+    threshold = keys[np.argpartition(-keys, k - 1)[k - 1]]
+    candidates = np.flatnonzero(keys >= threshold)
+    order = rank_order(scores[candidates])[:k]
+    return candidates[order]
+
+
+def top_k_per_group(groups: np.ndarray, scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Номера k лучших элементов каждой группы за один проход
+
+    Элементы сортируются по (группа, оценка по убыванию, номер), из каждой группы
+    берется начало длины k. Результат упорядочен по номеру группы, внутри группы - по
+    рангу. Элементы без группы (номер -1) не учитываются.
+    """
+    groups = np.asarray(groups, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float64)
+    if k <= 0 or len(groups) == 0:
+        return np.empty(0, dtype=np.int64)
+    keys = np.where(np.isnan(scores), -np.inf, scores)
+    order = np.lexsort((np.arange(len(keys)), np.isnan(scores), -keys, groups))
+    order = order[groups[order] >= 0]
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]) if len(order) else order
+    sizes = np.diff(np.r_[starts, len(order)])
+    ranks = np.arange(len(order)) - np.repeat(starts, sizes)
+    return order[ranks < k]
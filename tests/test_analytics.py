@@ -33,6 +33,28 @@ def test_get_top_products_with_filters(client):
                 assert product["category_level_1"] == "Красота и здоровье"
 
 
+def test_get_top_products_per_group(client):
+    """Тест топ товаров в каждой категории и выгрузки в CSV"""
+    response = client.get("/api/analytics/demand/top-per-group?group_by=category&limit=3")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert isinstance(data, list)
+    for group in data:
+        assert 1 <= len(group["products"]) <= 3
+        assert [p["rank"] for p in group["products"]] == list(range(1, len(group["products"]) + 1))
+        counts = [p["favorites_count"] for p in group["products"]]
+        assert counts == sorted(counts, reverse=True)
+    
+    response = client.get("/api/analytics/export/demand/top-per-group?group_by=category&limit=3")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.text.splitlines()[0].startswith("group,product_id")
+    
+    # Выгрузка принимает те же пределы, что и JSON-эндпоинт
+    for url in ("/api/analytics/demand/top-per-group", "/api/analytics/export/demand/top-per-group"):
+        response = client.get(f"{url}?group_by=category&limit=101")
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
 def test_get_demand_trends(client):
     """Тест получения трендов спроса"""
     response = client.get("/api/analytics/demand/trends?group_by=category")
@@ -143,6 +165,16 @@ def test_get_pricing_metrics_with_filters(client):
     assert isinstance(data["metrics"], list)
 
 
+def test_get_pricing_rules(client):
+    """Тест получения правил ценообразования"""
+    response = client.get("/api/analytics/pricing-rules")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    for key in ("demand_tiers", "priority_weights", "pricing_recommendations", "price_recommendations"):
+        assert key in data
+    assert data["pricing_recommendations"][-1]["recommendation"]
+
+
 def test_analytics_invalid_parameters(client):
     """Тест невалидных параметров аналитики"""
     # Невалидный limit
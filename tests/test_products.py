@@ -121,6 +121,23 @@ def test_get_brands_with_category_filter(client):
             assert isinstance(data, list)
 
 
+def test_get_category_tree(client):
+    """Тест дерева категорий с числом товаров в узлах"""
+    response = client.get("/api/products/categories/tree?depth=1")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["level"] == 0
+    assert sum(child["row_count"] for child in data["children"]) <= data["row_count"]
+    if data["children"]:
+        category = data["children"][0]["name"]
+        response = client.get(f"/api/products/categories/tree?category_level_1={category}&depth=1")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["path"] == [category]
+    
+    response = client.get("/api/products/categories/tree?category_level_1=__missing__")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
 def test_products_invalid_pagination(client):
     """Тест невалидной пагинации"""
     # Отрицательный номер страницы
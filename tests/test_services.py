@@ -160,3 +160,894 @@ def test_analytics_service_out_of_stock_priority(analytics_service):
 
 
 
+
+
+def test_stream_engine_matches_pandas(loader):
+    """Тест совпадения потокового движка чтения Excel с pd.read_excel"""
+    file_path = Path(TEST_DATA_DIR) / "chto-dobavlyali-v-izbrannoe-v-noyabre-2020_2SSM2SO.xlsx"
+    pandas_df, pandas_meta = loader._load_single_file(file_path, engine="pandas")
+    stream_df, stream_meta = loader._load_single_file(file_path, engine="stream")
+    assert stream_meta == pandas_meta
+    assert stream_df.equals(pandas_df)
+
+
+def test_benchmark_engines_report(loader):
+    """Тест отчета о сравнении движков чтения Excel"""
+    file_path = Path(TEST_DATA_DIR) / "chto-dobavlyali-v-izbrannoe-v-noyabre-2020_2SSM2SO.xlsx"
+    report = loader.benchmark_engines([file_path])
+    assert len(report) == 1
+    item = report[0]
+    assert item['file'] == file_path.name
+    assert item['rows'] > 0
+    assert item['identical'] is True
+    assert item['stream_rows_per_sec'] > 0
+
+
+def test_process_ingest_mode_matches_thread_mode():
+    """Тест совпадения результатов загрузки в пуле процессов и в пуле потоков"""
+    file_path = Path(TEST_DATA_DIR) / "chto-dobavlyali-v-izbrannoe-v-noyabre-2020_2SSM2SO.xlsx"
+    results = {}
+    for mode in ("process", "thread"):
+        mode_loader = ExcelLoader(TEST_DATA_DIR)
+        mode_loader._ingest_mode = mode
+        loaded = list(mode_loader._iter_loaded_files([file_path]))
+        assert len(loaded) == 1
+        position, loaded_path, (df, metadata) = loaded[0]
+        assert position == 0
+        assert loaded_path == file_path
+        results[mode] = (df, metadata)
+    assert results["process"][0].equals(results["thread"][0])
+    assert results["process"][1] == results["thread"][1]
+
+
+def test_process_pool_sized_by_files_to_parse(tmp_path, monkeypatch):
+    """Тест загрузки в пуле процессов: файлы из sidecar не занимают процессы, без разбора пул не создается"""
+    import app.services.excel_loader as excel_loader_module
+    from app.services.sidecar_cache import SidecarCache
+
+    files = sorted(Path(TEST_DATA_DIR).glob("*.xlsx"), key=lambda path: path.stat().st_size)[:3]
+    pool_sizes = []
+    process_pool = excel_loader_module.ProcessPoolExecutor
+
+    def recording_pool(max_workers, **kwargs):
+        pool_sizes.append(max_workers)
+        return process_pool(max_workers=max_workers, **kwargs)
+
+    monkeypatch.setattr(excel_loader_module, "ProcessPoolExecutor", recording_pool)
+    pool_loader = ExcelLoader(TEST_DATA_DIR)
+    pool_loader._ingest_mode = "process"
+    pool_loader._ingest_workers = 4
+    pool_loader._sidecars = SidecarCache(str(tmp_path))
+    for file_path in files[1:]:
+        pool_loader._load_single_file(file_path, engine="stream")
+
+    # Теплый перезапуск: изменился один файл - один процесс
+    assert len(list(pool_loader._iter_loaded_files(files))) == len(files)
+    assert pool_sizes == [1]
+
+    # Все файлы в sidecar - пул не нужен
+    assert len(list(pool_loader._iter_loaded_files(files))) == len(files)
+    assert pool_sizes == [1]
+
+
+def test_sidecar_cache_roundtrip(loader, tmp_path):
+    """Тест восстановления данных файла из колоночного sidecar"""
+    from app.services.sidecar_cache import SidecarCache
+
+    file_path = Path(TEST_DATA_DIR) / "chto-dobavlyali-v-izbrannoe-v-noyabre-2020_2SSM2SO.xlsx"
+    sidecar_loader = ExcelLoader(TEST_DATA_DIR)
+    sidecar_loader._sidecars = SidecarCache(str(tmp_path))
+    assert sidecar_loader._sidecars.load(file_path) is None
+
+    parsed_df, parsed_meta = sidecar_loader._load_single_file(file_path, engine="stream")
+    assert sidecar_loader._sidecars.load(file_path) is not None
+    cached_df, cached_meta = sidecar_loader._load_single_file(file_path, engine="stream")
+    assert cached_meta == parsed_meta
+    assert cached_df.equals(parsed_df)
+
+
+def test_columnar_snapshot_roundtrip(loader):
+    """Тест колоночного снимка каталога: типы, пропуски, кодеки и контрольная сумма"""
+    import pandas as pd
+    from app.services.snapshot import encode_snapshot, decode_snapshot, SnapshotError
+
+    # Каталог из общего снимка хранит строки категориальными колонками
+    df = loader.load_all_data().head(5000)
+    df = df.astype({column: object for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)})
+    df.loc[df.index[0], 'brand'] = None
+    df = df.drop(index=df.index[1])
+    for codec in ("none", "zlib", "lzma"):
+        restored = decode_snapshot(encode_snapshot(df, codec))
+        assert restored.equals(df)
+        assert list(restored.dtypes) == list(df.dtypes)
+        assert restored.index.equals(df.index)
+
+    data = bytearray(encode_snapshot(df, "none"))
+    data[-1] ^= 0xFF
+    with pytest.raises(SnapshotError):
+        decode_snapshot(bytes(data))
+
+
+def test_shared_snapshot_memory_mapped(loader, tmp_path):
+    """Тест общего снимка: колонки отображаются из файла, изменение идет по копии"""
+    import pandas as pd
+    from app.services.snapshot import write_snapshot_file, map_snapshot_file
+
+    df = loader.load_all_data().head(5000).reset_index(drop=True)
+    path = tmp_path / "catalog.snap"
+    write_snapshot_file(path, df, {'data_hash': 'test'})
+    mapped_df, header = map_snapshot_file(path)
+    assert header['meta']['data_hash'] == 'test'
+    assert mapped_df.astype(object).equals(df.astype(object))
+    assert not mapped_df['favorites_count'].to_numpy().flags.writeable
+    # Строки - категориальные колонки над кодами из файла, без объекта на строку
+    for column in ('id', 'name', 'brand', 'category_level_1'):
+        assert isinstance(mapped_df[column].dtype, pd.CategoricalDtype)
+        assert not mapped_df[column].cat.codes.to_numpy().flags.writeable
+
+    shared_loader = ExcelLoader(TEST_DATA_DIR)
+    shared_loader._cache = mapped_df
+    writable_df = shared_loader.ensure_writable()
+    writable_df.loc[0, 'favorites_count'] = 1
+    assert mapped_df.loc[0, 'favorites_count'] == df.loc[0, 'favorites_count']
+
+
+def test_shared_snapshot_followed_by_other_workers(loader, tmp_path, monkeypatch):
+    """Тест общего снимка: изменения и очистка в одном воркере видны в другом"""
+    monkeypatch.setenv("CACHE_DIR", str(tmp_path))
+    df = loader.load_all_data().head(2000).reset_index(drop=True)
+    writer, reader = ExcelLoader(TEST_DATA_DIR), ExcelLoader(TEST_DATA_DIR)
+    writer._publish_shared_snapshot(df, {'test.xlsx': {'rows_count': len(df)}})
+    reader._adopt_shared_snapshot(reader._load_shared_snapshot(exact=False))
+    product_id = df['id'].iloc[0]
+
+    version = reader.catalog_version
+    assert writer.update_products(product_id, {'favorites_count': 777, 'name': 'Обновлен'}) > 0
+    # Опубликованная версия не обращается к диску: снимок отображается при catalog_version
+    assert reader.published_version == version
+    assert reader.catalog_version > version
+    assert reader.published_version == reader.catalog_version
+    rows = reader.get_snapshot().df.iloc[reader.find_product_positions(product_id)]
+    assert (rows['favorites_count'] == 777).all() and (rows['name'] == 'Обновлен').all()
+
+    assert reader.delete_products([product_id]) > 0
+    assert len(writer.find_product_positions(product_id)) == 0
+    assert len(writer.get_snapshot()) == len(df) - len(rows)
+
+    writer.clear_cache()
+    assert not (tmp_path / "catalog.snap").exists()
+    assert not reader.get_snapshot().ready
+
+
+def test_vectorized_product_ids_match_row_ids(loader):
+    """Тест векторной генерации ID: совпадает с построчным md5, ключи обратимы"""
+    from app.services.product_keys import build_product_ids, product_id_for, ids_to_keys, keys_to_ids
+
+    df = loader.load_all_data().head(5000)
+    ids = build_product_ids(df['name'], df['brand'], df['link'], rows_count=len(df))
+    expected = [product_id_for(n, b, l) for n, b, l in zip(df['name'], df['brand'], df['link'])]
+    assert list(ids) == expected
+    assert list(ids) == df['id'].tolist()
+
+    keys = ids_to_keys(ids)
+    assert keys.dtype.name == 'uint64'
+    assert list(keys_to_ids(keys)) == expected
+
+
+def test_id_index_tracks_cache_changes(loader):
+    """Тест индекса ID: поиск, добавление и удаление без сканирования колонки id"""
+    df = loader.load_all_data().head(3000).reset_index(drop=True)
+    crud_loader = ExcelLoader(TEST_DATA_DIR)
+    crud_loader._cache = df
+
+    product_id = df['id'].iloc[100]
+    expected = df.index[df['id'] == product_id].tolist()
+    assert crud_loader.find_product_positions(product_id).tolist() == expected
+    assert len(crud_loader.find_product_positions('missing')) == 0
+
+    new_row = df.iloc[[0]].assign(id='new_product_0001')
+    crud_loader.append_products(new_row)
+    assert crud_loader.find_product_positions('new_product_0001').tolist() == [len(df)]
+
+    deleted = crud_loader.delete_products([product_id])
+    assert deleted == len(expected)
+    assert len(crud_loader.find_product_positions(product_id)) == 0
+    cache = crud_loader._cache
+    for check_id in (df['id'].iloc[0], df['id'].iloc[2999], 'new_product_0001'):
+        assert crud_loader.find_product_positions(check_id).tolist() == cache.index[cache['id'] == check_id].tolist()
+
+
+def test_enrichment_is_reproducible(loader):
+    """Тест векторного обогащения: одинаковое зерно дает одинаковый результат"""
+    from app.services.enrichment import enrich_catalog, COMPETITOR_PRICE_COLUMNS
+
+    base = loader.load_all_data().head(2000)[
+        ['id', 'name', 'brand', 'category_level_1', 'favorites_count', 'last_in_stock']
+    ].copy()
+    base.loc[base.index[::5], 'last_in_stock'] = None
+    first = enrich_catalog(base.copy(), seed=7)
+    second = enrich_catalog(base.copy(), seed=7)
+    other = enrich_catalog(base.copy(), seed=8)
+
+    assert first.equals(second)
+    assert not first['our_price'].equals(other['our_price'])
+    assert first['last_in_stock'].notna().all()
+    assert (first['days_out_of_stock'] >= 0).all()
+    assert first[list(COMPETITOR_PRICE_COLUMNS)].dtypes.eq('float32').all()
+
+
+def test_segment_enrichment_uses_per_file_streams(loader):
+    """Тест обогащения сегментов: у каждого файла свой поток, одинаковые строки разных файлов не совпадают"""
+    from app.services.enrichment import generate_missing_stock, generate_competitor_prices, COMPETITOR_PRICE_COLUMNS
+
+    base = loader.load_all_data().head(2000)[
+        ['id', 'name', 'brand', 'category_level_1', 'favorites_count', 'last_in_stock']
+    ].copy()
+    base['last_in_stock'] = None
+
+    def enrich(stream):
+        df = generate_missing_stock(base.copy(), seed=7, stream=stream)
+        return generate_competitor_prices(df, seed=7, stream=stream)
+
+    first, again, other = enrich("a.xlsx"), enrich("a.xlsx"), enrich("b.xlsx")
+    assert first.equals(again)
+    assert not first['last_in_stock'].equals(other['last_in_stock'])
+    prices = list(COMPETITOR_PRICE_COLUMNS)
+    assert (first[prices].to_numpy() != other[prices].to_numpy()).mean() > 0.9
+    # Без ключа потока - прежний поток полной сборки
+    assert not enrich(None)['our_price'].equals(first['our_price'])
+    assert enrich(None).equals(enrich(None))
+
+
+def test_competitor_price_analysis_whole_catalog(analytics_service):
+    """Тест векторного анализа цен: приоритет по всему каталогу и статистика по матрице цен"""
+    results = analytics_service.get_competitor_price_analysis(min_favorites=0, limit=20)
+    assert 0 < len(results) <= 20
+
+    demand_score = {'high': 3, 'medium': 2, 'low': 1}
+    priorities = [demand_score[r.demand_level] * 10 + abs(r.price_difference_percent) for r in results]
+    assert priorities == sorted(priorities, reverse=True)
+
+    for item in results:
+        prices = [c.price for c in item.competitor_prices]
+        assert len(prices) == 5
+        assert abs(item.min_competitor_price - min(prices)) < 0.01
+        assert abs(item.max_competitor_price - max(prices)) < 0.01
+        assert item.min_competitor_price <= item.avg_competitor_price <= item.max_competitor_price
+
+
+def test_competitor_prices_added_once_per_version(loader):
+    """Тест цен конкурентов для каталога без них: добавляются один раз на версию, а не на каждый запрос"""
+    from app.services.analytics_service import AnalyticsService, COMPETITOR_PRICES_KEY
+    from app.services.enrichment import COMPETITOR_PRICE_COLUMNS, has_competitor_prices
+
+    df = loader.load_all_data().head(3000).reset_index(drop=True)
+    df = df.drop(columns=['our_price', *COMPETITOR_PRICE_COLUMNS])
+    service = AnalyticsService(TEST_DATA_DIR)
+    service.loader = ExcelLoader(TEST_DATA_DIR)
+    service.loader._cache = df
+
+    first = service.get_competitor_price_analysis(min_favorites=0, limit=10)
+    snapshot = service.loader.get_snapshot()
+    enriched = snapshot.built(COMPETITOR_PRICES_KEY)
+    assert first and has_competitor_prices(enriched)
+    assert not has_competitor_prices(snapshot.df)
+
+    service.get_competitor_price_analysis(min_favorites=100, limit=5)
+    assert snapshot.built(COMPETITOR_PRICES_KEY) is enriched
+
+
+def test_segment_store_appends_and_compacts(loader):
+    """Тест сегментного хранилища: дозапись в буферы без копирования, неизменность прошлых версий и уплотнение"""
+    import numpy as np
+    import pandas as pd
+    from app.services.segment_store import SegmentStore
+
+    # Сегменты из Excel хранят строки объектами (в отличие от отображенного снимка)
+    df = loader.load_all_data().head(3000).reset_index(drop=True)
+    df = df.astype({column: object for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)})
+    parts = [df.iloc[i:i + 250] for i in range(0, len(df), 250)]
+    store = SegmentStore(growth_factor=2.0)
+
+    frames = []
+    reallocations = 0
+    for i, part in enumerate(parts):
+        frame = store.append(part)
+        assert len(store) == len(frame) == 250 * (i + 1)
+        if frames and not np.shares_memory(frame['favorites_count'].values,
+                                           frames[-1]['favorites_count'].values):
+            reallocations += 1
+        frames.append(frame)
+
+    # Емкость удваивается: перевыделений логарифмически мало
+    assert 0 < reallocations <= 4
+    # Прошлые версии не видят дописанных строк и не меняются
+    for frame in frames:
+        pd.testing.assert_frame_equal(frame, df.head(len(frame)))
+    with pytest.raises(ValueError):
+        frames[-1]['favorites_count'].values[0] = -1
+
+    compacted = store.compact()
+    pd.testing.assert_frame_equal(compacted, df)
+    assert store.compact() is None
+
+    # Сегмент с другими типами колонок объединяется по правилам pandas
+    other = df.head(10).copy()
+    other['favorites_count'] = other['favorites_count'].astype(float)
+    merged = store.append(other)
+    assert len(merged) == len(df) + 10
+    assert merged['favorites_count'].dtype == np.float64
+
+
+def test_catalog_versions_isolate_readers(loader):
+    """Тест версий каталога: изменения публикуются новой версией, прежняя остается неизменной"""
+    df = loader.load_all_data().head(2000).reset_index(drop=True)
+    crud_loader = ExcelLoader(TEST_DATA_DIR)
+    crud_loader._cache = df
+
+    before = crud_loader.get_snapshot()
+    product_id = df['id'].iloc[10]
+    old_favorites = before.df['favorites_count'].tolist()
+    assert crud_loader.update_products(product_id, {'favorites_count': 123456, 'name': 'Обновлен'}) > 0
+    assert crud_loader.update_products('missing', {'name': 'x'}) == 0
+
+    after = crud_loader.get_snapshot()
+    assert after.version == before.version + 1
+    assert before.df['favorites_count'].tolist() == old_favorites
+    positions = after.positions(product_id)
+    assert (after.df['favorites_count'].iloc[positions] == 123456).all()
+    assert (after.df['name'].iloc[positions] == 'Обновлен').all()
+
+    crud_loader.delete_products([product_id])
+    assert len(crud_loader.get_snapshot()) == len(before) - len(positions)
+    assert len(before.positions(product_id)) == len(positions)
+
+
+def test_readiness_wakes_sync_and_async_waiters(loader):
+    """Тест готовности: ожидающие просыпаются по событию окончания загрузки, без опроса"""
+    import asyncio
+    import threading
+
+    df = loader.load_all_data().head(100)
+    waiting_loader = ExcelLoader(TEST_DATA_DIR)
+    waiting_loader._cache = df
+    waiting_loader._loading = True
+    assert not waiting_loader.wait_until_ready(timeout=0.05)
+
+    def finish_loading():
+        with waiting_loader._load_lock:
+            waiting_loader._loading = False
+            waiting_loader._state_changed()
+
+    async def wait_async():
+        threading.Timer(0.1, finish_loading).start()
+        return await waiting_loader.wait_until_ready_async(timeout=10)
+
+    assert asyncio.run(wait_async())
+    assert waiting_loader.wait_until_ready(timeout=0)
+    assert waiting_loader._ready_waiters == []
+
+
+def test_compute_pools_bound_queue_and_report_metrics():
+    """Тест пулов вычислений: ограничение очереди (503) и метрики ожидания/выполнения"""
+    import asyncio
+    import threading
+    from app.services.compute import ComputeExecutor, ComputeQueueFull
+
+    executor = ComputeExecutor({'export': (1, 1), 'query': (2, 8)})
+    release = threading.Event()
+
+    async def scenario():
+        heavy = [asyncio.ensure_future(executor.run('export', release.wait, 5)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        # Пул export занят (1 выполняется + 1 в очереди): третья выгрузка отклоняется,
+        # а быстрые запросы в своем пуле выполняются без ожидания
+        with pytest.raises(ComputeQueueFull) as error:
+            await executor.run('export', sum, [1, 2])
+        assert error.value.status_code == 503
+        assert await executor.run('query', sum, [1, 2, 3]) == 6
+        release.set()
+        return await asyncio.gather(*heavy)
+
+    assert asyncio.run(scenario()) == [True, True]
+    metrics = executor.metrics()
+    assert metrics['export']['completed'] == 2
+    assert metrics['export']['rejected'] == 1
+    assert metrics['export']['queued'] == 0
+    assert metrics['query']['completed'] == 1
+    assert metrics['export']['queue_wait_ms']['max'] >= metrics['export']['queue_wait_ms']['p50']
+
+
+def test_compute_pool_releases_slot_of_cancelled_queued_request():
+    """Тест пулов вычислений: отмена запроса, ждущего в очереди, освобождает его место"""
+    import asyncio
+    import threading
+    from app.services.compute import ComputeExecutor
+
+    executor = ComputeExecutor({'export': (1, 2)})
+    release = threading.Event()
+
+    async def scenario():
+        running = asyncio.ensure_future(executor.run('export', release.wait, 5))
+        queued = asyncio.ensure_future(executor.run('export', sum, [1, 2]))
+        await asyncio.sleep(0.05)
+        # Клиент отключился, пока задача ждала в очереди
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        release.set()
+        assert await running is True
+        # Все места снова доступны: очередь не «протекла»
+        return await asyncio.gather(*(executor.run('export', sum, [i]) for i in range(3)))
+
+    assert asyncio.run(scenario()) == [0, 1, 2]
+    metrics = executor.metrics()['export']
+    assert metrics['running'] == 0
+    assert metrics['queued'] == 0
+    assert metrics['cancelled'] == 1
+    assert metrics['completed'] == 4
+
+
+def test_inverted_indexes_match_boolean_filters(product_service):
+    """Тест инвертированных индексов: тот же результат, что у цепочки булевых фильтров"""
+    from datetime import date as date_type
+
+    df = product_service.loader.load_all_data()
+    category = df['category_level_1'].value_counts().index[0]
+    brand = df.loc[df['category_level_1'] == category, 'brand'].value_counts().index[0]
+    filters = ProductFilter(category_level_1=category, brand=brand, period_start=date_type(2020, 1, 1))
+
+    expected = df[(df['category_level_1'] == category) & (df['brand'] == brand)]
+    expected = expected[expected['period_start'] >= date_type(2020, 1, 1)]
+    products, total = product_service.search_products(filters, page=1, page_size=20)
+    assert total == len(expected)
+    assert [p.id for p in products] == expected['id'].iloc[:20].tolist()
+
+    assert product_service.get_brands(category) == sorted(
+        str(b) for b in df.loc[df['category_level_1'] == category, 'brand'].dropna().unique()
+    )
+    assert product_service.get_categories() == sorted(str(c) for c in df['category_level_1'].dropna().unique())
+
+
+def test_sorted_indexes_resolve_ranges_and_order(product_service):
+    """Тест отсортированных индексов: диапазоны и порядок совпадают с фильтрами pandas"""
+    from datetime import date as date_type
+    import numpy as np
+    import pandas as pd
+    from app.services.catalog_index import SortedIndex
+
+    snapshot = product_service.loader.get_catalog()
+    df = snapshot.df
+
+    index = snapshot.sorted_index('favorites_count')
+    threshold = int(df['favorites_count'].median())
+    bounds = index.bounds(low=threshold)
+    assert index.count_for(bounds) == int((df['favorites_count'] >= threshold).sum())
+    assert np.array_equal(index.positions_for(bounds), np.flatnonzero(df['favorites_count'] >= threshold))
+
+    # Даты и пропуски: пропуски не попадают ни в один диапазон и идут в конце порядка
+    dates = pd.Series([date_type(2024, 1, 3), None, date_type(2024, 1, 1), date_type(2024, 1, 2)])
+    dates_index = SortedIndex(dates)
+    assert dates_index.slice(dates_index.bounds(high=date_type(2024, 1, 2))).tolist() == [2, 3]
+    assert dates_index.sort_positions(np.arange(4), descending=True).tolist() == [0, 3, 2, 1]
+
+    products = product_service.get_out_of_stock_products(min_days=30)
+    expected = df[df['days_out_of_stock'] >= 30].sort_values('favorites_count', ascending=False, kind='stable')
+    assert [p.id for p in products] == expected['id'].tolist()
+
+
+def test_bitmap_indexes_count_and_decode_pages(product_service):
+    """Тест битовых индексов: popcount и декодирование страницы совпадают с булевой маской"""
+    import numpy as np
+    from app.services.bitmap_index import filter_bitmap, popcount, decode_range, decode_all
+
+    snapshot = product_service.loader.get_catalog()
+    df = snapshot.df
+    category = df['category_level_1'].value_counts().index[0]
+    threshold = int(df['favorites_count'].quantile(0.3))
+
+    values = snapshot.bitmap_index('category_level_1')
+    ranges = snapshot.bitmap_index('favorites_count')
+    bitmap = filter_bitmap(len(df), [
+        (values, values.index.group_mask(category)),
+        (ranges, ranges.index.bounds(low=threshold)),
+    ])
+    expected = np.flatnonzero((df['category_level_1'] == category) & (df['favorites_count'] >= threshold))
+
+    assert popcount(bitmap) == len(expected)
+    assert np.array_equal(decode_all(bitmap), expected)
+    assert np.array_equal(decode_range(bitmap, 100, 150), expected[100:150])
+    assert len(decode_range(bitmap, len(expected), len(expected) + 50)) == 0
+
+    products, total = product_service.search_products(
+        ProductFilter(category_level_1=category, min_favorites_count=threshold), page=3, page_size=20)
+    assert total == len(expected)
+    assert [p.id for p in products] == df['id'].iloc[expected[40:60]].tolist()
+
+
+def test_query_planner_orders_by_selectivity(product_service):
+    """Тест планировщика: стратегия по избирательности, результат как у булевых фильтров"""
+    import numpy as np
+    from app.services.query_planner import QueryPlanner, predicates_from_filter
+
+    snapshot = product_service.loader.get_catalog()
+    df = snapshot.df
+    planner = QueryPlanner(snapshot)
+    top_brand = df['brand'].value_counts().index[0]
+    rare_favorites = int(df['favorites_count'].quantile(0.999))
+
+    # Узкое условие - позиции по индексу, остальные условия - одной маской
+    filters = ProductFilter(brand=top_brand, min_favorites_count=rare_favorites)
+    plan = planner.plan(predicates_from_filter(filters))
+    assert plan.strategy == 'index'
+    assert [step.estimated_rows for step in plan.steps] == sorted(step.estimated_rows for step in plan.steps)
+    result = planner.execute(plan)
+    expected = np.flatnonzero((df['brand'] == top_brand) & (df['favorites_count'] >= rare_favorites))
+    assert np.array_equal(result.positions(), expected)
+    assert plan.explain()['actual_rows'] == len(expected)
+    assert plan.explain()['steps'][0]['access'] == 'index'
+
+    # Широкое условие - битсеты
+    wide = planner.run(predicates_from_filter(ProductFilter(min_favorites_count=0)))
+    assert wide.plan.strategy == 'bitmap'
+    assert wide.total == int((df['favorites_count'] >= 0).sum())
+
+    # Без условий - весь каталог без копии
+    everything = planner.run([])
+    assert everything.plan.strategy == 'scan' and everything.frame() is df
+
+
+def test_result_cache_keys_by_catalog_version(analytics_service):
+    """Тест кэша результатов: повторный запрос из кэша, новая версия каталога - пересчет"""
+    from app.services.result_cache import ResultCache, get_result_cache
+
+    cache = get_result_cache()
+    loader = analytics_service.loader
+    loader.load_all_data()
+
+    before = cache.metrics()
+    first = analytics_service.get_top_products_by_demand(limit=5)
+    second = analytics_service.get_top_products_by_demand(limit=5)
+    after = cache.metrics()
+    assert second is first
+    assert after['hits'] - before['hits'] >= 1
+
+    # Изменение каталога публикует новую версию: старые записи удаляются
+    loader._cache = loader.get_catalog().df.copy()
+    assert cache.metrics()['invalidations'] > after['invalidations']
+    third = analytics_service.get_top_products_by_demand(limit=5)
+    assert third is not first
+    assert [item.product_id for item in third] == [item.product_id for item in first]
+
+    # LRU и TTL
+    small = ResultCache(max_entries=2, ttl_seconds=60)
+    for number in range(3):
+        small.put('method', (number,), 1, number)
+    assert small.metrics()['entries'] == 2 and small.metrics()['evictions'] == 1
+    assert small.get('method', (2,), 1) == 2
+    expired = ResultCache(max_entries=2, ttl_seconds=1e-9)
+    expired.put('method', (), 1, 'value')
+    assert expired.get('method', (), 1) != 'value'
+    assert expired.metrics()['expirations'] == 1
+
+
+def test_single_flight_shares_one_computation():
+    """Тест single-flight: одинаковые одновременные запросы ждут одно вычисление"""
+    import asyncio
+    import threading
+    from app.services.single_flight import SingleFlight
+
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'rows': 42}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('query', compute)))
+    leader.start()
+    assert started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('query', compute))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flight.metrics()['shared'] < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(results) == 4 and all(result is results[0] for result in results)
+    assert flight.metrics() == {'in_flight': 0, 'leaders': 1, 'shared': 3, 'failed': 0}
+
+    # Async: ошибка ведущего получают все ожидающие
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise ValueError("boom")
+
+    async def run_all():
+        return await asyncio.gather(*[flight.run('export', failing) for _ in range(3)], return_exceptions=True)
+
+    errors = asyncio.run(run_all())
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert flight.metrics()['leaders'] == 2 and flight.metrics()['failed'] == 1
+
+
+def test_single_flight_leader_cancellation_does_not_fail_followers():
+    """Тест single-flight: отмена ведущего или ожидающего запроса не отменяет остальные"""
+    import asyncio
+    from app.services.single_flight import SingleFlight
+
+    flight = SingleFlight()
+    calls = []
+
+    async def scenario():
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def compute():
+            calls.append(1)
+            started.set()
+            await release.wait()
+            return 42
+
+        leader = asyncio.ensure_future(flight.run('export', compute))
+        await started.wait()
+        followers = [asyncio.ensure_future(flight.run('export', compute)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        # Клиент ведущего отключился, один из ожидающих - тоже
+        leader.cancel()
+        followers[0].cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        results = await asyncio.gather(leader, *followers, return_exceptions=True)
+
+        # Прерванное вычисление: ожидающие не получают отмену, а считают заново
+        async def interrupted():
+            calls.append(2)
+            await asyncio.sleep(0.05)
+            raise asyncio.CancelledError()
+
+        async def fresh():
+            return 7
+
+        first = asyncio.ensure_future(flight.run('query', interrupted))
+        await asyncio.sleep(0.01)
+        retried = await flight.run('query', fresh)
+        await asyncio.gather(first, return_exceptions=True)
+        return results, retried
+
+    results, retried = asyncio.run(scenario())
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert isinstance(results[1], asyncio.CancelledError)
+    assert results[2:] == [42, 42]
+    assert calls == [1, 2]
+    assert retried == 7
+    assert flight.metrics()['in_flight'] == 0
+
+
+def test_product_rollup_matches_groupby_and_updates_incrementally(loader):
+    """Тест сводки по товарам: совпадает с groupby и обновляется инкрементально при CRUD"""
+    import numpy as np
+    import pandas as pd
+    from app.services.catalog_snapshot import ROLLUP_KEY
+    from app.services.product_rollup import ProductRollup
+
+    df = loader.load_all_data().head(3000).reset_index(drop=True)
+    crud_loader = ExcelLoader(TEST_DATA_DIR)
+    crud_loader._cache = df
+    rollup = crud_loader.get_snapshot().rollup()
+
+    # Подвыборка строк - те же суммы, максимумы и первые значения, что у groupby
+    positions = np.flatnonzero(df['favorites_count'].to_numpy() >= df['favorites_count'].median())
+    expected = df.iloc[positions].groupby('id', observed=True).agg({
+        'name': 'first', 'favorites_count': 'sum', 'days_out_of_stock': 'max'
+    }).reset_index()
+    table = rollup.aggregate(df, positions)
+    assert table['id'].tolist() == expected['id'].tolist()
+    assert table['name'].tolist() == expected['name'].tolist()
+    assert table['favorites_count'].tolist() == expected['favorites_count'].tolist()
+    assert np.allclose(table['days_out_of_stock'], expected['days_out_of_stock'], equal_nan=True)
+
+    # После CRUD новая версия получает пересчитанную сводку, равную построенной заново
+    def assert_carried():
+        snapshot = crud_loader.get_snapshot()
+        carried = snapshot.built(ROLLUP_KEY)
+        assert carried is not None
+        pd.testing.assert_frame_equal(carried.table, ProductRollup(snapshot.df).table, check_dtype=False)
+
+    product_id = df['id'].iloc[10]
+    crud_loader.update_products(product_id, {'favorites_count': 123456})
+    assert_carried()
+    crud_loader.append_products(df.iloc[[0, 1]].assign(id=['new_product_0001', df['id'].iloc[20]]))
+    assert_carried()
+    crud_loader.delete_products([product_id, 'new_product_0001'])
+    assert_carried()
+
+
+def test_demand_cube_rollups_match_groupby(analytics_service):
+    """Тест куба спроса: свертки совпадают с группировкой строк, датафрейм версии не меняется"""
+    import pandas as pd
+    from app.services.demand_cube import DemandCube
+
+    snapshot = analytics_service.loader.get_catalog()
+    df = snapshot.df.head(5000)
+    cube = DemandCube(df)
+    months = pd.to_datetime(df['period_start']).dt.to_period('M').dt.start_time
+
+    table = cube.rollup('category', 'month')
+    expected = df.assign(month=months).groupby(['category_level_1', 'month'], observed=True).agg(
+        favorites=('favorites_count', 'sum'), rows=('id', 'size'), products=('id', 'nunique')
+    ).reset_index()
+    table = table[table['group'].notna()]
+    assert table['group'].tolist() == expected['category_level_1'].tolist()
+    assert table['favorites_count'].tolist() == expected['favorites'].tolist()
+    assert table['rows'].tolist() == expected['rows'].tolist()
+    assert table['unique_products'].tolist() == expected['products'].tolist()
+
+    # Фильтр по категории и неделя: сумма по корзинам равна сумме строк
+    category = df['category_level_1'].iloc[0]
+    weekly = cube.rollup(None, 'week', category=category)
+    assert weekly['favorites_count'].sum() == df.loc[df['category_level_1'] == category, 'favorites_count'].sum()
+    assert (pd.to_datetime(weekly['bucket']).dt.weekday == 0).all()
+    assert len(cube.rollup('brand', 'day', category='missing')) == 0
+
+    columns = list(snapshot.df.columns)
+    trends = analytics_service.get_demand_trends(group_by="category")
+    series = analytics_service.get_time_series(group_by="brand", period="week")
+    assert trends and series
+    assert list(snapshot.df.columns) == columns
+
+
+def test_category_tree_aggregates_match_groupby(product_service):
+    """Тест дерева категорий: агрегаты узлов и позиции строк совпадают с группировкой"""
+    import numpy as np
+    from app.services.category_tree import CategoryTree, OUT_OF_STOCK_DAYS
+
+    df = product_service.loader.get_catalog().df.head(5000).reset_index(drop=True)
+    tree = CategoryTree(df)
+    assert tree.root.row_count == len(df)
+    assert sum(child.row_count for child in tree.root.children.values()) == len(df)
+
+    columns = ['category_level_1', 'category_level_2']
+    expected = df.groupby(columns, observed=True).agg(
+        rows=('id', 'size'), products=('id', 'nunique'), favorites=('favorites_count', 'sum')
+    )
+    for (level_1, level_2), row in expected.iterrows():
+        node = tree.find([level_1, level_2])
+        assert node is not None and node.level == 2
+        assert (node.row_count, node.product_count, node.favorites_count) == \
+            (row['rows'], row['products'], row['favorites'])
+        mask = (df['category_level_1'] == level_1) & (df['category_level_2'] == level_2)
+        assert np.array_equal(node.positions(), np.flatnonzero(mask))
+        missing = df.loc[mask & (df['days_out_of_stock'] >= OUT_OF_STOCK_DAYS), 'id'].nunique()
+        assert node.out_of_stock_count == missing
+    assert tree.find(['__missing__']) is None
+
+    # Сервис: поддерево до заданной глубины
+    level_1 = df['category_level_1'].iloc[0]
+    subtree = product_service.get_category_tree([level_1], depth=1)
+    assert subtree.path == [level_1]
+    assert subtree.children and all(not child.children for child in subtree.children)
+
+
+def test_top_k_selection_is_exact_and_limit_independent(analytics_service):
+    """Тест топ-K: частичный выбор совпадает с полной сортировкой, результат не зависит от limit"""
+    import numpy as np
+    from app.services.top_k import top_k, rank_order
+
+    rng = np.random.default_rng(7)
+    scores = rng.integers(0, 20, 500).astype(float)
+    scores[rng.random(500) < 0.05] = np.nan
+    for k in (0, 1, 10, 499, 600):
+        assert top_k(scores, k).tolist() == rank_order(scores)[:k].tolist()
+    assert rank_order(np.array([1.0, np.nan, 3.0, 1.0])).tolist() == [2, 0, 3, 1]
+
+    short = analytics_service.get_out_of_stock_with_priority(limit=5)
+    long = analytics_service.get_out_of_stock_with_priority(limit=40)
+    assert [p.product_id for p in short] == [p.product_id for p in long[:5]]
+    assert [p.priority_score for p in short] == [p.priority_score for p in long[:5]]
+    scores = [p.priority_score for p in long]
+    assert scores == sorted(scores, reverse=True)
+
+    short = analytics_service.get_pricing_metrics(limit=5)
+    long = analytics_service.get_pricing_metrics(limit=40)
+    assert [(p.product_id, p.demand_level) for p in short] == [(p.product_id, p.demand_level) for p in long[:5]]
+
+
+def test_top_products_per_group_match_filtered_top(analytics_service):
+    """Тест топа по группам: совпадает с топом по каждой категории/бренду отдельно"""
+    import numpy as np
+    from app.services.top_k import top_k_per_group
+
+    groups = np.array([1, 0, 1, -1, 0, 1, 0])
+    scores = np.array([5.0, 2.0, 5.0, 9.0, 7.0, 1.0, 2.0])
+    assert top_k_per_group(groups, scores, 2).tolist() == [4, 1, 0, 2]
+
+    by_category = analytics_service.get_top_products_per_group(group_by="category", limit=3)
+    assert [g.group for g in by_category] == sorted(g.group for g in by_category)
+    for group in by_category[:5]:
+        expected = analytics_service.get_top_products_by_demand(limit=3, category=group.group)
+        assert [p.model_dump() for p in group.products] == [p.model_dump() for p in expected]
+        assert group.total_products >= len(group.products)
+
+    by_brand = analytics_service.get_top_products_per_group(group_by="brand", limit=2)
+    for group in by_brand[:: max(1, len(by_brand) // 5)]:
+        expected = analytics_service.get_top_products_by_demand(limit=2, brand=group.group)
+        assert [p.product_id for p in group.products] == [p.product_id for p in expected]
+
+
+def test_pricing_rules_compile_and_reload_from_config(analytics_service, tmp_path):
+    """Тест правил ценообразования: векторные рекомендации и замена порогов через файл"""
+    import json
+    import numpy as np
+    from app.services.pricing_rules import PricingRules, RuleSet, reload_pricing_rules
+
+    rules = RuleSet([
+        {"when": [["demand_level", "==", "high"], ["days_out_of_stock", ">", 30]], "recommendation": "A"},
+        {"when": [["demand_level", "in", ["medium", "low"]]], "recommendation": "B"},
+        {"recommendation": "C"},
+    ])
+    columns = {
+        'demand_level': np.array(['high', 'high', 'low'], dtype=object),
+        'days_out_of_stock': np.array([40.0, 10.0, np.nan]),
+    }
+    assert rules.apply(columns).tolist() == ['A', 'C', 'B']
+    with pytest.raises(ValueError):
+        RuleSet([{"when": [["days_out_of_stock", "~", 1]], "recommendation": "x"}])
+
+    levels, scores = PricingRules().demand_tiers(np.arange(100))
+    assert (levels == 'high').sum() == 25 and scores.max() == 3
+
+    # Пороги из файла: все товары - «low», рекомендации по дням отсутствия
+    config = {
+        "demand_tiers": [{"level": "high", "quantile": 1.0, "score": 3}, {"level": "low", "score": 1}],
+        "pricing_recommendations": [
+            {"when": [["days_out_of_stock", ">=", 0]], "recommendation": "Проверить"},
+            {"recommendation": "Нет данных"}
+        ]
+    }
+    path = tmp_path / "pricing_rules.json"
+    path.write_text(json.dumps(config, ensure_ascii=False), encoding="utf-8")
+    try:
+        reload_pricing_rules(str(path))
+        metrics = analytics_service.get_pricing_metrics(limit=20)
+        assert metrics
+        assert all(m.recommendation == "Проверить" for m in metrics)
+        assert {m.demand_level for m in metrics} <= {"high", "low"}
+    finally:
+        reload_pricing_rules()
+    metrics = analytics_service.get_pricing_metrics(limit=20)
+    assert all(m.recommendation != "Проверить" for m in metrics)
+
+
+def test_pricing_rules_follow_file_changes(analytics_service, tmp_path):
+    """Тест правил ценообразования: изменение файла (например, другим воркером) подхватывается без reload"""
+    import json
+    from app.services.pricing_rules import reload_pricing_rules
+
+    def write_rules(recommendation, stamp_ns):
+        config = {"pricing_recommendations": [{"recommendation": recommendation}]}
+        path.write_text(json.dumps(config, ensure_ascii=False), encoding="utf-8")
+        os.utime(path, ns=(stamp_ns, stamp_ns))
+
+    path = tmp_path / "pricing_rules.json"
+    write_rules("Первое", 1_000_000_000)
+    try:
+        reload_pricing_rules(str(path))
+        assert {m.recommendation for m in analytics_service.get_pricing_metrics(limit=10)} == {"Первое"}
+
+        # Тот же запрос попал бы в кэш результатов, но файл изменился
+        write_rules("Второе", 2_000_000_000)
+        assert {m.recommendation for m in analytics_service.get_pricing_metrics(limit=10)} == {"Второе"}
+
+        # Ошибка в файле: действуют прежние правила
+        path.write_text("[]", encoding="utf-8")
+        os.utime(path, ns=(3_000_000_000, 3_000_000_000))
+        assert {m.recommendation for m in analytics_service.get_pricing_metrics(limit=10)} == {"Второе"}
+    finally:
+        reload_pricing_rules()
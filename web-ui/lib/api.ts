@@ -196,16 +196,18 @@ export const api = {
     return response.data;
   },
 
-  // Статус загрузки данных
-  getStatus: async (): Promise<{
+  // Статус загрузки данных (wait - long-poll: ответ по готовности данных, но не позже wait секунд)
+  getStatus: async (wait?: number): Promise<{
     cache_ready: boolean;
+    ready?: boolean;
     loading: boolean;
     files_loaded: number;
     total_products: number;
+    catalog_version?: number;
     using_mock_data?: boolean;
     message?: string;
   }> => {
-    const response = await apiClient.get('/api/status');
+    const response = await apiClient.get('/api/status', { params: wait ? { wait } : undefined });
     return response.data;
   },
 
@@ -53,8 +53,10 @@ export function useTopProducts(params?: {
 export function useStatus() {
   return useQuery({
     queryKey: queryKeys.status(),
-    queryFn: () => api.getStatus(),
-    refetchInterval: 5000, // Обновлять каждые 5 секунд
+    // Long-poll: сервер отвечает, как только данные готовы (или через 10 секунд)
+    queryFn: () => api.getStatus(10),
+    // Пока идет загрузка - сразу следующий long-poll, после готовности - редкая проверка
+    refetchInterval: (query) => (query.state.data?.ready ? 60000 : 100),
     staleTime: 1000,
   });
 }